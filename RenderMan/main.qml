@@ -26,6 +26,7 @@
 
 import QtQuick 2.2
 import Painter 1.0
+import "renderman.js" as Renderman
 
 PainterPlugin
 {
@@ -43,6 +44,13 @@ PainterPlugin
 		// create a plugintoolbar button for releases after 2018.1.0
 		alg.ui.addWidgetToPluginToolBar("plugintoolbar.qml");
 		}
+	// start the export daemon now, so it is ready for the first export.
+	Renderman.startDaemon();
+	}
+
+	Component.onDestruction:
+	{
+		Renderman.stopDaemon();
 	}
 
 	onConfigure:
@@ -80,6 +80,113 @@ function isUDIMProject(document)
 }
 
 
+// The export daemon is a persistent python process serving export requests
+// on localhost. It keeps its modules and rules loaded and converts the maps
+// while they are exported. If it isn't running, we fall back to launching
+// the python script for each export.
+
+var DAEMON_PORT = 47817
+var SCRIPT = "rmanAssetsSubstancePainter.py"
+
+
+function pythonBin() {
+    if (Qt.platform.os == "windows")
+        return "python.exe"
+    return "python"
+}
+
+
+function daemonPort() {
+    var port = alg.settings.value("daemonPort")
+    if (port == undefined)
+        return DAEMON_PORT
+    return port
+}
+
+
+// The daemon writes a random token to a file only the user can read, and
+// rejects the requests that don't carry it.
+function daemonToken() {
+    var path = alg.plugin_root_directory + "/.daemon_" + daemonPort() + ".token"
+    try {
+        var tokenFile = alg.fileIO.open(path, "r")
+        var token = tokenFile.readAll()
+        tokenFile.close()
+        return token.trim()
+    } catch (err) {
+        return ""
+    }
+}
+
+
+// Send a json request to the export daemon. The callback gets the decoded
+// reply, or null if the daemon is not running or the request failed.
+function daemonRequest(method, path, data, callback) {
+    var xhr = new XMLHttpRequest()
+    xhr.onreadystatechange = function() {
+        if (xhr.readyState != XMLHttpRequest.DONE)
+            return
+        var reply = null
+        try {
+            reply = JSON.parse(xhr.responseText)
+        } catch (err) {
+            reply = null
+        }
+        if (reply != null) {
+            for (var i in reply.log)
+                alg.log.info("RenderMan:          " + reply.log[i])
+            if (xhr.status != 200) {
+                alg.log.error("RenderMan: daemon error: " + reply.error)
+                reply = null
+            }
+        }
+        callback(reply)
+    }
+    xhr.open(method, "http://127.0.0.1:" + daemonPort() + path)
+    xhr.setRequestHeader("Content-Type", "application/json")
+    xhr.setRequestHeader("X-RfSP-Token", daemonToken())
+    xhr.send(data == null ? "" : JSON.stringify(data))
+}
+
+
+function startDaemon() {
+    if (alg.settings.value("useDaemon") === false)
+        return
+    if (typeof alg.subprocess.startDetached != "function")
+        return
+    daemonRequest("GET", "/ping", null, function(reply) {
+        if (reply == null) {
+            alg.log.info("RenderMan: Starting the export daemon...")
+            alg.subprocess.startDetached(
+                [pythonBin(), SCRIPT, "--daemon", String(daemonPort())])
+        }
+    })
+}
+
+
+function stopDaemon() {
+    daemonRequest("POST", "/quit", null, function(reply) {})
+}
+
+
+function exportMap(map) {
+    var t0 = new Date().getTime()
+    if (map.channel == "normal")
+    {
+        // Make sure the normals are correctly configured to combine
+        // mesh + height + normal.
+        alg.mapexport.saveConvertedMap([map.material], "normal_directx", map.output)
+    }
+    else
+    {
+        // regular map export
+        alg.mapexport.save([map.material, map.channel], map.output)
+    }
+    var t1 = new Date().getTime()
+    alg.log.info("RenderMan:   |_ Exported in " + ((t1-t0)/1000.0).toFixed(2) + " sec.: " + map.output)
+}
+
+
 // FIXME: the bxdf param is currently ignored.
 
 function exportAssets(bxdf) {
@@ -101,29 +208,18 @@ function exportAssets(bxdf) {
     // Some useful variables
     //
     var sep = "/"
-    var pyBin = "python"
     var winOS = (Qt.platform.os == "windows")
     if (winOS) {
         sep = "\\"
-        pyBin += ".exe"
     }
     var ext = ".png"
-    var script = "rmanAssetsSubstancePainter.py"
     var exportPath = ""
-    var jsonFilePath = ""
-    var tab = "    "
-    var tab2 = tab + tab
-    var tab3 = tab2 + tab
-    var tab4 = tab3 + tab
 
     // Query export path
     //
     exportPath = osPath(alg.mapexport.exportPath())
     exportPath += sep + "RenderMan" + sep
-    jsonFilePath = exportPath + "RmanExport.json"
 
-    // Export masks
-    //
     var matIdx = 0
     var channelIdx = 0
     var document = alg.mapexport.documentStructure()
@@ -133,31 +229,24 @@ function exportAssets(bxdf) {
 
     // store env vars
     //
-    var obj = {
+    var settings = {
         scene: scene_name,
         sp_version: alg.version.painter,
-        RMANTREE: jsonPath(alg.settings.value("RMANTREE")),
-        RMSTREE: jsonPath(alg.settings.value("RMSTREE")),
+        RMANTREE: alg.settings.value("RMANTREE"),
+        RMSTREE: alg.settings.value("RMSTREE"),
         bxdf: bxdf,
         udim: isUDIM,
-        saveTo: jsonPath(alg.settings.value("saveTo")),
-        document: []
+        saveTo: alg.settings.value("saveTo"),
+        exportPath: exportPath
     }
 
-    // Parse all materials (texture sets)
+    // List the maps of all materials (texture sets)
     //
-    var mobj = null
+    var maps = []
     for (matIdx = 0; matIdx < document.materials.length; matIdx++)
     {
         var material = document.materials[matIdx].name
-        if (!isUDIM || matIdx == 0)
-        {
-            mobj = {
-                textureSet: isUDIM ? "UDIM" : material,
-                resolution: alg.mapexport.textureSetResolution(material),
-                channels: {}
-            }
-        }
+        var resolution = alg.mapexport.textureSetResolution(material)
 
         var numChannels = document.materials[matIdx].stacks[0].channels.length
         for (channelIdx = 0; channelIdx < numChannels; channelIdx++)
@@ -178,32 +267,103 @@ function exportAssets(bxdf) {
             else
                 output += material + "_" + thisChannel + ext
 
-            var t0 = new Date().getTime()
-            if (thisChannel == "normal")
-            {
-                // Make sure the normals are correctly configured to combine
-                // mesh + height + normal.
-                alg.mapexport.saveConvertedMap([material], "normal_directx", output)
-            }
-            else
-            {
-                // regular map export
-                alg.mapexport.save([material, thisChannel], output)
-            }
-            var t1 = new Date().getTime()
-            alg.log.info("RenderMan:   |_ Exported in " + ((t1-t0)/1000.0).toFixed(2) + " sec.: " + output)
+            maps.push({
+                material: material,
+                textureSet: isUDIM ? "UDIM" : material,
+                resolution: resolution,
+                channel: thisChannel,
+                output: output
+            })
+        }
+    }
 
-            try {
-                mobj.channels[thisChannel].push(jsonPath(output))
-            } catch (error) {
-                mobj.channels[thisChannel] = [jsonPath(output)]
+    daemonRequest("GET", "/ping", null, function(reply) {
+        if (reply == null)
+            exportWithScript(settings, maps)
+        else
+            exportWithDaemon(settings, maps)
+    })
+}
+
+
+// Stream the maps to the daemon as soon as they are exported: it converts
+// them while we export the next ones.
+function exportWithDaemon(settings, maps) {
+    alg.log.info("RenderMan: Exporting with the export daemon...")
+    daemonRequest("POST", "/jobs", settings, function(reply) {
+        if (reply == null) {
+            exportWithScript(settings, maps)
+            return
+        }
+        var job = "/jobs/" + reply.job
+        var next = function(idx) {
+            if (idx == maps.length) {
+                daemonRequest("POST", job + "/end", {}, function(reply) {
+                    if (reply == null)
+                        alg.log.error("RenderMan: Export failed !")
+                    else
+                        alg.log.info("RenderMan: Export successful ! :)")
+                })
+                return
+            }
+            var map = maps[idx]
+            exportMap(map)
+            var data = {
+                textureSet: map.textureSet,
+                resolution: map.resolution,
+                channel: map.channel,
+                path: map.output
             }
+            daemonRequest("POST", job + "/maps", data, function(reply) {
+                if (reply == null) {
+                    alg.log.warn("RenderMan: The export daemon failed: retrying without it.")
+                    // drop the job, so the daemon doesn't keep its workers.
+                    daemonRequest("POST", job + "/abort", {}, function(reply) {})
+                    exportWithScript(settings, maps)
+                    return
+                }
+                next(idx + 1)
+            })
         }
+        next(0)
+    })
+}
+
+
+function exportWithScript(settings, maps) {
+    var jsonFilePath = settings.exportPath + "RmanExport.json"
+    var obj = {
+        scene: settings.scene,
+        sp_version: settings.sp_version,
+        RMANTREE: jsonPath(settings.RMANTREE),
+        RMSTREE: jsonPath(settings.RMSTREE),
+        bxdf: settings.bxdf,
+        udim: settings.udim,
+        saveTo: jsonPath(settings.saveTo),
+        document: []
+    }
 
-        if (!isUDIM || matIdx == 0)
+    // Export maps
+    //
+    var mobj = null
+    for (var i = 0; i < maps.length; i++)
+    {
+        var map = maps[i]
+        if (mobj == null || mobj.textureSet != map.textureSet)
         {
+            mobj = {
+                textureSet: map.textureSet,
+                resolution: map.resolution,
+                channels: {}
+            }
             obj.document.push(mobj)
         }
+        exportMap(map)
+        try {
+            mobj.channels[map.channel].push(jsonPath(map.output))
+        } catch (error) {
+            mobj.channels[map.channel] = [jsonPath(map.output)]
+        }
     }
 
     // Write json file and export
@@ -222,11 +382,11 @@ function exportAssets(bxdf) {
         // FIXME: we should probably just catch exceptions and print the log
         // on error.
         //
-        alg.log.info("RenderMan: Launching " + script + "...")
+        alg.log.info("RenderMan: Launching " + SCRIPT + "...")
         try
         {
             var fpath = "\"" + jsonFilePath + "\""
-            var result = alg.subprocess.check_output([pyBin, script, fpath])
+            var result = alg.subprocess.check_output([pythonBin(), SCRIPT, fpath])
             var lines = result.split(/[\r\n]+/g)
             for (var i in lines)
             {
@@ -1,5 +1,14 @@
 """python 2.7 plugin for substance painter 2.3+
 Export substance painter maps to a RenderMan Asset package.
+
+Usage:
+    rmanAssetsSubstancePainter.py <RmanExport.json>
+        export the maps described by the json file.
+    rmanAssetsSubstancePainter.py --daemon <port>
+        run a local export server, which keeps the modules and rules loaded
+        between exports and converts the maps while they are exported. The
+        requests must carry the token written to .daemon_<port>.token, in
+        this directory.
 """
 # -----------------------------------------------------------------------------
 #  MIT License
@@ -36,20 +45,31 @@ import shutil
 import logging
 import getpass
 import subprocess
+import collections
+import threading
+import time
+import hmac
+import binascii
+try:
+    import Queue as queue
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    import queue
+    from http.server import HTTPServer, BaseHTTPRequestHandler
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 LOGFILE = os.path.join(THIS_DIR, 'rfsp_log.txt')
-logging.basicConfig(filename=LOGFILE,
-                    filemode='w',
-                    level=logging.DEBUG,
-                    format='%(levelname)-10s %(message)s')
-DBUG = logging.debug
-INFO = logging.info
-WARN = logging.warning
-ERR = logging.error
-XCPT = logging.exception
+LOGGER = logging.getLogger('rfsp')
+DBUG = LOGGER.debug
+INFO = LOGGER.info
+WARN = LOGGER.warning
+ERR = LOGGER.error
+XCPT = LOGGER.exception
 IMG_EXTS = ['.png', '.jpg', '.exr']
 TEX_EXTS = ['.tex', '.tx', '.txr']
+RULES_FILE = os.path.join(THIS_DIR, 'rules.json')
+DAEMON_IDLE = 3600.0
+DAEMON_TOKEN = os.path.join(THIS_DIR, '.daemon_%d.token')
 
 
 class FilePath(unicode):
@@ -126,6 +146,69 @@ class FilePath(unicode):
         """
         return os.access(self, os.W_OK | os.X_OK)
 
+
+class RingHandler(logging.Handler):
+    """Keeps the last records in memory and only writes them to the log file
+    when an error is logged. Records are not formatted until then.
+    """
+
+    def __init__(self, fpath, capacity=5000):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.fpath = fpath
+        self.records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+        if record.levelno >= logging.ERROR:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        try:
+            with open(self.fpath, 'a') as fhdl:
+                fhdl.write('-' * 79 + '\n')
+                while self.records:
+                    fhdl.write(self.format(self.records.popleft()) + '\n')
+        except (OSError, IOError):
+            self.records.clear()
+
+
+def setup_logging():
+    """Messages at or above RFSP_LOG_LEVEL (default: INFO) are printed to
+    stdout, so they show up in Substance Painter's log. Debug messages are
+    kept in a ring buffer, which is flushed to rfsp_log.txt on error.
+    """
+    level = getattr(logging, os.environ.get('RFSP_LOG_LEVEL', 'INFO').upper(),
+                    logging.INFO)
+    fmt = logging.Formatter('%(levelname)-10s %(message)s')
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(level)
+    console.setFormatter(fmt)
+    ring = RingHandler(LOGFILE)
+    ring.setFormatter(fmt)
+    LOGGER.addHandler(console)
+    LOGGER.addHandler(ring)
+    LOGGER.setLevel(logging.DEBUG)
+    return console
+
+
+class ReplyHandler(logging.Handler):
+    """Collects the messages of the daemon's current request, so they can be
+    sent back to Substance Painter with the reply."""
+
+    def __init__(self, level):
+        logging.Handler.__init__(self, level)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+    def pop(self):
+        lines, self.lines = self.lines, []
+        return lines
+
+
 # functions -------------------------------------------------------------------
 
 def readJson(fpath):
@@ -175,6 +258,50 @@ def setup_environment(jsonDict):
     return rman_version
 
 
+RMAN_MODULES = {}
+RULES = {'mtime': None, 'data': None}
+
+
+def import_rman_assets(settings):
+    """Import rmanAssets once per process, so the daemon only pays for it
+    on the first export.
+
+    Returns:
+        tuple -- (rmanAssets module, rman_version)
+    """
+    key = settings['RMANTREE']
+    if key not in RMAN_MODULES:
+        if RMAN_MODULES:
+            WARN('RMANTREE changed: restart the daemon to use %s', key)
+            return list(RMAN_MODULES.values())[0]
+        rman_version = setup_environment(settings)
+        if int(rman_version) >= 22:
+            import rmanAssets.core as ra         # pylint: disable=import-error
+        else:
+            import rfm.rmanAssets as ra     # pylint: disable=import-error
+        RMAN_MODULES[key] = (ra, rman_version)
+        DBUG('OK: imported rmanAssets')
+    return RMAN_MODULES[key]
+
+
+def load_rules():
+    """Returns the rules, only reading rules.json again if it changed."""
+    mtime = os.path.getmtime(RULES_FILE)
+    if RULES['mtime'] != mtime:
+        RULES['data'] = readJson(RULES_FILE)
+        RULES['mtime'] = mtime
+        DBUG('OK: rules read')
+    return RULES['data']
+
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
 def set_params(settings_dict, chan, node_name, asset):
     # The bxdf may need specific settings to match Substance Painter
     try:
@@ -226,8 +353,7 @@ def app(name):
     return name
 
 
-def txmake(is_udim, asset_path, fpath_list):
-
+def txmake_cmd(is_udim):
     rmantree = FilePath(os.environ['RMANTREE'])
     binary = rmantree.join('bin', app('txmake')).osPath()
     cmd = [binary]
@@ -236,108 +362,151 @@ def txmake(is_udim, asset_path, fpath_list):
                 '-mode', 'clamp',
                 '-format', 'pixar',
                 '-compression', 'lossless',
-                '-newer',
-                'src', 'dst']
+                '-newer']
     else:
         cmd += ['-resize', 'round-',
                 '-mode', 'periodic',
                 '-format', 'pixar',
                 '-compression', 'lossless',
-                '-newer',
-                'src', 'dst']
-    for img in fpath_list:
-        cmd[-2] = FilePath(img).osPath()
-        dirname, filename = os.path.split(img)
-        texfile = os.path.splitext(filename)[0] + '.tex'
-        cmd[-1] = asset_path.join(texfile).osPath()
-        DBUG('       |_ txmake : %s -> %s', cmd[-2], cmd[-1])
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE,
-                             startupinfo=startupInfo())
-        p.wait()
-
-    # return a local path to the tex file.
+                '-newer']
+    return cmd
+
+
+def txmake(is_udim, asset_path, img):
+    """Convert a map to a texture in the asset directory."""
+    filename = os.path.basename(img)
+    texfile = os.path.splitext(filename)[0] + '.tex'
+    cmd = txmake_cmd(is_udim) + [FilePath(img).osPath(),
+                                 asset_path.join(texfile).osPath()]
+    DBUG('       |_ txmake : %s -> %s', cmd[-2], cmd[-1])
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE,
+                         startupinfo=startupInfo())
+    _, err = p.communicate()
+    if p.returncode:
+        ERR('txmake failed (%d): %s -> %s\n%s', p.returncode, cmd[-2],
+            cmd[-1], err)
+    elif err:
+        DBUG('       |_ txmake: %s', err)
+
+
+def tex_file(is_udim, fpath_list):
+    """return a local path to the tex file."""
     dirname, filename = os.path.split(fpath_list[0])
-    fname, fext = os.path.splitext(filename)
+    fname, _ = os.path.splitext(filename)
     asset_file_ref = FilePath(dirname).join(fname + '.tex')
     if is_udim:
         asset_file_ref = re.sub(r'1\d{3}', '_MAPID_', asset_file_ref)
     return asset_file_ref
 
 
-def export():
-    """Export a RenderManAsset package based on  a json file.
-    """
-    INFO('Start !')
-
-    if len(sys.argv) < 2:
-        ERR('expecting 2 arguments !')
-        raise Exception
+class Exporter(object):
+    """Builds the RenderMan assets of an export.
 
-    # get the input json file
-    jsonFile = FilePath(sys.argv[1].replace('"', ''))
-
-    # import json file
-    jsonDict = readJson(jsonFile)
-    DBUG('OK: json read')
-
-    rman_version = setup_environment(jsonDict)
-    if int(rman_version) >= 22:
-        import rmanAssets.core as ra         # pylint: disable=import-error
-    else:
-        import rfm.rmanAssets as ra     # pylint: disable=import-error
-    DBUG('OK: imported rmanAssets')
-
-    # constants
-    _bump = ('height', 'normal')
-    slotsFile = FilePath(os.path.dirname(os.path.realpath(__file__))).join('rules.json')
-    rules = readJson(slotsFile)
-    DBUG('OK: rules read')
-
-    _bxdf = jsonDict['bxdf']
-    bxdf_rules = rules[_bxdf]
-    mappings = bxdf_rules['mapping']
-    graph = bxdf_rules.get('graph', None)
-    settings = bxdf_rules.get('settings', None)
-    is_udim = jsonDict['udim']
+    Maps can be added one by one while Substance Painter exports them: they
+    are converted by worker threads, so the conversions overlap with the map
+    export. finish() then builds and installs the assets.
+    """
 
-    # we save the assets to SP's export directory, because we know it is writable.
-    # We will move them to the requested location later.
-    exportPath = jsonFile.dirname()
-
-    # build assets
-    assetList = []
-    scene = jsonDict['scene']
-    matArray = jsonDict['document']
-    for mat in matArray:
-        label = scene
-        if not is_udim:
-            label = '%s_%s' % (scene, mat['textureSet'])
+    def __init__(self, settings, export_path, jobs=None):
+        self.settings = settings
+        self.export_path = FilePath(export_path)
+        self.ra, self.rman_version = import_rman_assets(settings)
+        self.rules = load_rules()
+        self.is_udim = settings['udim']
+        self.materials = collections.OrderedDict()
+        self.queue = queue.Queue()
+        self.workers = []
+        for _ in range(jobs or cpu_count()):
+            thr = threading.Thread(target=self._work)
+            thr.daemon = True
+            thr.start()
+            self.workers.append(thr)
+
+    def label(self, texture_set):
+        if self.is_udim:
+            return self.settings['scene']
+        return '%s_%s' % (self.settings['scene'], texture_set)
+
+    def asset_path(self, texture_set):
+        return self.export_path.join(self.label(texture_set) + '.rma')
+
+    def add_map(self, texture_set, resolution, channel, fpath):
+        """Register an exported map and queue its conversion. The map must
+        be in the export directory, as it is deleted once converted."""
+        if not is_inside(fpath, self.export_path):
+            raise ValueError('%s is not in %s' % (fpath, self.export_path))
+        fpath = FilePath(fpath)
+        asset_path = self.asset_path(texture_set)
+        mat = self.materials.get(texture_set, None)
+        if mat is None:
+            mat = {'textureSet': texture_set, 'resolution': resolution,
+                   'channels': {}}
+            self.materials[texture_set] = mat
+            create_asset_dir(asset_path)
+        mat['channels'].setdefault(channel, []).append(fpath)
+        self.queue.put((asset_path, fpath))
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                txmake(self.is_udim, *item)
+            except Exception:
+                XCPT('Conversion failed: %s', item[1])
+            finally:
+                self.queue.task_done()
+
+    def stop_workers(self):
+        for _ in self.workers:
+            self.queue.put(None)
+
+    def abort(self):
+        """Drop the pending conversions and stop the workers."""
+        try:
+            while True:
+                self.queue.get_nowait()
+                self.queue.task_done()
+        except queue.Empty:
+            pass
+        self.stop_workers()
+
+    def finish(self):
+        """Wait for the conversions, then build and install the assets."""
+        self.queue.join()
+        self.stop_workers()
+        asset_list = []
+        for mat in self.materials.values():
+            asset_list.append(self.build_asset(mat))
+        install_assets(asset_list, self.settings['saveTo'])
+        cleanup(self.materials.values())
+        INFO('RenderMan : Done !')
+
+    def build_asset(self, mat):
+        _bxdf = self.settings['bxdf']
+        bxdf_rules = self.rules[_bxdf]
+        mappings = bxdf_rules['mapping']
+        graph = bxdf_rules.get('graph', None)
+        settings = bxdf_rules.get('settings', None)
+        is_udim = self.is_udim
+
+        label = self.label(mat['textureSet'])
         chans = mat['channels']
         DBUG('+ Exporting %s', label)
 
-        assetPath = exportPath.join(label + '.rma')
+        assetPath = self.asset_path(mat['textureSet'])
         DBUG('  + assetPath %s', assetPath)
         assetJsonPath = assetPath.join('asset.json')
         DBUG('  + assetJsonPath %s', assetJsonPath)
 
-        # create asset directory
-        if not assetPath.exists():
-            try:
-                os.mkdir(assetPath.osPath())
-            except (OSError, IOError):
-                XCPT('Asset directory could not be created !')
-                sys.exit(0)
-            DBUG('  + Created dir: %s', assetPath)
-        else:
-            DBUG('  + dir exists: %s', assetPath)
-
         # create asset
         try:
-            asset = ra.RmanAsset(assetType='nodeGraph', label=label)
+            asset = self.ra.RmanAsset(assetType='nodeGraph', label=label)
         except Exception:
             XCPT('Asset creation failed')
-            sys.exit(0)
+            raise
 
         # create standard metadata
         #
@@ -346,12 +515,11 @@ def export():
         # Compatibility data
         # This will help other application decide if they can use this asset.
         #
-        prmanVersion = str(rman_version)
+        prmanVersion = str(self.rman_version)
         asset.setCompatibility(hostName='Substance Painter',
-                               hostVersion=jsonDict['sp_version'],
+                               hostVersion=self.settings['sp_version'],
                                rendererVersion=prmanVersion)
         DBUG('  + compatibility set')
-
         # create nodes
         # start by adding a root node
         #
@@ -365,7 +533,7 @@ def export():
         #
         bxdfNode = label + "_Srf"
         asset.addNode(bxdfNode, _bxdf, 'bxdf', _bxdf)
-        DBUG('  + BxDF node: %s  (%s)', (rootNode, _bxdf))
+        DBUG('  + BxDF node: %s  (%s)', rootNode, _bxdf)
 
         # The bxdf may need specific settings to match Substance Painter
         set_params(settings, 'bxdf', bxdfNode, asset)
@@ -383,21 +551,21 @@ def export():
                 lname = label + nname
                 asset.addNode(lname, ndict['nodetype'],
                               'pattern', ndict['nodetype'])
-                DBUG('    |_ %s  (%s)' % (lname, ndict['nodetype']))
+                DBUG('    |_ %s  (%s)', lname, ndict['nodetype'])
                 if 'params' in ndict:
                     for pname, pdict in ndict['params'].iteritems():
                         asset.addParam(lname, pname, pdict)
-                        DBUG('       |_ param: %s %s = %s' %
-                             (pdict['type'], pname, pdict['value']))
+                        DBUG('       |_ param: %s %s = %s',
+                             pdict['type'], pname, pdict['value'])
 
         # create texture nodes
         DBUG('  + Create texture nodes...')
         chanNodes = {}
         for chan, fpath_list in chans.iteritems():
             nodeName = "%s_%s_tex" % (label, chan)
-            DBUG('    |_ %s' % nodeName)
+            DBUG('    |_ %s', nodeName)
             chanNodes[chan] = nodeName
-            fpath = txmake(is_udim, assetPath, fpath_list)
+            fpath = tex_file(is_udim, fpath_list)
             if chan == 'normal':
                 add_texture_node(asset, nodeName, 'PxrNormalMap', fpath)
             elif chan == 'height':
@@ -424,19 +592,18 @@ def export():
                 if dstParam != 'graph':
                     # connections with a graph type will be handled later, so
                     # we don't warn in that case.
-                    print 'WARNING: Not connecting: %s' % chan
+                    WARN('Not connecting: %s', chan)
                 continue
             if dstParam == 'graph':
                 continue
             dst = '%s.%s' % (bxdfNode, dstParam)
             asset.addConnection(src, dst)
-            DBUG('    |_ connect: %s -> %s' % (src, dst))
+            DBUG('    |_ connect: %s -> %s', src, dst)
             # also tag the bxdf param as connected
             pdict = {'type': 'reference ' + dstType, 'value': None}
             asset.addParam(bxdfNode, dstParam, pdict)
-            DBUG('       |_ param: %s %s -> %s' % (pdict['type'],
-                                                   dstParam,
-                                                   pdict['value']))
+            DBUG('       |_ param: %s %s -> %s', pdict['type'], dstParam,
+                 pdict['value'])
 
         # make graph connections
         #
@@ -473,31 +640,47 @@ def export():
                         dst_node = label + dst_node
                     dst = '%s.%s' % (dst_node, con['dst']['param'])
                     asset.addConnection(src, dst)
-                    DBUG('    |_ connect: %s -> %s' % (src, dst))
+                    DBUG('    |_ connect: %s -> %s', src, dst)
                     # mark param as a connected
                     dstType = con['dst']['type']
                     pdict = {'type': 'reference %s' % dstType, 'value': None}
                     asset.addParam(dst_node, con['dst']['param'], pdict)
-                    DBUG('       |_ param: %s %s = %s' % (pdict['type'],
-                                                          con['dst']['param'],
-                                                          pdict['value']))
+                    DBUG('       |_ param: %s %s = %s', pdict['type'],
+                         con['dst']['param'], pdict['value'])
 
         # save asset
         #
-        DBUG('  + ready to save: %s' % assetJsonPath)
+        DBUG('  + ready to save: %s', assetJsonPath)
         try:
             asset.save(assetJsonPath, False)
         except:
             XCPT('Saving the asset failed !')
             raise
 
-        # mark this asset as ready to be moved
-        #
-        assetList.append(assetPath)
+        return assetPath
+
+
+def is_inside(fpath, dir_path):
+    """True if fpath is inside dir_path, once links are resolved."""
+    fpath = os.path.normcase(os.path.realpath(fpath))
+    dir_path = os.path.normcase(os.path.realpath(dir_path))
+    return fpath.startswith(dir_path.rstrip(os.sep) + os.sep)
+
+
+def create_asset_dir(assetPath):
+    if not assetPath.exists():
+        try:
+            os.mkdir(assetPath.osPath())
+        except (OSError, IOError):
+            XCPT('Asset directory could not be created !')
+            raise
+        DBUG('  + Created dir: %s', assetPath)
+    else:
+        DBUG('  + dir exists: %s', assetPath)
 
-    # move assets to the requested location
-    #
-    dst = jsonDict['saveTo']
+
+def install_assets(assetList, dst):
+    """move assets to the requested location"""
     for item in assetList:
         # if the asset already exists in the destination
         # location, we need to move it first.
@@ -506,45 +689,211 @@ def export():
             try:
                 os.rename(dstAsset, dstAsset + '_old')
             except (OSError, IOError):
-                XCPT('Could not rename asset to %s_old' % dstAsset)
+                XCPT('Could not rename asset to %s_old', dstAsset)
                 continue
             else:
                 shutil.rmtree(dstAsset + '_old', ignore_errors=False)
         try:
             shutil.move(item, dst)
         except (OSError, IOError):
-            XCPT('WARNING: Could not copy asset to %s' % dst)
+            XCPT('WARNING: Could not copy asset to %s', dst)
 
 
-    # clean-up intermediate files
-    for mat in matArray:
-        for chan, fpath_list in chans.iteritems():
+def cleanup(materials):
+    """clean-up intermediate files"""
+    for mat in materials:
+        for fpath_list in mat['channels'].values():
             for fpath in fpath_list:
                 if not os.path.exists(fpath):
-                    print 'cleanup: file not found: %s' % fpath
+                    WARN('cleanup: file not found: %s', fpath)
                     continue
                 try:
                     os.remove(fpath)
                 except (OSError, IOError):
-                    XCPT('Cleanup failed: %s' % fpath)
+                    XCPT('Cleanup failed: %s', fpath)
                 else:
-                    DBUG('Cleanup: %s' % fpath)
+                    DBUG('Cleanup: %s', fpath)
+
+
+def export():
+    """Export a RenderManAsset package based on  a json file.
+    """
+    INFO('Start !')
+
+    if len(sys.argv) < 2:
+        ERR('expecting 2 arguments !')
+        raise Exception
+
+    # get the input json file
+    jsonFile = FilePath(sys.argv[1].replace('"', ''))
+
+    # import json file
+    jsonDict = readJson(jsonFile)
+    DBUG('OK: json read')
+
+    # we save the assets to SP's export directory, because we know it is writable.
+    # We will move them to the requested location later.
+    exporter = Exporter(jsonDict, jsonFile.dirname())
+    for mat in jsonDict['document']:
+        for chan, fpath_list in mat['channels'].items():
+            for fpath in fpath_list:
+                exporter.add_map(mat['textureSet'], mat['resolution'], chan,
+                                 fpath)
+    exporter.finish()
 
     if os.path.exists(jsonFile):
         try:
             os.remove(jsonFile)
         except (OSError, IOError):
-            XCPT('Cleanup failed: %s' % jsonFile)
+            XCPT('Cleanup failed: %s', jsonFile)
         else:
-            DBUG('Cleanup: %s' % jsonFile)
+            DBUG('Cleanup: %s', jsonFile)
+
+
+# daemon ----------------------------------------------------------------------
 
-    INFO('RenderMan : Done !')
+class DaemonHandler(BaseHTTPRequestHandler):
+    """The export server's API. All requests and replies are json, and
+    replies hold the messages logged while handling the request.
+
+    Requests must carry the server's token in an X-RfSP-Token header, and
+    POST requests must be sent as application/json: other local processes
+    and web pages can't drive the server.
+
+    GET  /ping                  -> {"pid": ...}
+    POST /jobs                  export settings -> {"job": id}
+    POST /jobs/<id>/maps        {textureSet, resolution, channel, path}
+    POST /jobs/<id>/end         build and install the assets.
+    POST /jobs/<id>/abort       drop the job.
+    POST /quit                  stop the server.
+    """
+
+    def authorized(self):
+        token = self.headers.get('X-RfSP-Token', '')
+        if hmac.compare_digest(str(token), str(self.server.token)):
+            return True
+        WARN('daemon: rejected unauthorized request: %s', self.path)
+        self.reply({'error': 'unauthorized'}, 403)
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path == '/ping':
+            self.reply({'pid': os.getpid()})
+        else:
+            self.reply({'error': 'unknown request'}, 404)
+
+    def do_POST(self):
+        server = self.server
+        if not self.authorized():
+            return
+        ctype = self.headers.get('Content-Type', '').split(';')[0].strip()
+        if ctype != 'application/json':
+            self.reply({'error': 'expected application/json'}, 415)
+            return
+        server.last_request = time.time()
+        try:
+            size = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(size) or '{}')
+            match = re.match(r'^/jobs/(\d+)/(maps|end|abort)$', self.path)
+            if self.path == '/jobs':
+                server.job_id += 1
+                server.jobs[server.job_id] = Exporter(data, data['exportPath'])
+                INFO('Start job %d: %s', server.job_id, data['scene'])
+                self.reply({'job': server.job_id})
+            elif match and int(match.group(1)) in server.jobs:
+                job_id = int(match.group(1))
+                if match.group(2) == 'maps':
+                    server.jobs[job_id].add_map(
+                        data['textureSet'], data['resolution'],
+                        data['channel'], data['path'])
+                elif match.group(2) == 'abort':
+                    server.jobs.pop(job_id).abort()
+                    INFO('Aborted job %d', job_id)
+                else:
+                    server.jobs.pop(job_id).finish()
+                self.reply({'job': job_id})
+            elif self.path == '/quit':
+                server.running = False
+                self.reply({})
+            else:
+                self.reply({'error': 'unknown request'}, 404)
+        except Exception as err:
+            XCPT('Request failed: %s', self.path)
+            self.reply({'error': str(err)}, 500)
+
+    def reply(self, data, status=200):
+        data['log'] = self.server.log.pop()
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        DBUG('daemon: ' + fmt, *args)
+
+
+def write_token(fpath):
+    """Write a new random token to a file only the user can read, and
+    return it."""
+    token = binascii.hexlify(os.urandom(16)).decode('ascii')
+    if os.path.exists(fpath):
+        os.remove(fpath)
+    fdesc = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fdesc, 'w') as fhdl:
+        fhdl.write(token)
+    return token
+
+
+def serve(port, console):
+    """Serve export requests on localhost until /quit or the server has been
+    idle for DAEMON_IDLE seconds."""
+    try:
+        server = HTTPServer(('127.0.0.1', port), DaemonHandler)
+    except (OSError, IOError) as err:
+        ERR('Can not start the daemon on port %d: %s', port, err)
+        return
+    token_file = DAEMON_TOKEN % port
+    try:
+        server.token = write_token(token_file)
+    except (OSError, IOError) as err:
+        ERR('Can not write the daemon token: %s', err)
+        server.server_close()
+        return
+    server.timeout = 1.0
+    server.jobs = {}
+    server.job_id = 0
+    server.running = True
+    server.last_request = time.time()
+    server.log = ReplyHandler(console.level)
+    server.log.setFormatter(console.formatter)
+    LOGGER.addHandler(server.log)
+    INFO('RenderMan daemon listening on 127.0.0.1:%d', port)
+    while server.running and \
+            time.time() - server.last_request < DAEMON_IDLE:
+        server.handle_request()
+    server.server_close()
+    for job in server.jobs.values():
+        job.abort()
+    try:
+        os.remove(token_file)
+    except OSError:
+        pass
+    INFO('RenderMan daemon stopped')
 
 
 # main
 
-try:
-    export()
-except Exception:
-    XCPT('Export failed')
-sys.exit(0)
+if __name__ == '__main__':
+    CONSOLE = setup_logging()
+    if len(sys.argv) > 2 and sys.argv[1] == '--daemon':
+        serve(int(sys.argv[2]), CONSOLE)
+    else:
+        try:
+            export()
+        except Exception:
+            XCPT('Export failed')
+    sys.exit(0)
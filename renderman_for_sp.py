@@ -43,15 +43,45 @@ import getpass
 import re
 import subprocess
 import shutil
+import stat
+import hashlib
+import time
+import socket
+import errno
+import random
+import threading
+import contextlib
+import collections
+import heapq
+import functools
+import copy
+import concurrent.futures
+import queue
+import array
+import io
+import cProfile
+import pstats
+import tracemalloc
 # from PySide2 import (QtWidgets, QtGui, QtCore)  # pylint: disable=import-error
-from PySide2.QtCore import (QResource, Qt)   # pylint: disable=import-error
-from PySide2.QtGui import (QIcon)   # pylint: disable=import-error
+from PySide2.QtCore import (QResource, Qt, QCoreApplication, QTimer)   # pylint: disable=import-error
+from PySide2.QtGui import (   # pylint: disable=import-error
+    QIcon,
+    QImage,
+    QImageReader,
+    QPainter,
+    QColor,
+    QRadialGradient
+    )
 from PySide2.QtWidgets import (
     QWidget,
     QMessageBox,
     QFileDialog,
     QFormLayout,
-    QComboBox
+    QComboBox,
+    QCheckBox,
+    QSpinBox,
+    QPushButton,
+    QLabel
     )   # pylint: disable=import-error
 import substance_painter as sp              # pylint: disable=import-error
 import substance_painter.ui as spui         # pylint: disable=import-error
@@ -60,6 +90,7 @@ import substance_painter.project as spp     # pylint: disable=import-error
 import substance_painter.textureset as spts # pylint: disable=import-error
 # import substance_painter.resource as spr    # pylint: disable=import-error
 import substance_painter.export as spex     # pylint: disable=import-error
+import substance_painter.event as spev      # pylint: disable=import-error
 
 
 __version__ = '24.1.0'
@@ -68,88 +99,2219 @@ MIN_SP_API = '0.1.0'
 
 
 class Log(object):
-    def __init__(self, loglevel=spl.ERROR):
+    """Logs to Substance Painter's log window.
+
+    The log level is resolved once: disabled methods are replaced by a
+    function that stores the message in a ring buffer without formatting it.
+    The ring buffer is dumped to rfsp_debug.log, next to the prefs file, when
+    an error is logged, so we get the debug context of a failure without
+    paying for debug logging. The file is rotated when it exceeds 'max_bytes':
+    the previous one is kept as rfsp_debug.log.1.
+    """
+
+    levels = (('debug_error', 'DBG_ERROR', 'ERROR'),
+              ('debug_warning', 'DBG_WARNING', 'WARNING'),
+              ('debug_info', 'DBG_INFO', 'INFO'),
+              ('warning', 'WARNING', 'WARNING'),
+              ('info', 'INFO', 'INFO'))
+
+    def __init__(self, loglevel=spl.ERROR, ring_size=5000, max_bytes=1048576):
         self.channel = 'RenderMan %s' % __version__
-        self.loglevel = int(loglevel)
+        self.ring = collections.deque(maxlen=ring_size)
+        self.max_bytes = max_bytes
+        self.set_level(loglevel)
         self.info('Log Level: %s (%s)', loglevel, self.loglevel)
         pyv = sys.version_info
         self.info('SP python: %d.%d.%d', *tuple(pyv[0:3]))
 
-    def debug_error(self, msg, *args):
-        if self.loglevel >= int(spl.DBG_ERROR):     # 5
-            spl.log(spl.ERROR, self.channel, msg % args)
+    def set_level(self, loglevel):
+        self.loglevel = int(loglevel)
+        for name, level, splevel in self.levels:
+            func = self._log if self.loglevel >= int(getattr(spl, level)) \
+                else self._buffer
+            setattr(self, name, functools.partial(func, getattr(spl, splevel)))
+
+    def _log(self, splevel, msg, *args):
+        if args:
+            msg = msg % args
+        spl.log(splevel, self.channel, msg)
+        self.ring.append((time.time(), splevel, msg, ()))
+
+    def _buffer(self, splevel, msg, *args):
+        self.ring.append((time.time(), splevel, msg, args))
+
+    def error(self, msg, *args):
+        if self.loglevel >= int(spl.ERROR):
+            self._log(spl.ERROR, msg, *args)
+        else:
+            self._buffer(spl.ERROR, msg, *args)
+        self.flush_ring()
+
+    def flush_ring(self):
+        """Write the buffered messages to disk and empty the buffer."""
+        if not self.ring:
+            return
+        # the prefs file is in the plugin's directory.
+        fpath = os.path.join(root_dir(), 'rfsp_debug.log')
+        try:
+            if os.path.getsize(fpath) > self.max_bytes:
+                os.replace(fpath, fpath + '.1')
+        except OSError:
+            pass
+        try:
+            with open(fpath, 'a') as fhdl:
+                fhdl.write('-' * 79 + '\n')
+                while self.ring:
+                    stamp, level, msg, args = self.ring.popleft()
+                    try:
+                        msg = msg % args if args else msg
+                    except (TypeError, ValueError):
+                        msg = '%s %r' % (msg, args)
+                    fhdl.write('%s %-8s %s\n' % (
+                        time.strftime('%H:%M:%S', time.localtime(stamp)),
+                        chan_type_str(level), msg))
+        except (OSError, IOError):
+            self.ring.clear()
+
+
+LOG = Log(loglevel=spl.ERROR)
+
+
+class EventBus(object):
+    """In-process publisher of structured export events.
+
+    Subscribers are callables receiving a dict with at least 'event', 'time'
+    and 'host' keys. A failing subscriber never breaks the export.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.host = socket.gethostname()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, event, **data):
+        data['event'] = event
+        data['time'] = time.time()
+        data['host'] = self.host
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(data)
+            except BaseException as err:    # pylint: disable=broad-except
+                LOG.warning('Event subscriber failed: %s', err)
+
+    @contextlib.contextmanager
+    def stage(self, name, **data):
+        """Publish 'stage_start' and 'stage_end' events around a block."""
+        self.publish('stage_start', stage=name, **data)
+        start = time.time()
+        status = 'error'
+        try:
+            yield
+            status = 'success'
+        finally:
+            self.publish('stage_end', stage=name, status=status,
+                         seconds=time.time() - start, **data)
+
+
+class JsonLinesSink(object):
+    """Appends each event as a json line to a file."""
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self._lock = threading.Lock()
+        self._hdl = open(fpath, 'a')
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._hdl.write(line + '\n')
+            self._hdl.flush()
+
+    def close(self):
+        with self._lock:
+            self._hdl.close()
+
+
+class SocketSink(object):
+    """Sends each event as a json datagram to a local UDP socket. Nothing
+    happens if no one is listening."""
+
+    def __init__(self, address):
+        host, _, port = address.rpartition(':')
+        self.address = (host or '127.0.0.1', int(port))
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, event):
+        try:
+            self._sock.sendto(json.dumps(event, default=str).encode('utf-8'),
+                              self.address)
+        except (OSError, IOError):
+            pass
+
+    def close(self):
+        self._sock.close()
+
+
+EVENTS = EventBus()
+
+
+class TaskQueue(object):
+    """Runs tasks in order, in a background thread, so they don't block
+    the export.
+
+    Tasks submitted with the same key are coalesced: a task that didn't
+    start yet is skipped if a newer task with the same key was submitted,
+    and its 'cancel' callable is called instead.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._latest = {}
+
+    def submit(self, func, *args, key=None, cancel=None):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            token = object()
+            if key is not None:
+                self._latest[key] = token
+        self._queue.put((func, args, key, token, cancel))
+
+    def join(self):
+        """Wait until all submitted tasks are done."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            func, args, key, token, cancel = self._queue.get()
+            try:
+                with self._lock:
+                    superseded = key is not None and \
+                        self._latest.get(key, None) is not token
+                    if not superseded:
+                        self._latest.pop(key, None)
+                if superseded:
+                    LOG.debug_info('%s: superseded task skipped: %s',
+                                   self.name, key)
+                    if cancel:
+                        cancel()
+                    continue
+                func(*args)
+            except BaseException as err:    # pylint: disable=broad-except
+                LOG.error('%s: task failed: %s', self.name, err)
+            finally:
+                self._queue.task_done()
+
+
+SWATCHES = TaskQueue('rfsp_swatches')
+AUTO_EXPORTS = TaskQueue('rfsp_auto_export')
+
+
+class Profiler(object):
+    """Profiles the exports with cProfile and tracemalloc when the
+    'profiling' pref is on.
+
+    Each profiled stage writes a .prof file and a tracemalloc snapshot to the
+    'profiles' directory next to the prefs file. cProfile can't nest, so a
+    parent stage is paused while a nested stage runs and the nested stage's
+    stats are added to the parent's. Only the files of the last
+    'profiling keep' sessions are kept.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.dir = None
+        self.keep = 10
+        self.top = 20
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tracing = 0
+
+    def configure(self, prefs):
+        self.enabled = bool(prefs.get('profiling', False))
+        self.dir = os.path.join(os.path.dirname(prefs.file), 'profiles')
+        self.keep = int(prefs.get('profiling keep', 10))
+        self.top = int(prefs.get('profiling top', 20))
+        if self.enabled:
+            LOG.info('Profiling exports to %s', self.dir)
+
+    def profiled(self, func):
+        """Decorator profiling a function as a stage."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        stack = self._local.__dict__.setdefault('stack', [])
+        if stack:
+            session = stack[0]['session']
+            stack[-1]['profiles'][-1].disable()
+        else:
+            session = '%s_%04d' % (time.strftime('%Y%m%d_%H%M%S'),
+                                   threading.get_ident() % 10000)
+            self._start_tracing()
+        frame = {'session': session, 'profiles': [], 'children': [],
+                 'count': 0}
+        root = stack[0] if stack else frame
+        # the stages are numbered, in case one runs several times.
+        name = '%02d_%s' % (root['count'], name)
+        root['count'] += 1
+        stack.append(frame)
+        start = time.time()
+        self._resume(frame)
+        try:
+            yield
+        finally:
+            frame['profiles'][-1].disable()
+            stack.pop()
+            stats = pstats.Stats(*frame['profiles'], stream=io.StringIO())
+            for child in frame['children']:
+                stats.add(child)
+            self._save(session, name, stats, time.time() - start,
+                       summary=not stack)
+            if stack:
+                stack[-1]['children'].append(stats)
+                self._resume(stack[-1])
+            else:
+                self._stop_tracing()
+                self.cleanup()
+
+    @staticmethod
+    def _resume(frame):
+        prof = cProfile.Profile()
+        frame['profiles'].append(prof)
+        try:
+            prof.enable()
+        except ValueError as err:
+            # another profiler is already active.
+            LOG.debug_warning('Profiling: %s', err)
+
+    def _start_tracing(self):
+        with self._lock:
+            if not self._tracing and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._tracing += 1
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+
+    def _stop_tracing(self):
+        with self._lock:
+            self._tracing -= 1
+            if not self._tracing:
+                tracemalloc.stop()
+
+    def _save(self, session, name, stats, seconds, summary=False):
+        base = os.path.join(self.dir, '%s_%s' % (session, name))
+        try:
+            if not os.path.isdir(self.dir):
+                os.makedirs(self.dir)
+            stats.dump_stats(base + '.prof')
+            snapshot = self._snapshot()
+            snapshot.dump(base + '.tracemalloc')
+        except (OSError, IOError) as err:
+            LOG.error('Profiling %s: %s', name, err)
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        LOG.info('Profile %s: %.2f sec., peak memory %.1f MB: %s.prof',
+                 name, seconds, peak / 1048576.0, base)
+        if not summary:
+            return
+        stats.sort_stats('cumulative').print_stats(self.top)
+        LOG.info('Top %d hotspots:\n%s', self.top, stats.stream.getvalue())
+        LOG.info('Top %d allocations:\n%s', self.top, '\n'.join(
+            '%s: %.1f KB in %d blocks' % (stat.traceback, stat.size / 1024.0,
+                                          stat.count)
+            for stat in snapshot.statistics('lineno')[:self.top]))
+
+    def _snapshot(self):
+        """Take a tracemalloc snapshot, without the allocations of the
+        profiler itself."""
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, pstats.__file__),
+            tracemalloc.Filter(False, cProfile.__file__)])
+        fname = Profiler._save.__code__.co_filename
+        first, last = self._lines()
+        # only a few lines of the profiler allocate: filtering the traces
+        # on these lines only is much faster than on the whole class.
+        own = sorted(set(
+            stat.traceback[0].lineno
+            for stat in snapshot.statistics('lineno')
+            if stat.traceback[0].filename == fname and
+            first <= stat.traceback[0].lineno <= last))
+        if own:
+            snapshot = snapshot.filter_traces(
+                [tracemalloc.Filter(False, fname, n) for n in own])
+        return snapshot
+
+    @classmethod
+    def _lines(cls):
+        """Returns the first and last lines of the class in its file."""
+        if '_line_range' not in cls.__dict__:
+            try:
+                lines, first = inspect.getsourcelines(cls)
+            except (OSError, TypeError):
+                lines, first = [], 0
+            cls._line_range = (first, first + len(lines) - 1)
+        return cls._line_range
+
+    def cleanup(self):
+        """Only keep the files of the last 'keep' sessions."""
+        try:
+            fnames = os.listdir(self.dir)
+        except OSError:
+            return
+        sessions = sorted(set(f[:20] for f in fnames))
+        old = set(sessions[:-self.keep]) if self.keep > 0 else set()
+        for fname in fnames:
+            if fname[:20] in old:
+                try:
+                    os.remove(os.path.join(self.dir, fname))
+                except OSError:
+                    pass
+
+
+PROFILER = Profiler()
+
+
+def active_texture_set():
+    """Returns the name of the texture set being painted, or None."""
+    try:
+        return spts.get_active_stack().material().name()
+    except Exception:   # pylint: disable=broad-except
+        # no project or no texture set.
+        return None
+
+
+def texture_set_states():
+    """Returns a string describing the resolution and channels of each
+    texture set, keyed by name."""
+    states = {}
+    for tset in spts.all_texture_sets():
+        res = tset.get_resolution()
+        states[tset.name()] = '%dx%d %s' % (
+            res.width, res.height,
+            ','.join(sorted(chan_type_str(c)
+                            for c in tset.get_stack().all_channels())))
+    return states
+
+
+class DirtyTracker(object):
+    """Tracks which texture sets changed since they were last exported to
+    each library asset, from Substance Painter's events.
+
+    Every change of a texture set gets a new sequence number. An export
+    records the sequence number at its start for the texture sets it
+    installed, so the texture sets changed during the export stay dirty.
+    The state is saved in a json file, keyed by project path.
+
+    The event dispatcher, the event classes and the project queries can be
+    replaced by stubs to test the tracking without Substance Painter.
+    """
+
+    version = 1
+
+    def __init__(self, fpath=None, dispatcher=None, events=None,
+                 project=None, active=None, states=None):
+        self.fpath = fpath
+        self.events = events or spev
+        self.dispatcher = dispatcher or self.events.DISPATCHER
+        self.project = project or spp.file_path
+        self.active = active or active_texture_set
+        self.states = states or texture_set_states
+        self.data = {'version': self.version, 'projects': {}}
+        self._connected = []
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def start(self, fpath=None):
+        """Load the saved state and subscribe to the events."""
+        self.fpath = fpath or self.fpath
+        self.load()
+        handlers = [('LayerStacksModelDataChanged', self._on_stack_changed),
+                    ('ProjectOpened', self._on_project_changed),
+                    ('ProjectEditionEntered', self._on_project_changed),
+                    ('ProjectSaved', self._on_save),
+                    ('ProjectAboutToClose', self._on_save)]
+        for name, handler in handlers:
+            # older versions of Substance Painter don't have all events.
+            event_cls = getattr(self.events, name, None)
+            if event_cls is not None:
+                self.dispatcher.connect(event_cls, handler)
+                self._connected.append((event_cls, handler))
+
+    def stop(self):
+        for event_cls, handler in self._connected:
+            self.dispatcher.disconnect(event_cls, handler)
+        self._connected = []
+        self.save()
+
+    def load(self):
+        try:
+            with open(self.fpath, 'r') as fhdl:
+                data = json.load(fhdl)
+        except (OSError, IOError, TypeError, ValueError):
+            return
+        if data.get('version', None) == self.version:
+            with self._lock:
+                self.data = data
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or not self.fpath:
+                return
+            tmp = '%s.%d.tmp' % (self.fpath, os.getpid())
+            try:
+                with open(tmp, 'w') as fhdl:
+                    json.dump(self.data, fhdl, separators=(',', ':'))
+                os.replace(tmp, self.fpath)
+            except (OSError, IOError) as err:
+                LOG.warning('Could not save the dirty texture sets: %s', err)
+            else:
+                self._dirty = False
+
+    def _entry(self, project):
+        return self.data['projects'].setdefault(
+            project, {'seq': 0, 'changes': {}, 'states': {}, 'exported': {}})
+
+    def touch(self, project, tset):
+        """Mark a texture set as changed."""
+        if not project or not tset:
+            return
+        with self._lock:
+            entry = self._entry(project)
+            entry['seq'] += 1
+            entry['changes'][tset] = entry['seq']
+            self._dirty = True
+
+    def sync(self, project):
+        """Mark the new texture sets and the ones whose resolution or
+        channels changed, and forget the deleted ones."""
+        if not project:
+            return
+        states = self.states()
+        with self._lock:
+            entry = self._entry(project)
+            for name, state in states.items():
+                if entry['states'].get(name, None) != state:
+                    self.touch(project, name)
+            for name in set(entry['states']) - set(states):
+                entry['changes'].pop(name, None)
+            entry['states'] = states
+            self._dirty = True
+
+    def sequence(self, project):
+        """Returns the current sequence number of a project."""
+        with self._lock:
+            return self._entry(project)['seq'] if project else 0
+
+    def dirty(self, project, target):
+        """Returns the sorted names of the texture sets that changed since
+        they were exported to the target asset."""
+        self.sync(project)
+        with self._lock:
+            if not project:
+                return sorted(self.states())
+            entry = self._entry(project)
+            exported = entry['exported'].get(target, {})
+            return sorted(
+                n for n in entry['states']
+                if n not in exported or
+                entry['changes'].get(n, 0) > exported[n])
+
+    def mark_exported(self, project, target, tsets, seq):
+        """Record the texture sets exported to a target asset, as they
+        were at sequence number 'seq'."""
+        if not project:
+            return
+        with self._lock:
+            exported = self._entry(project)['exported'].setdefault(target, {})
+            for name in tsets:
+                exported[name] = seq
+            self._dirty = True
+
+    def _on_stack_changed(self, _event):
+        self.touch(self.project(), self.active())
+
+    def _on_project_changed(self, _event):
+        self.sync(self.project())
+
+    def _on_save(self, _event):
+        self.save()
+
+
+DIRTY = DirtyTracker()
+
+
+class AssetGraph(object):
+    """An in-memory shading graph the asset is built from.
+
+    It mimics the subset of the RmanAsset API we use (addNode, addParam,
+    addConnection), so the graph can be analysed and pruned before being
+    handed over to the real asset.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.params = {}
+        self.connections = []
+        self.duplicates = []
+
+    def addNode(self, nid, nodetype, category, nodeclass):
+        if nid in self.nodes:
+            LOG.warning('Duplicate node: %s', nid)
+        self.nodes[nid] = (nodetype, category, nodeclass)
+        self.params.setdefault(nid, {})
+
+    def addParam(self, nid, pname, pdict):
+        params = self.params.setdefault(nid, {})
+        prev = params.get(pname, None)
+        if prev is not None and prev != pdict:
+            # connecting a param overrides its default value: that's expected.
+            if not (pdict['type'].startswith('reference') and
+                    not prev['type'].startswith('reference')):
+                self.duplicates.append((nid, pname, prev, pdict))
+                LOG.warning('Duplicate param: %s.%s: %r -> %r', nid, pname,
+                            prev, pdict)
+        params[pname] = pdict
+
+    def addConnection(self, src, dst):
+        self.connections.append((src, dst))
+
+    def reachable(self, root):
+        """Returns the set of nodes feeding the root node, root included."""
+        upstream = {}
+        for src, dst in self.connections:
+            upstream.setdefault(plug_node(dst), []).append(plug_node(src))
+        found = set()
+        todo = [root]
+        while todo:
+            nid = todo.pop()
+            if nid in found or nid not in self.nodes:
+                continue
+            found.add(nid)
+            todo.extend(upstream.get(nid, []))
+        return found
+
+    def prune(self, root):
+        """Remove all nodes that don't contribute to the root node, as well
+        as dangling connections.
+
+        Returns:
+            dict -- the params of the removed nodes, keyed by node name.
+        """
+        keep = self.reachable(root)
+        removed = {}
+        for nid in [n for n in self.nodes if n not in keep]:
+            del self.nodes[nid]
+            removed[nid] = self.params.pop(nid, {})
+        self.connections = [
+            (src, dst) for src, dst in self.connections
+            if plug_node(src) in keep and plug_node(dst) in keep]
+        return removed
+
+    def apply(self, asset):
+        """Add the graph's nodes, params and connections to a RmanAsset."""
+        for nid, (nodetype, category, nodeclass) in self.nodes.items():
+            asset.addNode(nid, nodetype, category, nodeclass)
+            for pname, pdict in self.params[nid].items():
+                asset.addParam(nid, pname, pdict)
+        for src, dst in self.connections:
+            asset.addConnection(src, dst)
+
+
+def build_graph(job, label, chans, packed, texfiles, skipped=()):
+    """Build the material's shading graph from the rules.
+
+    Arguments:
+        job {ExportJob} -- the export options and rules.
+        label {str} -- the asset's label, used to name the nodes.
+        chans {dict} -- the texture set's exported maps, keyed by channel.
+        packed {dict} -- the packed channels' components.
+        texfiles {dict} -- the converted textures, keyed by map.
+        skipped {set} -- the channels whose default UDIM tiles were not
+                         converted.
+
+    Returns:
+        tuple -- the AssetGraph and the name of its root node.
+    """
+    _bxdf = job.bxdf
+    compiled = job.compiled
+    mappings = job.bxdf_rules['mapping']
+    graph = job.bxdf_rules.get('graph', None)
+    settings = job.bxdf_rules.get('settings', None)
+    agraph = AssetGraph()
+
+    # start by adding a root node
+    #
+    root_node = label + '_Material'
+    agraph.addNode(root_node, 'shadingEngine', 'root', 'shadingEngine')
+    pdict = {'type': 'reference float[]', 'value': None}
+    agraph.addParam(root_node, 'surfaceShader', pdict)
+    LOG.debug_info('  + Root node: %s', root_node)
+
+    # add a disney, pixar or lama bxdf
+    #
+    bxdf_node = label + "_Srf"
+    agraph.addNode(bxdf_node, _bxdf, 'bxdf', _bxdf)
+    LOG.debug_info('  + BxDF node: %s  (%s)', root_node, _bxdf)
+
+    # The bxdf may need specific settings to match Substance Painter
+    set_params(settings, 'bxdf', bxdf_node, agraph)
+
+    # connect surf to root node
+    #
+    agraph.addConnection('%s.outColor' % bxdf_node,
+                         '%s.surfaceShader' % root_node)
+
+    # build additional nodes if need be.
+    #
+    if graph:
+        LOG.debug_info('  + Create graph nodes...')
+        for nname, ndict in graph['nodes'].items():
+            lname = label + nname
+            agraph.addNode(lname, ndict['nodetype'],
+                           ndict.get('category', 'pattern'),
+                           ndict['nodetype'])
+            LOG.debug_info(
+                '    |_ %s  (%s)', lname, ndict['nodetype'])
+            if 'params' in ndict:
+                for pname, pdict in ndict['params'].items():
+                    agraph.addParam(lname, pname, pdict)
+                    LOG.debug_info(
+                        '       |_ param: %s %s = %s',
+                        pdict['type'], pname, pdict['value'])
+
+    # create texture nodes
+    LOG.debug_info('  + Create texture nodes...')
+    chan_nodes = {}
+    if packed:
+        map_name = job.rules['packing']['name']
+        node_name = "%s_%s_tex" % (label, map_name)
+        LOG.debug_info('    |_ %s', node_name)
+        add_texture_node(agraph, node_name, 'PxrTexture',
+                         texfiles[map_name])
+        for ch_type in packed:
+            chan_nodes[ch_type] = node_name
+            set_params(settings, ch_type, node_name, agraph)
+    for ch_type in chans:
+        if ch_type in packed or ch_type not in texfiles:
+            continue
+        node_name = "%s_%s_tex" % (label, ch_type)
+        LOG.debug_info('    |_ %s', node_name)
+        chan_nodes[ch_type] = node_name
+        ntype = texture_node_type(ch_type)
+        add_texture_node(agraph, node_name, ntype, texfiles[ch_type])
+        default = mappings.get(ch_type, {}).get('default', None)
+        if ch_type in skipped and ntype == 'PxrTexture' and \
+                default is not None:
+            # missing UDIM tiles hold the channel's default value.
+            agraph.addParam(node_name, 'missingColor',
+                            {'type': 'color', 'value': default[:3]})
+            agraph.addParam(node_name, 'missingAlpha',
+                            {'type': 'float', 'value': (default + [1.0])[3]})
+        set_params(settings, ch_type, node_name, agraph)
+
+    # make direct connections
+    #
+    LOG.debug_info('  + Direct connections...')
+    for ch_type in chans:
+        if ch_type not in compiled['direct']:
+            if mappings.get(ch_type, {}).get('param', None) != 'graph':
+                # connections with a graph type will be handled later, so
+                # we don't warn in that case.
+                LOG.debug_warning('    |_ not connecting: %r', ch_type)
+            continue
+        if ch_type not in chan_nodes:
+            continue
+        src_plug, dst_param, dst_type = compiled['direct'][ch_type]
+        if ch_type in packed:
+            src_plug = 'result' + packed[ch_type]
+        src = '%s.%s' % (chan_nodes[ch_type], src_plug)
+        dst = '%s.%s' % (bxdf_node, dst_param)
+        agraph.addConnection(src, dst)
+        LOG.debug_info('    |_ connect: %s -> %s', src, dst)
+        # also tag the bxdf param as connected
+        pdict = {'type': 'reference ' + dst_type, 'value': None}
+        agraph.addParam(bxdf_node, dst_param, pdict)
+        LOG.debug_info(
+            '       |_ param: %s %s -> %s', pdict['type'],
+            dst_param, pdict['value'])
+
+    # make graph connections
+    #
+    if compiled['connections']:
+        LOG.debug_info('  + Connect graph nodes...')
+        nodes = {'bxdf': lambda _n: bxdf_node,
+                 'ch': chan_nodes.get,
+                 'node': lambda n: label + n}
+        for (skind, snode, sparam), (dkind, dnode, dparam, dtype) \
+                in compiled['connections']:
+            src_node = nodes[skind](snode)
+            dst_node = nodes[dkind](dnode)
+            if skind == 'ch' and snode in packed and \
+                    sparam == 'resultR':
+                sparam = 'result' + packed[snode]
+            if src_node is None or dst_node is None:
+                # the channel doesn't exist in this texture set.
+                continue
+            src = '%s.%s' % (src_node, sparam)
+            dst = '%s.%s' % (dst_node, dparam)
+            agraph.addConnection(src, dst)
+            LOG.debug_info('    |_ connect: %s -> %s', src, dst)
+            # mark param as a connected
+            pdict = {'type': 'reference %s' % dtype, 'value': None}
+            agraph.addParam(dst_node, dparam, pdict)
+            LOG.debug_info(
+                '       |_ param: %s %s = %s',
+                pdict['type'], dparam, pdict['value'])
+
+    return agraph, root_node
+
+
+def plug_node(plug):
+    """'node.param' -> 'node'"""
+    return plug.rpartition('.')[0]
+
+
+def root_dir():
+    """Returns the path the dir from which this plugin is executed."""
+    try:
+        this_file_path = __file__
+    except NameError:
+        this_file_path = os.path.abspath(inspect.stack()[0][1])
+    root = os.path.dirname(this_file_path)
+    return root
+
+
+def pick_directory(*args):
+    libpath = QFileDialog.getExistingDirectory(
+        None, 'Select a directory...')
+    args[0].setText(libpath)
+    LOG.info('pick_directory%s', str(args))
+
+
+class Prefs(object):
+
+    def __init__(self):
+        self.prefs = {}
+        self.root = root_dir()
+        self.file = os.path.join(self.root, 'renderman.prefs')
+        self.load()
+        LOG.debug_info('Prefs created')
+
+    def load(self):
+        if os.path.exists(self.file):
+            with open(self.file, 'r') as fhdl:
+                self.prefs = json.load(fhdl)
+            LOG.debug_info('Loaded: %s', self.file)
+        else:
+            LOG.debug_warning('NOT loaded: %s', self.file)
+
+    def save(self):
+        with open(self.file, mode='w') as fhdl:
+            json.dump(self.prefs, fhdl, sort_keys=False, indent=4)
+        LOG.debug_info('PREFS SAVED: %s', self.file)
+
+    def set(self, key, val):
+        self.prefs[key] = val
+
+    def get(self, key, default):
+        return self.prefs.get(key, default)
+
+    def __del__(self):
+        self.save()
+
+
+RULES_OVERRIDE = 'renderman_rules.json'
+
+
+class Rules(object):
+    """Loads the rules file and any override rules files found in the
+    library directories. The files are watched: the rules are re-loaded as
+    soon as a file changes, so mappings can be edited without re-starting SP.
+    The parsed and compiled rules are cached by content hash: only the
+    current version is kept.
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.override_dirs = []
+        self.data = {}
+        self.compiled = {}
+        self.errors = []
+        self.key = None
+        self._stamp = None
+        self._cache = {}
+
+    def files(self):
+        fpaths = [self.fpath]
+        for dpath in self.override_dirs:
+            fpath = os.path.join(dpath, RULES_OVERRIDE)
+            if os.path.isfile(fpath) and fpath not in fpaths:
+                fpaths.append(fpath)
+        return fpaths
+
+    def get(self):
+        """Returns the up-to-date rules dict."""
+        fpaths = self.files()
+        stamp = []
+        for fpath in fpaths:
+            try:
+                stamp.append((fpath, os.stat(fpath).st_mtime))
+            except OSError:
+                stamp.append((fpath, None))
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._reload(fpaths)
+        return self.data
+
+    def _reload(self, fpaths):
+        contents = []
+        for fpath in fpaths:
+            try:
+                with open(fpath, 'rb') as hdl:
+                    contents.append(hdl.read())
+            except (OSError, IOError):
+                LOG.error('RULES ARE MISSING: can not open %r', fpath)
+                contents.append(b'{}')
+        key = hashlib.sha1(b'\0'.join(contents)).hexdigest()
+        if key not in self._cache:
+            try:
+                data = {}
+                for content in contents:
+                    data = merge_dicts(data, json.loads(content.decode('utf-8')))
+            except ValueError as err:
+                # keep using the last valid rules.
+                self.errors = ['%s' % err]
+                LOG.error('Invalid rules file: %s', err)
+                return
+            self.errors = validate_rules(data)
+            if self.errors:
+                # keep using the last valid rules.
+                for msg in self.errors:
+                    LOG.error('Invalid rules: %s', msg)
+                return
+            self._cache = {key: (data, compile_rules(data))}
+            LOG.info('Rules loaded: %s', ', '.join(fpaths))
+        self.errors = []
+        self.key = key
+        self.data, self.compiled = self._cache[key]
+
+    def check(self, model=None):
+        """Make sure the rules are up-to-date, valid and define the model,
+        if any.
+
+        Raises:
+            RulesError -- if the rules are not usable.
+        """
+        self.get()
+        if self.errors:
+            raise RulesError(self.errors)
+        if model is not None and model not in self.compiled:
+            raise RulesError(['rules.models: unknown model %r' % model])
+
+
+class RulesError(ValueError):
+    """Raised when the rules are not valid. 'errors' holds the list of
+    problems found by validate_rules()."""
+
+    def __init__(self, errors):
+        super(RulesError, self).__init__('\n'.join(errors))
+        self.errors = errors
+
+
+VALID_TYPES = (None, 'color', 'float', 'normal')
+IDENTIFIER = re.compile(r'^[A-Za-z_]\w*$')
+PACKING_COMPONENTS = ('R', 'G', 'B', 'A')
+EXPORTED_CHANNEL = re.compile(r'_([A-Za-z]+)(\(\.\$udim\))?$')
+
+
+def validate_rules(rules):
+    """Check the structure and consistency of the rules.
+
+    Arguments:
+        rules {dict} -- the merged rules.
+
+    Returns:
+        list -- error messages. An empty list means the rules are valid.
+    """
+    errors = []
+
+    def _err(path, msg, *args):
+        errors.append('%s: %s' % (path, msg % args))
+
+    def _dict(path, data, key, optional=False):
+        val = data.get(key, None) if isinstance(data, dict) else None
+        if val is None and optional:
+            return {}
+        if not isinstance(val, dict):
+            _err(path, '%r should be a dict', key)
+            return {}
+        return val
+
+    def _params(path, params):
+        for pname, pdict in params.items():
+            ppath = '%s.%s' % (path, pname)
+            if not IDENTIFIER.match(pname):
+                _err(ppath, 'invalid param name %r', pname)
+            if not isinstance(pdict, dict) or 'type' not in pdict or \
+                    'value' not in pdict:
+                _err(ppath, 'expected {"type": ..., "value": ...}')
+
+    models = _dict('rules', rules, 'models')
+    if not models:
+        _err('rules.models', 'no model defined')
+    exported = set()
+    xcfg = _dict('rules', rules, 'export_config')
+    if xcfg:
+        presets = xcfg.get('exportPresets', [])
+        if not isinstance(presets, list):
+            _err('rules.export_config.exportPresets', 'should be a list')
+            presets = []
+        names = [p.get('name', None) for p in presets if isinstance(p, dict)]
+        default = xcfg.get('defaultExportPreset', None)
+        if default not in names:
+            _err('rules.export_config.defaultExportPreset',
+                 '%r is not in exportPresets %r', default, names)
+        for i, preset in enumerate(presets):
+            ppath = 'rules.export_config.exportPresets[%d]' % i
+            if not isinstance(preset, dict):
+                _err(ppath, 'should be a dict')
+                continue
+            xmaps = preset.get('maps', [])
+            if not isinstance(xmaps, list):
+                _err(ppath + '.maps', 'should be a list')
+                continue
+            for j, xmap in enumerate(xmaps):
+                mpath = '%s.maps[%d]' % (ppath, j)
+                if not isinstance(xmap, dict):
+                    _err(mpath, 'should be a dict')
+                    continue
+                fname = xmap.get('fileName', None)
+                match = EXPORTED_CHANNEL.search(fname) \
+                    if isinstance(fname, str) else None
+                if not match:
+                    _err(mpath, 'fileName %r should end with _<Channel>(.$udim)',
+                         fname)
+                elif preset.get('name', None) == default:
+                    exported.add(match.group(1))
+                chans = xmap.get('channels', None)
+                if not chans or not isinstance(chans, list):
+                    _err(mpath, 'no channels')
+                    continue
+                for k, chan in enumerate(chans):
+                    kpath = '%s.channels[%d]' % (mpath, k)
+                    if not isinstance(chan, dict):
+                        _err(kpath, 'should be a dict')
+                        continue
+                    for key in ('srcChannel', 'destChannel', 'srcMapType',
+                                'srcMapName'):
+                        if key not in chan:
+                            _err(kpath, '%r is missing', key)
+
+    packing = _dict('rules', rules, 'packing', optional=True)
+    if packing:
+        if not IDENTIFIER.match(packing.get('name', '') or ''):
+            _err('rules.packing.name', 'invalid map name %r',
+                 packing.get('name', None))
+        for comp in _dict('rules.packing', packing, 'channels'):
+            if comp not in PACKING_COMPONENTS:
+                _err('rules.packing.channels', 'invalid component %r: '
+                     'expected one of %r', comp, PACKING_COMPONENTS)
+
+    for model, mdict in models.items():
+        path = 'rules.models.%s' % model
+        mapping = _dict(path, mdict, 'mapping')
+        for ch_type, chdict in mapping.items():
+            cpath = '%s.mapping.%s' % (path, ch_type)
+            if not isinstance(chdict, dict):
+                _err(cpath, 'should be a dict')
+                continue
+            for key in ('param', 'type', 'ocio'):
+                if key not in chdict:
+                    _err(cpath, '%r is missing', key)
+            if chdict.get('type', None) not in VALID_TYPES:
+                _err(cpath, 'invalid type %r: expected one of %r',
+                     chdict['type'], VALID_TYPES)
+            if 'param' in chdict and chdict['param'] is None and \
+                    chdict.get('type', None) is not None:
+                # only texture-only channels are not connected.
+                _err(cpath, 'a null param requires a null type')
+            default = chdict.get('default', None)
+            if default is not None and not (
+                    isinstance(default, list) and len(default) in (3, 4) and
+                    all(isinstance(v, (int, float)) and 0.0 <= v <= 1.0
+                        for v in default)):
+                _err(cpath, 'default should be a list of 3 or 4 values '
+                     'between 0 and 1')
+            priority = chdict.get('priority', 1.0)
+            if not isinstance(priority, (int, float)) or \
+                    not 0.0 < priority <= 1.0:
+                _err(cpath, 'priority should be a number in ]0, 1]')
+            if chdict.get('param', None) is not None and exported and \
+                    ch_type not in exported:
+                _err(cpath, 'no map of the default export preset produces '
+                     'this channel: %s', ', '.join(sorted(exported)))
+        settings = _dict(path, mdict, 'settings', optional=True)
+        for target, params in settings.items():
+            spath = '%s.settings.%s' % (path, target)
+            if target != 'bxdf' and target not in mapping:
+                _err(spath, 'should be "bxdf" or a mapped channel')
+            if not isinstance(params, dict):
+                _err(spath, 'should be a dict')
+                continue
+            _params(spath, params)
+        graph = _dict(path, mdict, 'graph', optional=True)
+        nodes = _dict('%s.graph' % path, graph, 'nodes', optional=True)
+        for nname, ndict in nodes.items():
+            npath = '%s.graph.nodes.%s' % (path, nname)
+            if not IDENTIFIER.match(nname):
+                _err(npath, 'invalid node name %r', nname)
+            if not isinstance(ndict, dict) or 'nodetype' not in ndict:
+                _err(npath, '"nodetype" is missing')
+                continue
+            if ndict.get('category', 'pattern') not in ('pattern', 'bxdf'):
+                _err(npath, 'invalid category %r', ndict['category'])
+            _params(npath + '.params', _dict(npath, ndict, 'params', True))
+        for i, con in enumerate(graph.get('connections', [])):
+            cpath = '%s.graph.connections[%d]' % (path, i)
+            for end in ('src', 'dst'):
+                edict = con.get(end, None) if isinstance(con, dict) else None
+                epath = '%s.%s' % (cpath, end)
+                if not isinstance(edict, dict):
+                    _err(epath, 'is missing')
+                    continue
+                keys = ('node', 'param', 'type') if end == 'dst' else \
+                    ('node', 'param')
+                for key in keys:
+                    if key not in edict:
+                        _err(epath, '%r is missing', key)
+                node = edict.get('node', '')
+                if node.startswith('ch:'):
+                    if node[3:] not in mapping:
+                        _err(epath, 'unknown channel %r', node[3:])
+                elif node != model and node not in nodes:
+                    _err(epath, 'unknown node %r', node)
+                param = edict.get('param', '')
+                if not IDENTIFIER.match(param or ''):
+                    _err(epath, 'invalid param name %r', param)
+    return errors
+
+
+def merge_dicts(base, over):
+    """Returns a deep merge of 2 dicts: values from 'over' win, lists are
+    replaced."""
+    result = dict(base)
+    for k, v in over.items():
+        if isinstance(v, dict) and isinstance(result.get(k, None), dict):
+            result[k] = merge_dicts(result[k], v)
+        else:
+            result[k] = v
+    return result
+
+
+def compile_rules(rules):
+    """Pre-digest the models, so the graph builder doesn't have to
+    interpret the rules for each texture set.
+
+    Returns:
+        dict -- per model: 'direct' maps a channel to a (src plug,
+                dst param, dst type) tuple for direct bxdf connections.
+                'connections' is a list of ((kind, node, param),
+                (kind, node, param, type)) tuples, with kind in 'bxdf',
+                'ch' or 'node'. 'packable' is the set of scalar channels that
+                can be packed in a multi-channel texture.
+    """
+    plugs = {'normal': 'resultN', 'color': 'resultRGB', 'float': 'resultR'}
+    compiled = {}
+    for model, mdict in rules.get('models', {}).items():
+        direct = {}
+        for ch_type, mapping in mdict.get('mapping', {}).items():
+            if mapping['param'] == 'graph':
+                continue
+            if mapping['type'] not in plugs:
+                continue
+            direct[ch_type] = (plugs[mapping['type']], mapping['param'],
+                               mapping['type'])
+
+        def _end(node_dict, model=model):
+            node = node_dict['node']
+            if node == model:
+                return ('bxdf', node, node_dict['param'])
+            if node.startswith('ch:'):
+                return ('ch', node[3:], node_dict['param'])
+            return ('node', node, node_dict['param'])
+
+        # scalar data channels can share a texture if they don't need any
+        # specific texture settings.
+        packable = set()
+        settings = mdict.get('settings', None) or {}
+        for ch_type, mapping in mdict.get('mapping', {}).items():
+            tex_settings = settings.get(ch_type, {})
+            if mapping['type'] == 'float' and mapping['ocio'] == 'data' and \
+                    all(v['value'] == 0 for v in tex_settings.values()):
+                packable.add(ch_type)
+
+        connections = []
+        graph = mdict.get('graph', None) or {}
+        for con in graph.get('connections', []):
+            connections.append(
+                (_end(con['src']), _end(con['dst']) + (con['dst']['type'],)))
+        compiled[model] = {'direct': direct, 'connections': connections,
+                           'packable': packable}
+    return compiled
+
+
+TextureSetInfo = collections.namedtuple(
+    'TextureSetInfo', 'name is_udim resolution channels tiles')
+
+OCIO_RENDERING = 'rendering'
+
+
+class OcioError(ValueError):
+    """Raised when the OCIO config can not be used for an export."""
+
+
+def ocio_colorspaces(text):
+    """Returns the names of the color spaces, aliases and roles defined by
+    an OCIO config. This only reads what we need and doesn't depend on a
+    yaml parser."""
+    names = set()
+    section = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if not line[0].isspace():
+            section = stripped.split(':', 1)[0]
+            continue
+        key, _, value = stripped.lstrip('- ').partition(':')
+        key, value = key.strip(), value.strip()
+        if section == 'roles':
+            names.add(key)
+        elif section in ('colorspaces', 'display_colorspaces'):
+            if key == 'name':
+                names.add(value.strip('"\''))
+            elif key == 'aliases':
+                names.update(a.strip().strip('"\'')
+                             for a in value.strip('[]').split(',') if a.strip())
+    return names
+
+
+class OcioConfig(object):
+    """An OCIO config, read once per export to check the color spaces used
+    by the rules before any map is exported.
+
+    The txmake transform arguments are derived from it and its digest is part
+    of the conversion signature: editing the config invalidates the converted
+    textures. txmake converts one file per process, so each process still
+    loads the config.
+    """
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path
+        self.digest = None
+        self.colorspaces = frozenset()
+        if path:
+            try:
+                with open(path, 'rb') as fhdl:
+                    data = fhdl.read()
+            except (OSError, IOError) as err:
+                raise OcioError('Can not read the OCIO config: %s' % err)
+            self.digest = hashlib.sha1(data).hexdigest()
+            self.colorspaces = frozenset(
+                ocio_colorspaces(data.decode('utf-8', 'replace')))
+
+    def check(self, colorspaces):
+        """Raises OcioError if a colorspace is not defined by the config."""
+        if not self.path:
+            return
+        missing = (set(colorspaces) | {OCIO_RENDERING}) - self.colorspaces
+        if missing:
+            raise OcioError('%s does not define: %s' % (
+                self.path, ', '.join(sorted(missing))))
+
+    def transform(self, colorspace):
+        """Returns the txmake arguments converting colorspace to the
+        rendering space."""
+        if not self.path:
+            return []
+        return ['-ocioconfig', self.path,
+                '-ocioconvert', colorspace, OCIO_RENDERING]
+
+    def signature(self, colorspace):
+        if not self.path:
+            return None
+        return [self.digest, colorspace, OCIO_RENDERING]
+
+
+MAP_FILE = re.compile(r'^(.*?)(?:\.(\d{4}))?(\.\w+)?$')
+EXPORTED_FILE = re.compile(r'_([A-Za-z]+)(\.\d{4})*\.\w{3}$')
+
+
+class MapFiles(object):
+    """The files of an exported map, stored as a shared directory, the file
+    name around the UDIM tile number and an array of tiles. It behaves like a
+    read-only list of paths, which are only built when needed."""
+
+    __slots__ = ('dir', 'prefix', 'suffix', 'tiles', 'extra')
+
+    def __init__(self, dirname, prefix, suffix):
+        self.dir = dirname
+        self.prefix = prefix
+        self.suffix = suffix
+        self.tiles = array.array('H')
+        # files that don't follow the naming of the first one.
+        self.extra = None
+
+    def add(self, dirname, prefix, tile, suffix, fpath):
+        if dirname is self.dir and prefix == self.prefix and \
+                suffix == self.suffix:
+            self.tiles.append(tile)
+        elif self.extra is None:
+            self.extra = [fpath]
+        else:
+            self.extra.append(fpath)
+
+    def path(self, tile):
+        if tile:
+            return os.path.join(
+                self.dir, '%s.%04d%s' % (self.prefix, tile, self.suffix))
+        return os.path.join(self.dir, self.prefix + self.suffix)
+
+    def __iter__(self):
+        for tile in self.tiles:
+            yield self.path(tile)
+        for fpath in self.extra or ():
+            yield fpath
+
+    def __len__(self):
+        return len(self.tiles) + len(self.extra or ())
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if 0 <= idx < len(self.tiles):
+            return self.path(self.tiles[idx])
+        return (self.extra or [])[idx - len(self.tiles)]
+
+
+class ExportManifest(object):
+    """The exported maps, keyed by texture set and channel.
+
+    Directories are interned and tiles are stored in arrays, so the manifest
+    grows with the number of maps rather than the number of tiles.
+    """
+
+    def __init__(self):
+        self._dirs = {}
+        self.maps = {}
+
+    def add(self, tset, channel, fpath):
+        dirname, basename = os.path.split(fpath)
+        dirname = self._dirs.setdefault(dirname, dirname)
+        prefix, tile, suffix = MAP_FILE.match(basename).groups()
+        suffix = suffix or ''
+        tset_maps = self.maps.setdefault(tset, {})
+        if channel not in tset_maps:
+            tset_maps[channel] = MapFiles(dirname, prefix, suffix)
+        tset_maps[channel].add(dirname, prefix, int(tile or 0), suffix, fpath)
+
+    def __contains__(self, tset):
+        return tset in self.maps
+
+    def __getitem__(self, tset):
+        return self.maps[tset]
+
+    def get(self, tset, default=None):
+        return self.maps.get(tset, default)
+
+    def paths(self):
+        """Iterate over all exported files."""
+        for tset_maps in self.maps.values():
+            for mfiles in tset_maps.values():
+                for fpath in mfiles:
+                    yield fpath
+
+    def to_json(self):
+        dirs = list(self._dirs)
+        index = dict((d, i) for i, d in enumerate(dirs))
+        return {'dirs': dirs, 'maps': dict(
+            (tset, dict((ch, [index[m.dir], m.prefix, m.suffix,
+                              m.tiles.tolist(), m.extra])
+                        for ch, m in tset_maps.items()))
+            for tset, tset_maps in self.maps.items())}
+
+    @classmethod
+    def from_json(cls, data):
+        manifest = cls()
+        dirs = [manifest._dirs.setdefault(d, d) for d in data['dirs']]
+        for tset, tset_maps in data['maps'].items():
+            manifest.maps[tset] = {}
+            for ch, (dir_id, prefix, suffix, tiles, extra) in tset_maps.items():
+                mfiles = MapFiles(dirs[dir_id], prefix, suffix)
+                mfiles.tiles.extend(tiles)
+                mfiles.extra = extra
+                manifest.maps[tset][ch] = mfiles
+        return manifest
+
+
+class ExportJob(object):
+    """The options and state of an export, from the map export to the
+    installation of the assets in the library."""
+
+    def __init__(self, label, bxdf, ocio_config, pack, rules, compiled,
+                 rules_key, ocio=None):
+        self.label = label
+        self.bxdf = bxdf
+        self.ocio_config = ocio_config
+        self.ocio = ocio or OcioConfig(ocio_config['config'])
+        self.pack = pack
+        # don't convert the UDIM tiles holding the channel's default value.
+        self.skip_tiles = False
+        # texture memory budget per asset, in bytes. 0 means no budget.
+        self.budget = 0
+        # file format of the maps handed over to txmake.
+        self.handoff = 'png'
+        # use the normal map holding the height, without a bump node.
+        self.fold_height = False
+        # number of lower resolution variants of each texture.
+        self.variants = 0
+        # only export the texture sets changed since the last export to the
+        # same asset.
+        self.only_changed = False
+        # the exported texture sets, or None for all of them.
+        self.only = None
+        # the project's path, the library asset (category path and label)
+        # and the dirty tracker's sequence number at the start of the export.
+        self.project = None
+        self.target = None
+        self.seq = 0
+        # overrides the 'txmake jobs' pref.
+        self.jobs = None
+        # run txmake at a lower priority.
+        self.low_priority = False
+        self.rules = rules
+        self.bxdf_rules = rules['models'][bxdf]
+        self.compiled = compiled
+        self.rules_key = rules_key
+        self.journal = None
+        self.export_path = None
+        # TextureSetInfo list
+        self.tsets = []
+        # ExportManifest of the exported maps
+        self.files = ExportManifest()
+        # packed channels' components, keyed by texture set
+        self.packed = {}
+        # (label, path) of the assets ready to be installed
+        self.assets = []
+        # texture set name, keyed by asset label
+        self.sources = {}
+        # preview type requested by the preset browser
+        self.preview = None
+        self.start = time.time()
+
+
+class ExportJournal(object):
+    """Records the progress of an export in a json file inside the export
+    directory, so an interrupted export can be resumed.
+
+    The export directory name is derived from everything that affects the
+    export's output: a later export with the same project, options and rules
+    will find the journal and skip the completed steps.
+    """
+
+    version = 2
+
+    def __init__(self, project, options):
+        key = hashlib.sha1(json.dumps(
+            [project, options], sort_keys=True).encode('utf-8')).hexdigest()
+        self.dir = os.path.join(tempfile.gettempdir(), 'rfsp_export_' + key[:16])
+        self.file = os.path.join(self.dir, 'journal.json')
+        self.data = {}
+
+    def start(self, project_state):
+        """Load a compatible journal or start a new one.
+
+        Arguments:
+            project_state {dict} -- describes the saved state of the project.
+                                    None if it can not be trusted (unsaved
+                                    changes): the export won't be resumable.
+
+        Returns:
+            bool -- True if we are resuming a previous export.
+        """
+        data = {}
+        if project_state and os.path.isfile(self.file):
+            try:
+                with open(self.file, 'r') as fhdl:
+                    data = json.load(fhdl)
+            except (OSError, IOError, ValueError):
+                data = {}
+        if data.get('version', None) == self.version and \
+                data.get('project', None) == project_state:
+            self.data = data
+            return True
+        if os.path.isdir(self.dir):
+            shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir)
+        self.data = {'version': self.version, 'project': project_state,
+                     'exported': None, 'converted': {}, 'saved': [],
+                     'installed': []}
+        self.save()
+        return False
+
+    def save(self):
+        tmp = self.file + '.tmp'
+        with open(tmp, 'w') as fhdl:
+            json.dump(self.data, fhdl)
+        os.replace(tmp, self.file)
+
+    def set_exported(self, files, packed):
+        self.data['exported'] = {'files': files.to_json(), 'packed': packed}
+        self.save()
+
+    def exported(self):
+        """Returns the ExportManifest and packed channels if all the
+        exported files are still there, otherwise None."""
+        exported = self.data.get('exported', None)
+        if not exported:
+            return None
+        files = ExportManifest.from_json(exported['files'])
+        if not all(os.path.exists(f) for f in files.paths()):
+            return None
+        return files, exported['packed']
+
+    def converted(self, dst, signature):
+        key = os.path.relpath(dst, self.dir)
+        return self.data['converted'].get(key, None) == signature and \
+            os.path.exists(dst)
+
+    def set_converted(self, dst, signature, save=True):
+        self.data['converted'][os.path.relpath(dst, self.dir)] = signature
+        if save:
+            self.save()
+
+    def mark(self, step, label):
+        if label not in self.data[step]:
+            self.data[step].append(label)
+            self.save()
+
+    def done(self, step, label):
+        return label in self.data[step]
+
+    def finish(self):
+        """The export succeeded: we don't need the export directory
+        anymore."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class LibraryIndex(object):
+    """A compact json index of the assets of a library, stored at the root
+    of the library.
+
+    Categories are re-scanned lazily, only when their directory's mtime
+    differs from the indexed one. Installed assets are added incrementally.
+    The index is shared by all artists using the library: our changes are
+    merged with the index file when saving.
+    """
+
+    version = 1
+    filename = '.rfsp_index.json'
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        self.file = os.path.join(self.root, self.filename)
+        self.data = self._load() or {'version': self.version,
+                                     'categories': {}}
+        self._dirty = False
+        self._lock = threading.RLock()
+        # the changes to merge: the re-scanned categories, the updated
+        # assets of the other categories and their mtime before the first
+        # update.
+        self._scanned = set()
+        self._updated = {}
+        self._base = {}
+
+    def _load(self):
+        try:
+            with open(self.file, 'r') as fhdl:
+                data = json.load(fhdl)
+        except (OSError, IOError, ValueError):
+            return None
+        if data.get('version', None) != self.version:
+            return None
+        return data
+
+    def _key(self, category_dir):
+        return os.path.relpath(category_dir, self.root).replace(os.sep, '/')
+
+    def category(self, category_dir):
+        """Returns the indexed assets of a category directory, keyed by
+        asset directory name. The category is re-scanned if it changed."""
+        key = self._key(category_dir)
+        try:
+            mtime = os.stat(category_dir).st_mtime
+        except OSError:
+            return {}
+        with self._lock:
+            entry = self.data['categories'].get(key, None)
+            if entry is None or entry['mtime'] != mtime:
+                entry = {'mtime': mtime, 'assets': {}}
+                for name in os.listdir(category_dir):
+                    if name.endswith('.rma'):
+                        info = read_asset_info(os.path.join(category_dir, name))
+                        if info:
+                            entry['assets'][name] = info
+                self.data['categories'][key] = entry
+                self._scanned.add(key)
+                self._dirty = True
+            return entry['assets']
+
+    def categories(self):
+        with self._lock:
+            return sorted(self.data['categories'])
+
+    def find(self, category_dir):
+        """Returns the sorted paths of the assets of a category directory."""
+        category_dir = os.path.normpath(category_dir)
+        return [os.path.join(category_dir, name)
+                for name in sorted(self.category(category_dir))]
+
+    def update_asset(self, asset_dir, before=None):
+        """Index a newly installed asset. Only its entry is updated: the
+        install changed the category's mtime, which would otherwise trigger
+        a re-scan of the whole category.
+
+        Arguments:
+            before {float} -- the category directory's mtime before the
+                install. The indexed mtime is only updated if it matches:
+                otherwise other assets were installed or removed since the
+                last scan, and the category must be re-scanned.
+        """
+        category_dir, name = os.path.split(os.path.normpath(asset_dir))
+        key = self._key(category_dir)
+        with self._lock:
+            entry = self.data['categories'].get(key, None)
+            if entry is None:
+                # the first scan of the category finds the new asset.
+                self.category(category_dir)
+                return
+            info = read_asset_info(asset_dir)
+            if info:
+                entry['assets'][name] = info
+            else:
+                entry['assets'].pop(name, None)
+            self._updated.setdefault(key, {})[name] = info
+            self._base.setdefault(key, entry['mtime'])
+            if before is not None and before == entry['mtime']:
+                try:
+                    entry['mtime'] = os.stat(category_dir).st_mtime
+                except OSError:
+                    pass
+            self._dirty = True
+
+    def _merge(self, data):
+        """Apply our changes to the index saved by another session."""
+        categories = data['categories']
+        for key in self._scanned:
+            categories[key] = self.data['categories'][key]
+        for key, assets in self._updated.items():
+            entry = categories.get(key, None)
+            if key in self._scanned or entry is None:
+                categories[key] = self.data['categories'][key]
+                continue
+            for name, info in assets.items():
+                if info:
+                    entry['assets'][name] = info
+                else:
+                    entry['assets'].pop(name, None)
+            if entry['mtime'] == self._base[key]:
+                entry['mtime'] = self.data['categories'][key]['mtime']
+            else:
+                # the category was re-scanned or changed by another
+                # session since we loaded it.
+                entry['mtime'] = None
+        return data
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = self._load()
+            if data is not None:
+                self.data = self._merge(data)
+            tmp = '%s.%s.tmp' % (self.file, os.getpid())
+            try:
+                with open(tmp, 'w') as fhdl:
+                    json.dump(self.data, fhdl, separators=(',', ':'))
+                os.replace(tmp, self.file)
+            except (OSError, IOError) as err:
+                LOG.warning('Could not save library index: %s', err)
+            else:
+                self._dirty = False
+                self._scanned, self._updated, self._base = set(), {}, {}
+
+
+def file_digest(fpath):
+    """Returns the sha1 of a file's content."""
+    sha = hashlib.sha1()
+    with open(fpath, 'rb') as fhdl:
+        for chunk in iter(functools.partial(fhdl.read, 1048576), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class TextureStore(object):
+    """A content-addressed store of textures at the root of a library.
+
+    Each texture is stored once, named after the sha1 of its content, and
+    the assets hold hard links to the stored files, or symbolic links if the
+    file system doesn't support hard links. Each asset lists its stored
+    textures in a json file, used by the garbage collector.
+    """
+
+    dirname = '.rfsp_store'
+    refs_file = '.rfsp_store_refs.json'
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        self.dir = os.path.join(self.root, self.dirname)
+
+    def blob_path(self, digest):
+        return os.path.join(self.dir, digest[:2], digest + '.tex')
+
+    def put(self, fpath):
+        """Move a file to the store, unless an identical one is already
+        stored, and returns its digest."""
+        digest = file_digest(fpath)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            os.remove(fpath)
+            touch_blob(blob)
+            return digest
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp = '%s.%d.tmp' % (blob, os.getpid())
+        shutil.move(fpath, tmp)
+        # stored files are shared: they should never be edited in place.
+        os.chmod(tmp, 0o444)
+        try:
+            os.replace(tmp, blob)
+        except OSError:
+            # another process stored the same file in the meantime.
+            if not os.path.exists(blob):
+                raise
+            os.remove(tmp)
+        # the moved file keeps its mtime: reset it for the gc's grace period.
+        touch_blob(blob)
+        return digest
 
-    def debug_warning(self, msg, *args):
-        if self.loglevel >= int(spl.DBG_WARNING):    # 4
-            spl.log(spl.WARNING, self.channel, msg % args)
+    def ingest(self, asset_dir):
+        """Move the asset's textures to the store and record them in the
+        asset's refs file. Ingesting the same asset again only adds the new
+        textures, so an interrupted install can be resumed.
 
-    def debug_info(self, msg, *args):
-        if self.loglevel >= int(spl.DBG_INFO):       # 3
-            spl.log(spl.INFO, self.channel, msg % args)
+        Returns:
+            dict -- the digests, keyed by path relative to the asset.
+        """
+        refs = self.refs(asset_dir)
+        for dirpath, _, filenames in os.walk(asset_dir):
+            for fname in filenames:
+                if not fname.endswith('.tex'):
+                    continue
+                fpath = os.path.join(dirpath, fname)
+                rel = os.path.relpath(fpath, asset_dir).replace(os.sep, '/')
+                refs[rel] = self.put(fpath)
+        with open(os.path.join(asset_dir, self.refs_file), 'w') as fhdl:
+            json.dump(refs, fhdl, indent=1, sort_keys=True)
+        return refs
 
-    def error(self, msg, *args):
-        if self.loglevel >= int(spl.ERROR):          # 2
-            spl.log(spl.ERROR, self.channel, msg % args)
+    def refs(self, asset_dir):
+        """Returns the stored textures of an asset, keyed by path."""
+        try:
+            with open(os.path.join(asset_dir, self.refs_file), 'r') as fhdl:
+                return json.load(fhdl)
+        except (OSError, IOError, ValueError):
+            return {}
 
-    def warning(self, msg, *args):
-        if self.loglevel >= int(spl.WARNING):        # 1
-            spl.log(spl.WARNING, self.channel, msg % args)
+    def link(self, asset_dir):
+        """Create the links to the asset's stored textures."""
+        for rel, digest in self.refs(asset_dir).items():
+            dst = os.path.join(asset_dir, *rel.split('/'))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            link_file(self.blob_path(digest), dst)
 
-    def info(self, msg, *args):
-        if self.loglevel >= int(spl.INFO):           # 0
-            spl.log(spl.INFO, self.channel, msg % args)
+    def gc(self, grace=3600.0):
+        """Delete the stored files that no asset of the library refers to.
+        Files younger than 'grace' seconds are kept, as they may belong to
+        an install in progress. Run it from Substance Painter's python
+        console:
 
+            import renderman_for_sp
+            renderman_for_sp.TextureStore('/path/to/library').gc()
 
-LOG = Log(loglevel=spl.ERROR)
+        Returns:
+            tuple -- the number of deleted files and the bytes freed.
+        """
+        used = set()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root and self.dirname in dirnames:
+                dirnames.remove(self.dirname)
+            if self.refs_file in filenames:
+                used.update(self.refs(dirpath).values())
+                dirnames[:] = []
+        removed, freed = 0, 0
+        limit = time.time() - grace
+        for dirpath, _, filenames in os.walk(self.dir):
+            for fname in filenames:
+                digest, ext = os.path.splitext(fname)
+                fpath = os.path.join(dirpath, fname)
+                if ext != '.tex' or digest in used:
+                    continue
+                try:
+                    fstat = os.stat(fpath)
+                    if fstat.st_mtime > limit:
+                        continue
+                    # windows can't delete read-only files.
+                    os.chmod(fpath, stat.S_IWRITE)
+                    os.remove(fpath)
+                except OSError as err:
+                    LOG.warning('store: could not remove %s: %s', fpath, err)
+                    continue
+                removed += 1
+                freed += fstat.st_size
+        LOG.info('store: removed %d unused files, %.1f MB', removed,
+                 freed / 1048576.0)
+        return removed, freed
 
 
-def root_dir():
-    """Returns the path the dir from which this plugin is executed."""
+def touch_blob(blob):
+    """Set a stored file's mtime to now, so the gc keeps it while it is
+    being installed."""
     try:
-        this_file_path = __file__
-    except NameError:
-        this_file_path = os.path.abspath(inspect.stack()[0][1])
-    root = os.path.dirname(this_file_path)
-    return root
+        os.utime(blob, None)
+    except OSError as err:
+        # owned by another user: the gc may remove it after the grace period.
+        LOG.debug_warning('store: could not touch %s: %s', blob, err)
 
 
-def pick_directory(*args):
-    libpath = QFileDialog.getExistingDirectory(
-        None, 'Select a directory...')
-    args[0].setText(libpath)
-    LOG.info('pick_directory%s', str(args))
+def remove_readonly(func, path, _):
+    """shutil.rmtree error handler: windows can't delete the read-only links
+    to the stored textures, so the read-only bit is cleared and the removal
+    retried."""
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
 
 
-class Prefs(object):
+def link_file(src, dst):
+    """Replace dst with a hard link to src, or a symbolic link if hard
+    links are not supported. Copies the file as a last resort."""
+    tmp = '%s.%d.tmp' % (dst, os.getpid())
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            os.symlink(src, tmp)
+        except OSError:
+            LOG.warning('Could not link %s: copying', dst)
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
 
-    def __init__(self):
-        self.prefs = {}
-        self.root = root_dir()
-        self.file = os.path.join(self.root, 'renderman.prefs')
-        self.load()
-        LOG.debug_info('Prefs created')
 
-    def load(self):
-        if os.path.exists(self.file):
-            with open(self.file, 'r') as fhdl:
-                self.prefs = json.load(fhdl)
-            LOG.debug_info('Loaded: %s', self.file)
-        else:
-            LOG.debug_warning('NOT loaded: %s', self.file)
+def replace_asset(src, dst_dir, store=None):
+    """Move an asset directory to a category, replacing the asset with the
+    same name."""
+    dst_asset = os.path.join(dst_dir, os.path.basename(src))
+    if os.path.islink(dst_asset):
+        # a versioned asset: the versions are left untouched.
+        os.remove(dst_asset)
+    elif os.path.exists(dst_asset):
+        os.rename(dst_asset, dst_asset + '_old')
+        shutil.rmtree(dst_asset + '_old', onerror=remove_readonly)
+    shutil.move(src, dst_dir)
+    if store:
+        store.link(dst_asset)
 
-    def save(self):
-        with open(self.file, mode='w') as fhdl:
-            json.dump(self.prefs, fhdl, sort_keys=False, indent=4)
-        LOG.debug_info('PREFS SAVED: %s', self.file)
 
-    def set(self, key, val):
-        self.prefs[key] = val
+def supports_symlinks(dir_path):
+    """True if symbolic links can be created in a directory: windows only
+    allows them in developer mode or with admin rights."""
+    probe = os.path.join(dir_path, '.rfsp_symlink.%d.tmp' % os.getpid())
+    try:
+        os.symlink('rfsp_probe', probe)
+    except (OSError, NotImplementedError):
+        return False
+    os.remove(probe)
+    return True
 
-    def get(self, key, default):
-        return self.prefs.get(key, default)
 
-    def __del__(self):
-        self.save()
+class AssetVersions(object):
+    """The installed versions of an asset.
+
+    The versions are stored in a hidden directory next to the asset, which
+    is a symbolic link to the current version. Installing a version builds
+    a new directory, hard-linking the textures that didn't change since the
+    current version, and switches the link atomically. Each version lists
+    its textures' digests, so the unchanged ones are found without reading
+    the previous version's files.
+
+    If the file system doesn't support symbolic links, the current version
+    is renamed to the asset's directory and a 'current' file records its
+    number: the switch is then not atomic.
+    """
+
+    digests_file = '.rfsp_digests.json'
+
+    def __init__(self, asset_dir):
+        self.current = os.path.normpath(asset_dir)
+        category_dir, name = os.path.split(self.current)
+        self.dir = os.path.join(category_dir, '.%s.versions' % name)
+        self.current_file = os.path.join(self.dir, 'current')
+
+    def versions(self):
+        """Returns the sorted version numbers, except the current one if it
+        isn't linked."""
+        try:
+            names = os.listdir(self.dir)
+        except OSError:
+            return []
+        return sorted(int(n[1:]) for n in names
+                      if n.startswith('v') and n[1:].isdigit())
+
+    def path(self, version):
+        return os.path.join(self.dir, 'v%04d' % version)
+
+    def version_dir(self, version):
+        """Returns the directory holding a version."""
+        if not os.path.islink(self.current) and \
+                version == self.current_version():
+            return self.current
+        return self.path(version)
+
+    def current_version(self):
+        """Returns the current version number, or None."""
+        if os.path.islink(self.current):
+            name = os.path.basename(os.readlink(self.current))
+            return int(name[1:]) if name[1:].isdigit() else None
+        if not os.path.isdir(self.current):
+            return None
+        try:
+            with open(self.current_file, 'r') as fhdl:
+                return int(fhdl.read())
+        except (OSError, IOError, ValueError):
+            return None
+
+    def install(self, src, store=None, keep=3):
+        """Install an asset directory as a new version and make it current.
+        The source directory is deleted once installed.
+
+        Returns:
+            str -- the new version's directory.
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        # check before moving anything: the asset must stay usable.
+        linked = supports_symlinks(self.dir)
+        previous = self.current_version()
+        if previous is None and os.path.isdir(self.current):
+            # an asset installed without versions becomes the first one.
+            previous = max(self.versions() + [0]) + 1
+            if linked:
+                os.rename(self.current, self.path(previous))
+                self._switch(previous, linked)
+            else:
+                self._set_current(previous)
+        version = max(self.versions() + [previous or 0]) + 1
+        vdir = self.path(version)
+        tmp = '%s.%d.tmp' % (vdir, os.getpid())
+        # the source is copied, so a failed install can be resumed.
+        try:
+            self._build(src, tmp, previous)
+            if store:
+                store.link(tmp)
+        except BaseException:
+            shutil.rmtree(tmp, onerror=remove_readonly)
+            raise
+        os.rename(tmp, vdir)
+        shutil.rmtree(src, onerror=remove_readonly)
+        self._switch(version, linked)
+        self.prune(keep)
+        return self.version_dir(version)
+
+    def digests(self, version):
+        """Returns the textures' digests of a version, keyed by path."""
+        fpath = os.path.join(self.version_dir(version), self.digests_file)
+        try:
+            with open(fpath, 'r') as fhdl:
+                return json.load(fhdl)
+        except (OSError, IOError, ValueError):
+            return {}
+
+    def _build(self, src, tmp, previous):
+        """Copy an asset directory, hard-linking the textures identical to
+        the previous version's."""
+        old_digests = {} if previous is None else self.digests(previous)
+        digests = {}
+        for dirpath, _, filenames in os.walk(src):
+            rel = os.path.relpath(dirpath, src)
+            os.makedirs(os.path.normpath(os.path.join(tmp, rel)), exist_ok=True)
+            for fname in filenames:
+                fpath = os.path.join(dirpath, fname)
+                dst = os.path.normpath(os.path.join(tmp, rel, fname))
+                if fname.endswith('.tex'):
+                    key = os.path.normpath(os.path.join(rel, fname)).replace(
+                        os.sep, '/')
+                    digests[key] = file_digest(fpath)
+                    if old_digests.get(key, None) == digests[key]:
+                        old = os.path.join(self.version_dir(previous),
+                                           *key.split('/'))
+                        try:
+                            os.link(old, dst)
+                        except OSError:
+                            pass
+                        else:
+                            continue
+                shutil.copy2(fpath, dst)
+        with open(os.path.join(tmp, self.digests_file), 'w') as fhdl:
+            json.dump(digests, fhdl, indent=1, sort_keys=True)
+
+    def _switch(self, version, linked):
+        if not linked:
+            previous = self.current_version()
+            if previous is not None:
+                os.rename(self.current, self.path(previous))
+            os.rename(self.path(version), self.current)
+            self._set_current(version)
+            return
+        tmp = '%s.%d.tmp' % (self.current, os.getpid())
+        os.symlink(os.path.relpath(self.path(version),
+                                   os.path.dirname(self.current)), tmp)
+        os.replace(tmp, self.current)
+
+    def _set_current(self, version):
+        tmp = '%s.%d.tmp' % (self.current_file, os.getpid())
+        with open(tmp, 'w') as fhdl:
+            fhdl.write(str(version))
+        os.replace(tmp, self.current_file)
+
+    def prune(self, keep):
+        """Delete the oldest versions, keeping 'keep' versions including the
+        current one."""
+        current = self.current_version()
+        old = [v for v in self.versions() if v != current]
+        for version in old[:max(0, len(old) - max(0, keep - 1))]:
+            shutil.rmtree(self.path(version), onerror=remove_readonly)
+
+
+class LockTimeout(OSError):
+    """Raised when an asset lock could not be acquired in time."""
+
+
+class AssetLock(object):
+    """An exclusive lock on an asset of a library shared by several hosts.
+
+    The lock is a file next to the asset, created with O_EXCL. Its mtime is
+    refreshed while the lock is held: a lock that wasn't refreshed for
+    'stale' seconds, or held by a dead process of this host, is broken.
+    Exports of different assets don't wait for each other. A stamp file
+    records the start time of the installed export, so an export can't
+    replace the result of a more recent one.
+    """
+
+    def __init__(self, asset_dir, timeout=600.0, stale=120.0):
+        category_dir, name = os.path.split(os.path.normpath(asset_dir))
+        self.path = os.path.join(category_dir, '.%s.lock' % name)
+        self.stamp_file = os.path.join(category_dir, '.%s.stamp' % name)
+        self.timeout = timeout
+        self.stale = stale
+        self.owner = {'host': socket.gethostname(), 'pid': os.getpid(),
+                      'id': '%x' % random.getrandbits(64)}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        delay = 0.05
+        while True:
+            try:
+                fdesc = os.open(self.path,
+                                os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+                self._break_stale()
+                if time.time() > deadline:
+                    raise LockTimeout(errno.ETIMEDOUT, 'Asset is locked',
+                                      self.path)
+                # random back-off, so the waiting processes don't retry in
+                # lock-step.
+                time.sleep(delay * (1.0 + random.random()))
+                delay = min(delay * 2.0, 2.0)
+                continue
+            with os.fdopen(fdesc, 'w') as fhdl:
+                json.dump(self.owner, fhdl)
+            break
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh, daemon=True)
+        self._thread.start()
+
+    def release(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._read(self.path) == self.owner:
+            os.remove(self.path)
+
+    def _refresh(self):
+        while not self._stop.wait(self.stale / 4.0):
+            try:
+                os.utime(self.path, None)
+            except OSError:
+                return
+
+    @staticmethod
+    def _read(fpath):
+        try:
+            with open(fpath, 'r') as fhdl:
+                return json.load(fhdl)
+        except (OSError, IOError, ValueError):
+            return None
+
+    def _break_stale(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        owner = self._read(self.path) or {}
+        dead = False
+        if owner.get('host', None) == self.owner['host'] and os.name != 'nt':
+            try:
+                os.kill(owner['pid'], 0)
+            except (OSError, KeyError, TypeError) as err:
+                dead = getattr(err, 'errno', None) == errno.ESRCH
+        if not dead and time.time() - stat.st_mtime < self.stale:
+            return
+        # only one process can rename the lock: the others will find it gone.
+        broken = '%s.%s.stale' % (self.path, self.owner['id'])
+        try:
+            os.rename(self.path, broken)
+        except OSError:
+            return
+        if os.stat(broken).st_ino != stat.st_ino:
+            # the lock was re-created in the meantime: put it back.
+            try:
+                os.link(broken, self.path)
+            except OSError:
+                pass
+        os.remove(broken)
+
+    def superseded(self, stamp):
+        """True if an export started after 'stamp' is installed."""
+        installed = self._read(self.stamp_file) or {}
+        return installed.get('stamp', 0.0) > stamp
+
+    def set_stamp(self, stamp):
+        tmp = '%s.%s.tmp' % (self.stamp_file, self.owner['id'])
+        with open(tmp, 'w') as fhdl:
+            json.dump(dict(self.owner, stamp=stamp), fhdl)
+        os.replace(tmp, self.stamp_file)
+
+
+def read_asset_info(asset_dir):
+    """Returns the indexed data of an asset directory or None."""
+    try:
+        with open(os.path.join(asset_dir, 'asset.json'), 'r') as fhdl:
+            data = json.load(fhdl)
+    except (OSError, IOError, ValueError):
+        return None
+    data = data.get('RenderManAsset', data)
+    thumbnail = os.path.join(asset_dir, 'asset_100.png')
+    return {
+        'label': data.get('label', None),
+        'metadata': data.get('assetMetadata', {}),
+        'compatibility': data.get('compatibility', {}),
+        'thumbnail': thumbnail if os.path.exists(thumbnail) else None}
+
+
+SWATCH_FILE = 'asset_100.png'
+
+
+def swatch_key(mode, size, command, fpaths):
+    """Hash everything that affects a swatch: the maps' contents and the
+    swatch settings."""
+    hsh = hashlib.sha1(json.dumps([mode, size, command]).encode('utf-8'))
+    for fpath in sorted(fpaths):
+        with open(fpath, 'rb') as fhdl:
+            for chunk in iter(lambda: fhdl.read(1 << 20), b''):
+                hsh.update(chunk)
+    return hsh.hexdigest()
+
+
+def flat_swatch(basecolor, roughness, size, output):
+    """A cheap swatch: the downsampled base color with a specular highlight
+    driven by the average roughness."""
+    img = QImage(basecolor).scaled(size, size, Qt.IgnoreAspectRatio,
+                                   Qt.SmoothTransformation)
+    if img.isNull():
+        raise RuntimeError('Can not read %s' % basecolor)
+    img = img.convertToFormat(QImage.Format_ARGB32)
+    rough = 0.5
+    if roughness:
+        rimg = QImage(roughness).scaled(1, 1, Qt.IgnoreAspectRatio,
+                                        Qt.SmoothTransformation)
+        if not rimg.isNull():
+            rough = QColor(rimg.pixel(0, 0)).redF()
+    grad = QRadialGradient(size * 0.3, size * 0.3, size * (0.2 + rough * 0.6))
+    grad.setColorAt(0.0, QColor(255, 255, 255, int(200 * (1.0 - rough))))
+    grad.setColorAt(1.0, QColor(255, 255, 255, 0))
+    painter = QPainter(img)
+    painter.fillRect(img.rect(), grad)
+    painter.end()
+    if not img.save(output, 'PNG'):
+        raise RuntimeError('Can not write %s' % output)
+
+
+def project_state():
+    """Returns a dict describing the saved project or None if the project
+    has unsaved changes."""
+    try:
+        if spp.needs_saving():
+            return None
+        fpath = spp.file_path()
+        return {'path': fpath, 'mtime': os.path.getmtime(fpath)}
+    except (OSError, TypeError, AttributeError, RuntimeError):
+        return None
 
 
 class RenderManForSP(object):
@@ -165,13 +2327,52 @@ class RenderManForSP(object):
             LOG.error('Invalid Resource: %s', rpath)
         # init UI
         self.prefs = Prefs()
+        self.event_sinks = self.setup_event_sinks()
+        self.host_prefs = None
+        # the preset browser's asset lister, restored by cleanup().
+        self.asset_list = None
+        PROFILER.configure(self.prefs)
+        DIRTY.start(os.path.join(os.path.dirname(self.prefs.file),
+                                 'renderman_dirty.json'))
         self.widget, self.dock = self.build_panel()
 
     def cleanup(self):
         LOG.debug_info('cleanup')
+        for sink in self.event_sinks:
+            EVENTS.unsubscribe(sink)
+            sink.close()
+        DIRTY.stop()
+        if self.host_prefs:
+            self.host_prefs.stop_auto_export()
+        if self.asset_list:
+            # a reloaded plugin would wrap our wrapper otherwise.
+            ral, get_asset_list = self.asset_list
+            ral.getAssetList = get_asset_list
+            self.asset_list = None
         self.prefs.save()
         spui.delete_ui_element(self.dock)
 
+    def setup_event_sinks(self):
+        """Forward export events to the json-lines file and/or UDP socket
+        defined in the prefs ('events file' and 'events socket' as host:port).
+        """
+        sinks = []
+        fpath = self.prefs.get('events file', None)
+        if fpath:
+            try:
+                sinks.append(JsonLinesSink(fpath))
+            except (OSError, IOError) as err:
+                LOG.error('Can not open events file: %s', err)
+        address = self.prefs.get('events socket', None)
+        if address:
+            try:
+                sinks.append(SocketSink(address))
+            except (ValueError, OSError) as err:
+                LOG.error('Invalid events socket %r: %s', address, err)
+        for sink in sinks:
+            EVENTS.subscribe(sink)
+        return sinks
+
     def build_panel(self):
         """Build the UI"""
         LOG.debug_info('build_panel')
@@ -213,7 +2414,8 @@ class RenderManForSP(object):
                     super(SPrefs, self).__init__(rman_version)
                     self.root_dir = root_dir()
                     self.prefsobj = pref_obj
-                    self.rules = self._load_rules()
+                    self._rules = Rules(
+                        os.path.join(root_dir(), 'renderman_rules.json'))
                     if 'host_prefs' in self.prefsobj.prefs:
                         hprefs = self.prefsobj.prefs['host_prefs']
                         for k in self.saved:
@@ -228,16 +2430,103 @@ class RenderManForSP(object):
                                 self.rpbUserLibraries = [
                                     FilePath(f) for f in self.rpbUserLibraries]
                     # export vars
-                    self.spx_exported_files = {}
                     self.opt_bxdf = None
                     self.opt_ocio = None
+                    self.opt_pack = None
+                    self.opt_skip_tiles = None
+                    self.opt_budget = None
+                    self.opt_handoff = None
+                    self.opt_fold_height = None
+                    self.opt_variants = None
+                    self.opt_store = None
+                    self.opt_versions = None
+                    self.opt_changed = None
+                    self.opt_auto = None
                     self._defaultLabel = 'UNTITLED'
                     self.ocio_config = {'config': None, 'path': None}
                     # render previews
                     self.hostTree = ''
                     self.rmanTree = self.prefsobj.get('RMANTREE', '')
+                    self._indices = {}
+                    self._category_paths = {}
+                    self.swatch_cache = os.path.join(root_dir(), 'swatches')
+                    self._rules.override_dirs = [
+                        str(d) for d in self.rpbUserLibraries]
+                    # auto export: saves restart the timer, so a burst of
+                    # saves triggers a single export.
+                    self._auto_timer = QTimer()
+                    self._auto_timer.setSingleShot(True)
+                    self._auto_timer.timeout.connect(self.auto_export)
+                    spev.DISPATCHER.connect(spev.ProjectSaved,
+                                            self._on_project_saved)
                     LOG.debug_info('SPrefs object created')
 
+                def stop_auto_export(self):
+                    self._auto_timer.stop()
+                    spev.DISPATCHER.disconnect(spev.ProjectSaved,
+                                               self._on_project_saved)
+
+                def _on_project_saved(self, _event):
+                    if self.prefsobj.get('auto export', False):
+                        self._auto_timer.start(int(1000 * float(
+                            self.prefsobj.get('auto export delay', 10.0))))
+
+                def auto_export(self):
+                    """Export the project's changed texture sets to the
+                    asset they were last exported to, with the saved
+                    options. The maps are exported now, the assets are
+                    built and installed in the background with a limited
+                    number of low priority txmake processes.
+                    """
+                    # this is a timer's slot: errors must not escape.
+                    try:
+                        self._auto_export()
+                    except BaseException as err:   # pylint: disable=broad-except
+                        LOG.error('Auto export failed: %s', err)
+                        traceback.print_exc(file=sys.stdout)
+
+                def _auto_export(self):
+                    project = spp.file_path() if spp.is_open() else None
+                    target = self.prefsobj.get(
+                        'auto export targets', {}).get(project, None)
+                    if not target:
+                        LOG.debug_info('Auto export: no previous export of %s',
+                                       project)
+                        return
+                    if not spp.is_in_edition_state():
+                        # try again when SP is done.
+                        self._auto_timer.start(1000)
+                        return
+                    try:
+                        job = self.export_job(target['label'])
+                    except (RulesError, OcioError) as err:
+                        LOG.error('Auto export aborted: %s', err)
+                        return
+                    job.only_changed = True
+                    job.jobs = max(1, int(self.prefsobj.get(
+                        'auto export jobs', (os.cpu_count() or 1) // 4)))
+                    job.low_priority = True
+                    if not self.select_changed(job, target['category']):
+                        return
+                    LOG.info('Auto export: %s -> %s', project, job.target)
+                    self.export_maps(job)
+
+                    def _cancel():
+                        job.journal.finish()
+                        EVENTS.publish('export_end', label=job.label,
+                                       status='cancelled',
+                                       seconds=time.time() - job.start)
+                    # a newer export of the same asset supersedes this one
+                    # if it didn't start yet: its texture sets are still
+                    # dirty, so the newer export includes them.
+                    AUTO_EXPORTS.submit(self.build_and_install, job,
+                                        target['category'], key=job.target,
+                                        cancel=_cancel)
+
+                @property
+                def rules(self):
+                    return self._rules.get()
+
                 def getHostPref(self, pref_name, default_value):
                     return self.prefsobj.get(pref_name, default_value)
 
@@ -267,271 +2556,637 @@ class RenderManForSP(object):
                             QMessageBox.Ok, QMessageBox.Ok)
                     return False
 
+                @PROFILER.profiled
                 def exportMaterial(self, categorypath, infodict, previewtype):
                     LOG.debug_info(
                         'exportMaterial: %r, %r, %r', categorypath, infodict,
                         previewtype)
-                    #
-                    _bxdf = self.opt_bxdf.currentText()
-                    self.prefsobj.set('last bxdf', _bxdf)
+                    self.save_export_options()
+                    # fail now rather than after exporting all maps.
+                    try:
+                        job = self.export_job(infodict['label'])
+                    except RulesError as err:
+                        LOG.error('Export aborted: invalid rules\n%s', err)
+                        msg_box('Export aborted: the rules are not valid !',
+                                str(err), QMessageBox.Ok, QMessageBox.Ok)
+                        return False
+                    except OcioError as err:
+                        LOG.error('Export aborted: %s', err)
+                        msg_box('Export aborted: invalid color configuration !',
+                                str(err), QMessageBox.Ok, QMessageBox.Ok)
+                        return False
+                    job.preview = previewtype
+                    if not self.select_changed(job, categorypath):
+                        msg_box('Nothing to export',
+                                'No texture set changed since the last '
+                                'export of %s.' % job.label,
+                                QMessageBox.Ok, QMessageBox.Ok)
+                        return False
+                    self.export_maps(job)
+                    if not self.build_and_install(job, categorypath):
+                        return False
+                    if job.project:
+                        # auto export goes to the last exported asset.
+                        targets = self.prefsobj.get('auto export targets', {})
+                        targets[job.project] = {'category': categorypath,
+                                                'label': job.label}
+                        self.prefsobj.set('auto export targets', targets)
+                    return True
+
+                def select_changed(self, job, categorypath):
+                    """Set the job's target asset and, if only the changed
+                    texture sets should be exported, pick them.
+
+                    Returns:
+                        bool -- False if there is nothing to export.
+                    """
+                    job.project = spp.file_path()
+                    job.target = os.path.join(
+                        self.category_path(categorypath), job.label)
+                    if not job.only_changed:
+                        return True
+                    job.only = DIRTY.dirty(job.project, job.target)
+                    LOG.info('Changed texture sets: %s',
+                             ', '.join(job.only) or 'none')
+                    return bool(job.only)
+
+                def library_index(self, root=None):
+                    """Returns the index of a library, by default the
+                    selected one."""
+                    root = str(root or self.rpbSelectedLibrary)
+                    if not root:
+                        return None
+                    if root not in self._indices:
+                        self._indices[root] = LibraryIndex(root)
+                    return self._indices[root]
+
+                def indexed_asset_list(self, get_asset_list):
+                    """Wraps ral.getAssetList(cfg, categorypath), so the
+                    preset browser lists the assets of the user libraries
+                    from their index rather than by scanning the category.
+                    The factory library is still scanned.
+                    """
+                    get_asset_list = getattr(get_asset_list, '__wrapped__',
+                                             get_asset_list)
+
+                    @functools.wraps(get_asset_list)
+                    def _asset_list(cfg, categorypath, *args, **kwargs):
+                        category_dir = os.path.normpath(str(
+                            ral.getAbsCategoryPath(cfg, categorypath)))
+                        for lib in self.rpbUserLibraries:
+                            root = os.path.normpath(str(lib))
+                            if category_dir.startswith(root + os.sep):
+                                index = self.library_index(root)
+                                found = index.find(category_dir)
+                                index.save()
+                                return [FilePath(f) for f in found]
+                        return get_asset_list(cfg, categorypath, *args,
+                                              **kwargs)
+                    return _asset_list
+
+                def category_path(self, categorypath):
+                    """A cached ral.getAbsCategoryPath()."""
+                    key = (str(self.rpbSelectedLibrary), categorypath)
+                    if key not in self._category_paths:
+                        self._category_paths[key] = ral.getAbsCategoryPath(
+                            self.cfg, categorypath)
+                    return self._category_paths[key]
+
+                def save_export_options(self):
+                    """Store the options set in the UI in the prefs, where
+                    the export jobs get them."""
+                    if self.opt_bxdf is None:
+                        return
+                    try:
+                        options = {
+                            'last bxdf': self.opt_bxdf.currentText(),
+                            'ocio config': self.opt_ocio.currentText(),
+                            'pack channels': self.opt_pack.isChecked(),
+                            'skip default tiles':
+                                self.opt_skip_tiles.isChecked(),
+                            'texture budget': self.opt_budget.value(),
+                            'handoff format': self.opt_handoff.currentText(),
+                            'fold height': self.opt_fold_height.isChecked(),
+                            'resolution variants':
+                                self.opt_variants.currentIndex(),
+                            'texture store': self.opt_store.isChecked(),
+                            'keep versions': self.opt_versions.value(),
+                            'export changed only':
+                                self.opt_changed.isChecked()}
+                    except RuntimeError:
+                        # the dialog was closed: Qt deleted the widgets.
+                        return
+                    for key, value in options.items():
+                        self.prefsobj.set(key, value)
+
+                def export_job(self, scene):
+                    """Create an export job for the current project, using the
+                    options saved in the prefs.
+
+                    Raises:
+                        RulesError -- if the rules are not usable.
+                        OcioError -- if the OCIO config doesn't define the
+                                     color spaces used by the rules.
+                    """
+                    prefs = self.prefsobj
+                    self._rules.check()
+                    _bxdf = prefs.get('last bxdf', None) or \
+                        list(self.rules['models'].keys())[0]
                     LOG.debug_info('chosen bxdf: %s', _bxdf)
-                    _ocio = self.opt_ocio.currentText()
-                    self.ocio_config['config'] = _ocio
+                    _ocio = prefs.get('ocio config', None) or 'Off'
+                    self.ocio_config = {'config': _ocio, 'path': None}
                     if _ocio == '$OCIO':
+                        if not os.environ.get('OCIO', None):
+                            raise OcioError('$OCIO is not set')
                         self.ocio_config['path'] = FilePath(os.environ['OCIO'])
                     elif _ocio != 'Off':
                         self.ocio_config['path'] = FilePath(self.rmanTree).join(
                             'lib', 'ocio', _ocio, 'config.ocio')
-                    self.prefsobj.set('ocio config', _ocio)
                     LOG.debug_info('chosen ocio config: %s', _ocio)
-                    # setup data
-                    bxdf_rules = self.rules['models'][_bxdf]
-                    mappings = bxdf_rules['mapping']
-                    graph = bxdf_rules.get('graph', None)
-                    settings = bxdf_rules.get('settings', None)
-                    scene = infodict['label']
-
-                    # we save the assets to SP's export directory, because we
+                    _pack = prefs.get('pack channels', False)
+                    self._rules.check(_bxdf)
+                    # fail before exporting any map if the config doesn't
+                    # define the rules' color spaces.
+                    ocio = OcioConfig(
+                        _ocio, self.ocio_config['path'] and
+                        self.ocio_config['path'].os_path())
+                    colorspaces = set(
+                        m['ocio'] for m in
+                        self.rules['models'][_bxdf]['mapping'].values()
+                        if m.get('ocio', None))
+                    if _pack:
+                        colorspaces.add('data')
+                    ocio.check(colorspaces)
+                    job = ExportJob(scene, _bxdf, self.ocio_config, _pack,
+                                    self.rules, self._rules.compiled[_bxdf],
+                                    self._rules.key, ocio=ocio)
+                    job.skip_tiles = prefs.get('skip default tiles', False)
+                    job.budget = prefs.get('texture budget', 0) * 1048576
+                    job.handoff = prefs.get('handoff format', 'png')
+                    if job.skip_tiles and not qt_reads(job.handoff):
+                        # no tile could be found empty.
+                        LOG.warning('Skip default tiles: %s maps can not be '
+                                    'read, all tiles are converted.',
+                                    job.handoff)
+                        job.skip_tiles = False
+                    job.fold_height = prefs.get('fold height', False)
+                    job.variants = prefs.get('resolution variants', 0)
+                    if job.variants and not qt_reads(job.handoff):
+                        # the variants are scaled down with QImage.
+                        LOG.warning('Resolution variants: %s maps can not '
+                                    'be read, no variant is converted.',
+                                    job.handoff)
+                        job.variants = 0
+                    job.only_changed = prefs.get('export changed only', False)
+                    return job
+
+                @PROFILER.profiled
+                def export_maps(self, job):
+                    """Export the project's maps, unless a previous identical
+                    export can be resumed. This calls the SP API and must run
+                    in the main thread.
+                    """
+                    # we save the assets to a temp directory, because we
                     # know it is writable. We will move them to the requested
                     # location later.
-                    export_path = FilePath(tempfile.mkdtemp(prefix='rfsp_export_'))
+                    # The directory holds a journal, so we can resume an
+                    # export that didn't complete.
+                    # changes made from now on will need another export. The
+                    # sequence number is part of the journal key, so a
+                    # background export still installing never shares its
+                    # directory with a newer export. So is the target
+                    # asset: an export to another library or category
+                    # must install its assets again.
+                    job.seq = DIRTY.sequence(job.project)
+                    job.journal = ExportJournal(
+                        spp.file_path(), [job.label, job.target, job.bxdf,
+                                          job.ocio_config['config'], job.pack,
+                                          job.skip_tiles, job.budget,
+                                          job.handoff, job.fold_height,
+                                          job.variants, job.only, job.seq,
+                                          job.rules_key, __version__])
+                    if job.journal.start(project_state()):
+                        LOG.info('Resuming previous export: %s', job.journal.dir)
+                    job.export_path = FilePath(job.journal.dir)
 
-                    # export project textures
-                    self.sp_export(export_path)
+                    EVENTS.publish('export_start', label=job.label,
+                                   bxdf=job.bxdf,
+                                   ocio=job.ocio_config['config'],
+                                   path=job.export_path.os_path())
 
-                    # list of spts.TextureSet objects
-                    tset_list = spts.all_texture_sets()
+                    try:
+                        # snapshot the texture sets, so the assets can be built
+                        # without calling the SP API.
+                        job.tsets = [
+                            TextureSetInfo(
+                                ts.name(), ts.has_uv_tiles(),
+                                (ts.get_resolution().width,
+                                 ts.get_resolution().height),
+                                [chan_type_str(c) for c in
+                                 ts.get_stack().all_channels()],
+                                len(ts.all_uv_tiles()) if ts.has_uv_tiles() else 1)
+                            for ts in spts.all_texture_sets()
+                            if job.only is None or ts.name() in job.only]
 
-                    # build assets
-                    asset_list = []
-                    for mat in tset_list:
-                        label = scene
-                        is_udim = mat.has_uv_tiles()
-                        if not is_udim:
-                            label = '%s_%s' % (scene, mat.name())
+                        # export project textures
+                        exported = job.journal.exported()
+                        if exported:
+                            LOG.info('Resume: skipping map export')
+                            job.files, job.packed = exported
+                        else:
+                            with EVENTS.stage('export_maps'):
+                                job.files, job.packed = self.sp_export(
+                                    job.export_path, job.tsets,
+                                    packable=job.compiled['packable'] if job.pack else None,
+                                    budget=functools.partial(budget_plan, job)
+                                    if job.budget else None,
+                                    handoff=job.handoff,
+                                    drop=['Height'] if job.fold_height else None)
+                            job.journal.set_exported(job.files, job.packed)
+                    except BaseException:
+                        # build_and_install() publishes it otherwise.
+                        EVENTS.publish('export_end', label=job.label,
+                                       status='error',
+                                       seconds=time.time() - job.start)
+                        raise
 
-                        # chans = mat.get_stack().all_channels()
-                        chans = self.textureset_channels(mat)
-                        LOG.debug_info('+ Exporting %s', label)
+                @PROFILER.profiled
+                def build_assets(self, job):
+                    """Build all assets in the export directory. This doesn't
+                    call the SP API and can run in a worker thread.
+                    """
+                    job.assets = []
+                    for tset in job.tsets:
+                        self.build_asset(job, tset)
 
-                        asset_path = export_path.join(label + '.rma')
-                        LOG.debug_info('  + asset_path %s', asset_path)
-                        asset_json_path = asset_path.join('asset.json')
-                        LOG.debug_info('  + asset_json_path %s', asset_json_path)
+                def build_asset(self, job, tset):
+                    journal = job.journal
 
-                        # create asset directory
-                        create_directory(asset_path)
+                    label = job.label
+                    is_udim = tset.is_udim
+                    if not is_udim:
+                        label = '%s_%s' % (job.label, tset.name)
 
-                        # create asset
-                        try:
-                            asset = rac.RmanAsset(assetType='nodeGraph', label=label)
-                        except Exception:
-                            LOG.error('Asset creation failed')
-                            raise
-
-                        asset.ocio = self.ocio_config
-
-                        # create standard metadata
-                        #
-                        self.set_metadata(asset, mat)
-
-                        # create nodes
-                        # start by adding a root node
-                        #
-                        root_node = label + '_Material'
-                        asset.addNode(root_node, 'shadingEngine', 'root', 'shadingEngine')
-                        pdict = {'type': 'reference float[]', 'value': None}
-                        asset.addParam(root_node, 'surfaceShader', pdict)
-                        LOG.debug_info('  + Root node: %s', root_node)
-
-                        # add a disney, pixar or lama bxdf
-                        #
-                        bxdf_node = label + "_Srf"
-                        asset.addNode(bxdf_node, _bxdf, 'bxdf', _bxdf)
-                        LOG.debug_info('  + BxDF node: %s  (%s)', root_node, _bxdf)
-
-                        # The bxdf may need specific settings to match Substance Painter
-                        set_params(settings, 'bxdf', bxdf_node, asset)
-
-                        # connect surf to root node
-                        #
-                        asset.addConnection('%s.outColor' % bxdf_node,
-                                            '%s.surfaceShader' % root_node)
-
-                        # build additional nodes if need be.
-                        #
-                        if graph:
-                            LOG.debug_info('  + Create graph nodes...')
-                            for nname, ndict in graph['nodes'].items():
-                                lname = label + nname
-                                asset.addNode(lname, ndict['nodetype'],
-                                              ndict.get('category', 'pattern'),
-                                              ndict['nodetype'])
-                                LOG.debug_info(
-                                    '    |_ %s  (%s)', lname, ndict['nodetype'])
-                                if 'params' in ndict:
-                                    for pname, pdict in ndict['params'].items():
-                                        asset.addParam(lname, pname, pdict)
-                                        LOG.debug_info(
-                                            '       |_ param: %s %s = %s',
-                                            pdict['type'], pname, pdict['value'])
-
-                        # create texture nodes
-                        LOG.debug_info('  + Create texture nodes...')
-                        chan_nodes = {}
-                        for ch_type in chans:
-                            fpath_list = self.spx_exported_files[mat.name()].get(ch_type, None)
-                            if fpath_list is None:
-                                LOG.debug_warning(
-                                    '    |_ tex_dict[%r][%r] failed', mat.name(),
-                                    ch_type)
-                                continue
-                            node_name = "%s_%s_tex" % (label, ch_type)
-                            LOG.debug_info('    |_ %s', node_name)
-                            chan_nodes[ch_type] = node_name
-                            colorspace = mappings[ch_type]['ocio']
-                            fpath = self.txmake(is_udim, asset_path, fpath_list,
-                                                self.ocio_config, colorspace)
-                            if ch_type == 'Normal':
-                                add_texture_node(asset, node_name, 'PxrNormalMap', fpath)
-                            elif ch_type == 'Height':
-                                add_texture_node(asset, node_name, 'PxrBump', fpath)
-                            else:
-                                add_texture_node(asset, node_name, 'PxrTexture', fpath)
-                            set_params(settings, ch_type, node_name, asset)
-
-                        # print_dict(chan_nodes, msg='chan_nodes:\n')
-
-                        # make direct connections
-                        #
-                        LOG.debug_info('  + Direct connections...')
-                        for ch_type in chans:
-                            if not ch_type in mappings:
-                                LOG.debug_warning('    |_ skipped %r', ch_type)
-                                continue
-                            src = None
-                            dst_type = mappings[ch_type]['type']
-                            dst_param = mappings[ch_type]['param']
-                            if dst_type == 'normal':
-                                src = '%s.resultN' % (chan_nodes[ch_type])
-                            elif dst_type == 'color':
-                                src = '%s.resultRGB' % (chan_nodes[ch_type])
-                            elif dst_type == 'float':
-                                src = '%s.resultR' % (chan_nodes[ch_type])
-                            else:
-                                # don't create a connection
-                                if dst_param != 'graph':
-                                    # connections with a graph type will be handled later, so
-                                    # we don't warn in that case.
-                                    LOG.debug_warning('WARNING: Not connecting: %s', ch_type)
-                                continue
-                            if dst_param == 'graph':
-                                continue
-                            dst = '%s.%s' % (bxdf_node, dst_param)
-                            asset.addConnection(src, dst)
-                            LOG.debug_info('    |_ connect: %s -> %s' % (src, dst))
-                            # also tag the bxdf param as connected
-                            pdict = {'type': 'reference ' + dst_type, 'value': None}
-                            asset.addParam(bxdf_node, dst_param, pdict)
-                            LOG.debug_info(
-                                '       |_ param: %s %s -> %s', pdict['type'],
-                                dst_param, pdict['value'])
-
-                        # make graph connections
-                        #
-                        if graph and 'connections' in graph:
-                            LOG.debug_info('  + Connect graph nodes...')
-                            for con in graph['connections']:
-
-                                src_node = con['src']['node']
-                                src_ch = None
-                                if src_node == _bxdf:
-                                    src_node = bxdf_node
-                                elif src_node.startswith('ch:'):
-                                    src_ch = src_node[3:]
-                                    if src_ch in chan_nodes:
-                                        src_node = chan_nodes[src_ch]
-                                    else:
-                                        continue
-                                if not src_node.startswith(label):
-                                    src_node = label + src_node
-                                src = '%s.%s' % (src_node, con['src']['param'])
-
-                                dst_node = con['dst']['node']
-                                dst_ch = None
-                                if dst_node == _bxdf:
-                                    dst_node = bxdf_node
-                                elif dst_node.startswith('ch:'):
-                                    dst_ch = dst_node[3:]
-                                    if dst_ch in chan_nodes:
-                                        dst_node = chan_nodes[dst_ch]
-                                    else:
-                                        continue
-                                if not dst_node.startswith(label):
-                                    dst_node = label + dst_node
-                                dst = '%s.%s' % (dst_node, con['dst']['param'])
-                                asset.addConnection(src, dst)
-                                LOG.debug_info('    |_ connect: %s -> %s', src, dst)
-                                # mark param as a connected
-                                dstType = con['dst']['type']
-                                pdict = {'type': 'reference %s' % dstType, 'value': None}
-                                asset.addParam(dst_node, con['dst']['param'], pdict)
-                                LOG.debug_info(
-                                    '       |_ param: %s %s = %s',
-                                    pdict['type'], con['dst']['param'],
-                                    pdict['value'])
-
-                        # save asset
-                        #
-                        LOG.debug_info('  + ready to save: %s' % asset_json_path)
-                        try:
-                            asset.save(asset_json_path, False)
-                        except:
-                            LOG.error('Saving the asset failed !')
-                            raise
+                    asset_path = job.export_path.join(label + '.rma')
+                    if journal.done('installed', label):
+                        LOG.info('Resume: %s already installed', label)
+                        return
+                    if journal.done('saved', label) and \
+                            asset_path.join('asset.json').exists():
+                        LOG.info('Resume: %s already saved', label)
+                        job.assets.append((label, asset_path))
+                        job.sources[label] = tset.name
+                        return
+
+                    chans = self.textureset_channels(job, tset)
+                    LOG.debug_info('+ Exporting %s', label)
+                    with EVENTS.stage('build_asset', asset=label):
+                        self._build_asset(job, tset, label, asset_path, chans)
+
+                    # mark this asset as ready to be moved
+                    #
+                    job.assets.append((label, asset_path))
+                    job.sources[label] = tset.name
+
+                def _build_asset(self, job, tset, label, asset_path, chans):
+                    """Convert the maps and save the asset."""
+                    mappings = job.bxdf_rules['mapping']
+                    is_udim = tset.is_udim
+
+                    LOG.debug_info('  + asset_path %s', asset_path)
+                    asset_json_path = asset_path.join('asset.json')
+                    LOG.debug_info('  + asset_json_path %s', asset_json_path)
+
+                    # create asset directory
+                    create_directory(asset_path)
+
+                    # create asset
+                    try:
+                        asset = rac.RmanAsset(assetType='nodeGraph', label=label)
+                    except Exception:
+                        LOG.error('Asset creation failed')
+                        raise
+
+                    asset.ocio = job.ocio_config
+
+                    # create standard metadata
+                    #
+                    packed = job.packed.get(tset.name, {})
+                    self.set_metadata(asset, tset,
+                                      budget_plan(job, tset, packed))
+
+                    # convert the maps
+                    LOG.debug_info('  + Convert maps...')
+                    maps = {}
+                    if packed:
+                        map_name = job.rules['packing']['name']
+                        maps[map_name] = (job.files[tset.name][map_name], 'data')
+                    for ch_type, fpath_list in chans.items():
+                        if ch_type in packed:
+                            continue
+                        if not fpath_list or ch_type not in mappings:
+                            LOG.debug_warning(
+                                '    |_ tex_dict[%r][%r] failed', tset.name,
+                                ch_type)
+                            continue
+                        maps[ch_type] = (fpath_list, mappings[ch_type]['ocio'])
+                    skipped = set()
+                    if job.skip_tiles and is_udim:
+                        skipped = self.skip_default_tiles(job, label, maps)
+                    texfiles = dict(
+                        (m, self.tex_file(is_udim, asset_path, fpaths))
+                        for m, (fpaths, _) in maps.items())
+
+                    # create nodes
+                    # they are first added to an intermediate graph, so we
+                    # can get rid of useless nodes before converting the
+                    # maps.
+                    #
+                    agraph, root_node = build_graph(job, label, chans, packed,
+                                                    texfiles, skipped)
+                    removed = agraph.prune(root_node)
+                    for nid in removed:
+                        LOG.debug_info('  + pruned: %s', nid)
+
+                    # only convert the maps the pruned graph still uses.
+                    used = set(params['filename']['value']
+                               for params in agraph.params.values()
+                               if 'filename' in params)
+                    maps = dict((m, v) for m, v in maps.items()
+                                if os.path.basename(texfiles[m]) in used)
+                    self.convert_maps(job, label, is_udim, asset_path, maps)
+                    agraph.apply(asset)
+                    if job.variants:
+                        # the directories holding the lower resolution
+                        # copies of the textures, keyed by scale.
+                        variants = converted_variants(asset_path.os_path(),
+                                                      job.variants)
+                        if variants:
+                            asset.addMetadata('textureVariants', variants)
+
+                    # save asset
+                    #
+                    LOG.debug_info('  + ready to save: %s', asset_json_path)
+                    try:
+                        asset.save(asset_json_path, False)
+                    except:
+                        LOG.error('Saving the asset failed !')
+                        raise
+
+                    job.journal.mark('saved', label)
+                    EVENTS.publish('asset_saved', asset=label,
+                                   path=asset_json_path.os_path())
 
-                        # mark this asset as ready to be moved
-                        #
-                        asset_list.append(asset_path)
+                @PROFILER.profiled
+                def install_assets(self, job, categorypath):
+                    """Move the assets to the library and clean-up.
 
+                    Returns:
+                        bool -- True if all assets were installed.
+                    """
                     # move assets to the requested location
                     #
-                    dst = ral.getAbsCategoryPath(self.cfg, categorypath)
-                    for item in asset_list:
-                        # if the asset already exists in the destination
-                        # location, we need to move it first.
-                        dst_asset = os.path.join(dst, os.path.basename(item))
-                        if os.path.exists(dst_asset):
+                    journal = job.journal
+                    index = self.library_index()
+                    store = None
+                    if index and self.prefsobj.get('texture store', False):
+                        store = TextureStore(index.root)
+                    # number of versions kept in the library, 0 to replace
+                    # the assets.
+                    keep = int(self.prefsobj.get('keep versions', 0))
+                    with EVENTS.stage('install'):
+                        dst = self.category_path(categorypath)
+                        installed = 0
+                        for label, item in job.assets:
+                            dst_asset = os.path.join(dst, os.path.basename(item))
                             try:
-                                os.rename(dst_asset, dst_asset + '_old')
-                            except (OSError, IOError):
-                                LOG.error('Could not rename asset to %s_old' % dst_asset)
+                                # the lock changes the category's mtime.
+                                before = os.stat(dst).st_mtime
+                            except OSError:
+                                before = None
+                            try:
+                                # other artists may export the same asset.
+                                with AssetLock(dst_asset) as lock:
+                                    superseded = lock.superseded(job.start)
+                                    if not superseded:
+                                        if store:
+                                            # the textures are moved to the
+                                            # store, so only links are
+                                            # installed.
+                                            store.ingest(item)
+                                        if keep:
+                                            AssetVersions(dst_asset).install(
+                                                item, store=store, keep=keep)
+                                        else:
+                                            replace_asset(item, dst,
+                                                          store=store)
+                                        lock.set_stamp(job.start)
+                            except (OSError, IOError) as err:
+                                LOG.error('Could not install %s in %s: %s',
+                                          label, dst, err)
                                 continue
-                            else:
-                                shutil.rmtree(dst_asset + '_old', ignore_errors=False)
-                        try:
-                            shutil.move(item, dst)
-                        except (OSError, IOError):
-                            LOG.error('WARNING: Could not copy asset to %s' % dst)
-
+                            # a superseded asset is up to date too.
+                            installed += 1
+                            journal.mark('installed', label)
+                            DIRTY.mark_exported(job.project, job.target,
+                                                [job.sources[label]], job.seq)
+                            if superseded:
+                                LOG.warning('%s: a more recent export is '
+                                            'installed: skipped', label)
+                                continue
+                            if index:
+                                index.update_asset(dst_asset, before)
+                            self.queue_swatch(job, label, dst_asset)
+                            EVENTS.publish('asset_installed',
+                                           asset=os.path.basename(item),
+                                           path=dst_asset,
+                                           bytes=directory_size(dst_asset))
 
-                    # clean-up intermediate files
-                    for mat in tset_list:
-                        for chan, fpath_list in chans.items():
-                            for fpath in fpath_list:
-                                if not os.path.exists(fpath):
-                                    LOG.warning('cleanup: file not found: %s', fpath)
-                                    continue
-                                try:
-                                    os.remove(fpath)
-                                except (OSError, IOError):
-                                    LOG.error('Cleanup failed: %s' % fpath)
-                                else:
-                                    LOG.debug_info('Cleanup: %s' % fpath)
+                        if index:
+                            index.save()
+                        DIRTY.save()
 
+                    # clean-up intermediate files, unless we need them to
+                    # resume the export.
+                    if installed < len(job.assets):
+                        LOG.error('Some assets were not installed: export again '
+                                  'to resume. (%s)', journal.dir)
+                        return False
+                    # the swatches may still need the exported maps.
+                    SWATCHES.submit(journal.finish)
+                    LOG.debug_info('Cleanup: %s', journal.dir)
                     LOG.debug_info('RenderMan : Done !')
                     return True
 
+                def queue_swatch(self, job, label, asset_dir):
+                    """Generate the asset's swatch in the background. The
+                    'swatch mode' pref can be 'flat' (default), 'render' or
+                    'off'. In 'render' mode, the 'swatch command' pref is a
+                    list of arguments where {asset}, {output} and {size} are
+                    replaced.
+                    """
+                    mode = self.prefsobj.get('swatch mode', 'flat')
+                    if mode == 'off' or job.preview == 'none':
+                        return
+                    command = self.prefsobj.get('swatch command', None)
+                    if mode == 'render' and not command:
+                        LOG.warning('swatch: "swatch command" is not set')
+                        return
+                    files = job.files.get(job.sources.get(label, None), {})
+                    SWATCHES.submit(self.make_swatch, mode, command, files,
+                                    int(self.rpbSwatchSize), asset_dir,
+                                    self.library_index())
+
+                def make_swatch(self, mode, command, files, size, asset_dir,
+                                index):
+                    basecolor = files.get('BaseColor', [None])[0]
+                    roughness = files.get('Roughness', [None])[0]
+                    if mode == 'flat' and not basecolor:
+                        return
+                    sources = [f for fl in files.values() for f in fl] \
+                        if mode == 'render' else [basecolor, roughness]
+                    key = swatch_key(mode, size, command,
+                                     [f for f in sources if f])
+                    cached = os.path.join(self.swatch_cache, key + '.png')
+                    if not os.path.exists(cached):
+                        if not os.path.isdir(self.swatch_cache):
+                            os.makedirs(self.swatch_cache)
+                        start = time.time()
+                        if mode == 'render':
+                            fmt = {'asset': asset_dir, 'output': cached,
+                                   'size': size}
+                            subprocess.check_call(
+                                [arg.format(**fmt) for arg in command],
+                                startupinfo=startup_info())
+                        else:
+                            flat_swatch(basecolor, roughness, size, cached)
+                        LOG.debug_info('swatch: %s rendered in %.2f sec.',
+                                       asset_dir, time.time() - start)
+                    shutil.copyfile(cached, os.path.join(asset_dir, SWATCH_FILE))
+                    if index:
+                        index.update_asset(asset_dir)
+                        index.save()
+                    EVENTS.publish('swatch_done', path=asset_dir, cached=key)
+
+                @PROFILER.profiled
+                def batch_export(self, project_files, categorypath):
+                    """Export a list of projects with the current options.
+                    The assets of a project are built and installed in a
+                    worker thread while the next project is opened and its
+                    maps exported.
+
+                    Returns:
+                        list -- a report dict for each project.
+                    """
+                    if spp.is_open() and spp.needs_saving():
+                        raise RuntimeError(
+                            'Please save the current project first.')
+                    EVENTS.publish('batch_start', projects=len(project_files))
+                    batch_start = time.time()
+                    report = []
+                    pending = []
+                    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+                        for fpath in project_files:
+                            entry = {'project': fpath, 'status': 'error',
+                                     'error': None, 'assets': []}
+                            report.append(entry)
+                            start = time.time()
+                            try:
+                                if spp.is_open():
+                                    spp.close()
+                                spp.open(fpath)
+                                wait_for_project()
+                                job = self.export_job(spp.name() or 'UNTITLED')
+                                if not self.select_changed(job, categorypath):
+                                    LOG.info('Batch: %s is up to date', fpath)
+                                    entry['status'] = 'success'
+                                    continue
+                                self.export_maps(job)
+                            except BaseException as err:   # pylint: disable=broad-except
+                                entry['error'] = str(err)
+                                LOG.error('Batch: %s failed: %s', fpath, err)
+                                continue
+                            entry['maps_seconds'] = time.time() - start
+                            LOG.info('Batch: %s maps exported in %.1f sec.',
+                                     fpath, entry['maps_seconds'])
+                            pending.append((entry, job, start, pool.submit(
+                                self.build_and_install, job, categorypath)))
+                        for entry, job, start, future in pending:
+                            try:
+                                if future.result():
+                                    entry['status'] = 'success'
+                            except BaseException as err:   # pylint: disable=broad-except
+                                entry['error'] = str(err)
+                                LOG.error('Batch: %s failed: %s',
+                                          entry['project'], err)
+                            entry['assets'] = [label for label, _ in job.assets]
+                            entry['seconds'] = time.time() - start
+                    self.batch_report(report, time.time() - batch_start)
+                    EVENTS.publish('batch_end', projects=len(project_files),
+                                   seconds=time.time() - batch_start)
+                    return report
+
+                def build_and_install(self, job, categorypath):
+                    """Build and install the assets of a job whose maps
+                    were exported, and publish 'export_end'.
+
+                    Returns:
+                        bool -- True if all assets were installed.
+                    """
+                    status = 'error'
+                    try:
+                        self.build_assets(job)
+                        if self.install_assets(job, categorypath):
+                            status = 'success'
+                    finally:
+                        EVENTS.publish('export_end', label=job.label,
+                                       status=status,
+                                       seconds=time.time() - job.start)
+                    return status == 'success'
+
+                def batch_report(self, report, seconds):
+                    ok = [e for e in report if e['status'] == 'success']
+                    n_assets = sum(len(e['assets']) for e in report)
+                    LOG.info('Batch export: %d/%d projects, %d assets in %.1f '
+                             'sec. (%.1f projects/hour)', len(ok), len(report),
+                             n_assets, seconds,
+                             len(ok) * 3600.0 / max(seconds, 0.001))
+                    for entry in report:
+                        LOG.info('  |_ %-8s %s %s', entry['status'],
+                                 entry['project'], entry['error'] or '')
+                    fpath = os.path.join(
+                        root_dir(), 'rfsp_batch_%s.json' %
+                        time.strftime('%Y%m%d_%H%M%S'))
+                    try:
+                        with open(fpath, 'w') as fhdl:
+                            json.dump({'seconds': seconds, 'projects': report},
+                                      fhdl, indent=4)
+                    except (OSError, IOError) as err:
+                        LOG.error('Could not write batch report: %s', err)
+                    else:
+                        LOG.info('Batch report: %s', fpath)
+
+                def batch_dialog(self):
+                    fpaths, _ = QFileDialog.getOpenFileNames(
+                        None, 'Select the projects to export', '',
+                        'Substance Painter projects (*.spp)')
+                    if not fpaths:
+                        return
+                    self.save_export_options()
+                    try:
+                        report = self.batch_export(fpaths,
+                                                   self.rpbSelectedCategory)
+                    except (RuntimeError, RulesError) as err:
+                        LOG.error('Batch export aborted: %s', err)
+                        msg_box('Batch export aborted !', str(err),
+                                QMessageBox.Ok, QMessageBox.Ok)
+                        return
+                    ok = len([e for e in report if e['status'] == 'success'])
+                    msg_box('Batch export done: %d/%d projects' % (ok, len(report)),
+                            '\n'.join('%s: %s' % (e['project'], e['status'])
+                                      for e in report),
+                            QMessageBox.Ok, QMessageBox.Ok)
+
                 def addUiExportOptions(self, top_layout, mode):
                     if mode == 'material':
                         lyt = QFormLayout()
@@ -541,13 +3196,104 @@ class RenderManForSP(object):
                         lyt.setLabelAlignment(Qt.AlignRight)
                         # BXDF
                         self.opt_bxdf = QComboBox()
-                        self.opt_bxdf.addItems(list(self.rules['models'].keys()))
+                        try:
+                            self._rules.check()
+                        except RulesError as err:
+                            # the exports will fail: tell why right away.
+                            errors = QLabel('Invalid rules:\n%s' % err)
+                            errors.setWordWrap(True)
+                            lyt.addRow(errors)
+                        else:
+                            self.opt_bxdf.addItems(
+                                list(self.rules['models'].keys()))
                         lyt.addRow('BxDF :', self.opt_bxdf)
                         # color space
                         self.opt_ocio = QComboBox()
                         self.opt_ocio.addItems(['Off', 'ACES-1.2',
                                                 'filmic-blender', '$OCIO'])
                         lyt.addRow('Color configuration :', self.opt_ocio)
+                        # channel packing
+                        self.opt_pack = QCheckBox()
+                        self.opt_pack.setToolTip(
+                            'Pack scalar maps (roughness, metallic, etc) in a '
+                            'single texture.')
+                        lyt.addRow('Pack scalar maps :', self.opt_pack)
+                        # sparse UDIMs
+                        self.opt_skip_tiles = QCheckBox()
+                        self.opt_skip_tiles.setToolTip(
+                            'Skip the UDIM tiles holding the channel\'s '
+                            'default value (as set in the rules).')
+                        lyt.addRow('Skip default tiles :', self.opt_skip_tiles)
+                        # texture budget
+                        self.opt_budget = QSpinBox()
+                        self.opt_budget.setRange(0, 65536)
+                        self.opt_budget.setSuffix(' MB')
+                        self.opt_budget.setSpecialValueText('Off')
+                        self.opt_budget.setToolTip(
+                            'Texture memory budget per asset. The maps with '
+                            'the lowest priority (as set in the rules) are '
+                            'exported at a lower resolution to fit.')
+                        lyt.addRow('Texture budget :', self.opt_budget)
+                        # intermediate file format
+                        self.opt_handoff = QComboBox()
+                        self.opt_handoff.addItems(sorted(HANDOFF_FORMATS))
+                        self.opt_handoff.setToolTip(
+                            'File format of the maps exported for txmake. '
+                            'They are deleted after conversion: uncompressed '
+                            'formats are faster to write and read.')
+                        lyt.addRow('Handoff format :', self.opt_handoff)
+                        # height
+                        self.opt_fold_height = QCheckBox()
+                        self.opt_fold_height.setToolTip(
+                            'Don\'t export the height map: use the normal '
+                            'map combining the mesh normals, the height and '
+                            'the normal channels, without a bump node.')
+                        lyt.addRow('Fold height in normal :',
+                                   self.opt_fold_height)
+                        # lower resolution copies
+                        self.opt_variants = QComboBox()
+                        self.opt_variants.addItems(
+                            ['Off', '1/2', '1/2, 1/4', '1/2, 1/4, 1/8'])
+                        self.opt_variants.setToolTip(
+                            'Also store lower resolution copies of the '
+                            'textures in the asset, for layout and crowds.')
+                        lyt.addRow('Resolution variants :', self.opt_variants)
+                        # library storage
+                        self.opt_store = QCheckBox()
+                        self.opt_store.setToolTip(
+                            'Store each texture once at the root of the '
+                            'library and install links in the assets.')
+                        lyt.addRow('Shared texture store :', self.opt_store)
+                        # versioned installs
+                        self.opt_versions = QSpinBox()
+                        self.opt_versions.setRange(0, 100)
+                        self.opt_versions.setSpecialValueText('Off')
+                        self.opt_versions.setToolTip(
+                            'Number of versions of each asset kept in the '
+                            'library. Unchanged textures are shared by the '
+                            'versions.')
+                        lyt.addRow('Keep versions :', self.opt_versions)
+                        # incremental export
+                        self.opt_changed = QCheckBox()
+                        self.opt_changed.setToolTip(
+                            'Only export the texture sets changed since the '
+                            'last export to the same asset.')
+                        lyt.addRow('Changed texture sets only :',
+                                   self.opt_changed)
+                        self.opt_auto = QCheckBox()
+                        self.opt_auto.setToolTip(
+                            'Export the changed texture sets in the background '
+                            'when the project is saved, to the asset it was '
+                            'last exported to.')
+                        self.opt_auto.toggled.connect(
+                            lambda on: self.prefsobj.set('auto export', on))
+                        lyt.addRow('Auto export on save :', self.opt_auto)
+                        # batch export
+                        batch_btn = QPushButton('Batch export...')
+                        batch_btn.setToolTip(
+                            'Export several projects to the selected category.')
+                        batch_btn.clicked.connect(self.batch_dialog)
+                        lyt.addRow('', batch_btn)
                         # add to parent layout
                         top_layout.addLayout(lyt)
                         # set last used bxdf and ocio config
@@ -557,6 +3303,26 @@ class RenderManForSP(object):
                         ocio_config = self.prefsobj.get('ocio config', None)
                         if ocio_config:
                             self.opt_ocio.setCurrentText(ocio_config)
+                        self.opt_pack.setChecked(
+                            self.prefsobj.get('pack channels', False))
+                        self.opt_skip_tiles.setChecked(
+                            self.prefsobj.get('skip default tiles', False))
+                        self.opt_budget.setValue(
+                            self.prefsobj.get('texture budget', 0))
+                        self.opt_handoff.setCurrentText(
+                            self.prefsobj.get('handoff format', 'png'))
+                        self.opt_fold_height.setChecked(
+                            self.prefsobj.get('fold height', False))
+                        self.opt_variants.setCurrentIndex(
+                            self.prefsobj.get('resolution variants', 0))
+                        self.opt_store.setChecked(
+                            self.prefsobj.get('texture store', False))
+                        self.opt_versions.setValue(
+                            self.prefsobj.get('keep versions', 0))
+                        self.opt_changed.setChecked(
+                            self.prefsobj.get('export changed only', False))
+                        self.opt_auto.setChecked(
+                            self.prefsobj.get('auto export', False))
 
                 def _print(self):
                     prefs = self.prefsobj.get('host_prefs', {})
@@ -566,23 +3332,21 @@ class RenderManForSP(object):
                         '%r ------------------------\nLOADED:\n%s\nSTATE:\n%s', self,
                         ''.join(loaded), ''.join(state))
 
-                def _load_rules(self):
-                    fpath = FilePath(root_dir()).join('renderman_rules.json')
-                    if fpath.exists():
-                        with open(fpath, 'r') as hdl:
-                            data = json.load(hdl)
-                        return data
-                    else:
-                        LOG.error('RULES ARE MISSING: can not open %r', fpath)
-                        return {}
-
-                def set_metadata(self, asset, sp_ts):
+                def set_metadata(self, asset, tset, plan=None):
                     meta = asset.stdMetadata()
                     meta['author'] = getpass.getuser()
                     meta['description'] = ('Created by RenderMan for Substance '
                                            'Painter %s' % __version__)
-                    res = sp_ts.get_resolution()
-                    meta['resolution'] = '%d x %d' %  (res.width, res.height)
+                    meta['resolution'] = '%d x %d' % tset.resolution
+                    if plan:
+                        # the resolutions picked to fit the texture budget.
+                        meta['textureBudget'] = '%.1f MB' % (
+                            plan['budget'] / 1048576.0)
+                        meta['textureMemory'] = '%.1f MB' % (
+                            plan['bytes'] / 1048576.0)
+                        meta['mapResolutions'] = dict(
+                            (m, '%d x %d' % tuple(size))
+                            for m, size in plan['maps'].items())
                     for k, v in meta.items():
                         asset.addMetadata(k, v)
                     # Compatibility data
@@ -594,83 +3358,271 @@ class RenderManForSP(object):
                         rendererVersion=str(self.rman_version))
                     LOG.debug_info('  + compatibility set')
 
-                def sp_export(self, export_path):
-                    tset_names = [s.name() for s in spts.all_texture_sets()]
-                    config = dict(self.rules['export_config'])
+                def sp_export(self, export_path, tsets, packable=None,
+                              budget=None, handoff='png', drop=None):
+                    """Export the maps of all texture sets.
+
+                    Arguments:
+                        drop {list} -- the channels that should not be
+                            exported.
+                        handoff {str} -- the maps' file format, a key of
+                            HANDOFF_FORMATS.
+                        budget {callable} -- returns the budget plan of a
+                            texture set, given its packed channels. The maps
+                            are exported at the planned resolution.
+
+                    Returns:
+                        tuple -- the ExportManifest of the exported files and
+                                 the packed channels, keyed by texture set.
+                    """
+                    tset_names = [ts.name for ts in tsets]
+                    config = copy.deepcopy(self.rules['export_config'])
                     tex_path = export_path.join('exported')
                     create_directory(tex_path)
                     config['exportPath'] = tex_path.os_path()
                     # config['defaultExportPreset'] = spr.ResourceID(
                     #     context='allegorithmic', name='Renderman (pxrDisney)').url()
                     config['exportList'] = [{'rootPath': n} for n in tset_names]
+                    if drop:
+                        drop_maps(config, drop)
+                    packed = {}
+                    if packable:
+                        packed = self.pack_channels(config, tsets, packable)
+                    if budget:
+                        for tset in tsets:
+                            plan = budget(tset, packed.get(tset.name, {}))
+                            config['exportParameters'].extend(
+                                budget_parameters(tset, plan))
+                    handoff_config(config, handoff)
                     # print_dict(config, msg='config:\n')
                     result = spex.export_project_textures(config)
                     if result.status != spex.ExportStatus.Success:
                         LOG.error(result.message)
                         raise RuntimeError(result.message)
                     LOG.debug_info('+ Exported --------------------------------------------')
-                    self.spx_exported_files = {}
+                    exported_files = ExportManifest()
                     for stack, texs in result.textures.items():
                         LOG.debug_info('  |_ Stack %s: ', stack)
                         stck_name = stack[0]
-                        self.spx_exported_files[stck_name] = {}
                         for t in texs:
                             LOG.debug_info('     |_ %s', t)
                             if t:
-                                ch_type = re.search(r'_([A-Za-z]+)(\.\d{4})*\.\w{3}$', t).group(1)
-                                if ch_type in self.spx_exported_files[stck_name]:
-                                    self.spx_exported_files[stck_name][ch_type].append(t)
-                                else:
-                                    self.spx_exported_files[stck_name][ch_type] = [t]
+                                ch_type = EXPORTED_FILE.search(t).group(1)
+                                exported_files.add(stck_name, ch_type, t)
+                    return exported_files, packed
+
+                def pack_channels(self, config, tsets, packable):
+                    """Modify the export config to pack scalar channels
+                    in a single map, as described by the 'packing' rules.
+                    Each texture set gets a preset matching its channels.
 
-                def textureset_channels(self, spts_textureset):
+                    Returns:
+                        dict -- the packed channels' components, keyed by
+                                texture set.
+                    """
                     result = {}
-                    ts_name = spts_textureset.name()
-                    chans = spts_textureset.get_stack().all_channels()
-                    for chan_type in chans:
-                        if ts_name in self.spx_exported_files:
-                            ch = chan_type_str(chan_type)
-                            result[chan_type_str(chan_type)] = \
-                                self.spx_exported_files[ts_name].get(ch, [])
+                    layout = self.rules.get('packing', None)
+                    if not layout:
+                        return result
+                    presets = {}
+                    default = [p for p in config['exportPresets']
+                               if p['name'] == config['defaultExportPreset']][0]
+                    for item, tset in zip(config['exportList'], tsets):
+                        packed = dict(
+                            (comp, ch) for comp, ch in layout['channels'].items()
+                            if ch in packable and ch in tset.channels)
+                        if len(packed) < 2:
+                            continue
+                        key = tuple(sorted(packed.items()))
+                        if key not in presets:
+                            presets[key] = pack_preset(
+                                default, '%s_packed%d' % (default['name'],
+                                                          len(presets)),
+                                layout['name'], packed)
+                            config['exportPresets'].append(presets[key])
+                        item['exportPreset'] = presets[key]['name']
+                        result[tset.name] = dict(
+                            (ch, comp) for comp, ch in packed.items())
+                        LOG.debug_info('  + packed %s: %s', tset.name, key)
                     return result
 
-                def txmake(self, is_udim, asset_path, fpath_list, ocio_config,
-                           ocio_colorspace):
+                def textureset_channels(self, job, tset):
+                    """Returns the texture set's exported maps, keyed by
+                    channel. The maps are shared with the manifest, not
+                    copied."""
+                    files = job.files.get(tset.name, None)
+                    if files is None:
+                        return {}
+                    return dict((ch, files.get(ch, ()))
+                                for ch in exported_channels(job, tset))
+
+                def skip_default_tiles(self, job, label, maps):
+                    """Drop the UDIM tiles only holding the channel's default
+                    value: the texture node's missingColor replaces them. A
+                    channel without any remaining tile is dropped.
+
+                    Returns:
+                        set -- the channels with skipped tiles.
+                    """
+                    mappings = job.bxdf_rules['mapping']
+                    todo = [(ch, fpath, mappings[ch]['default'])
+                            for ch, (fpath_list, _) in maps.items()
+                            if mappings.get(ch, {}).get('default', None) and
+                            texture_node_type(ch) == 'PxrTexture'
+                            for fpath in fpath_list]
+                    if not todo:
+                        return set()
+                    jobs = job.jobs or max(1, int(self.prefsobj.get(
+                        'txmake jobs', os.cpu_count() or 1)))
+                    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+                        empty = list(pool.map(
+                            lambda item: is_default_tile(item[1], item[2]),
+                            todo))
+                    skipped = {}
+                    for (ch, fpath, _), is_empty in zip(todo, empty):
+                        if is_empty:
+                            skipped.setdefault(ch, set()).add(fpath)
+                    for ch, fpaths in skipped.items():
+                        fpath_list, colorspace = maps[ch]
+                        kept = [f for f in fpath_list if f not in fpaths]
+                        LOG.debug_info('    |_ %s: skipped %d/%d default tiles',
+                                       ch, len(fpaths), len(fpath_list))
+                        if kept:
+                            maps[ch] = (kept, colorspace)
+                        else:
+                            del maps[ch]
+                    EVENTS.publish('tiles_skipped', asset=label,
+                                   tiles=sum(len(f) for f in skipped.values()))
+                    return set(skipped)
+
+                def convert_maps(self, job, label, is_udim, asset_path, maps):
+                    """Convert maps to textures. The maps are grouped by
+                    color transform, and each group is a 'txmake' stage.
 
+                    Arguments:
+                        maps {dict} -- (file list, colorspace), keyed by map.
+                    """
+                    groups = {}
+                    for map_name, (_, colorspace) in maps.items():
+                        groups.setdefault(colorspace, []).append(map_name)
+                    for colorspace, map_names in groups.items():
+                        LOG.debug_info('    |_ %s: %s', colorspace,
+                                       ', '.join(map_names))
+                        with EVENTS.stage('txmake', asset=label,
+                                          colorspace=colorspace,
+                                          maps=map_names):
+                            self.txmake(is_udim, asset_path,
+                                        (f for m in map_names for f in maps[m][0]),
+                                        job.ocio, colorspace, journal=job.journal,
+                                        variants=job.variants, jobs=job.jobs,
+                                        low_priority=job.low_priority)
+
+                def txmake(self, is_udim, asset_path, fpath_list, ocio,
+                           colorspace, journal=None, variants=0, jobs=None,
+                           low_priority=False):
+                    """Convert maps sharing the same color transform, with
+                    one txmake process per file. Up to 'txmake jobs'
+                    processes run in parallel.
+
+                    Arguments:
+                        variants {int} -- the number of half resolution
+                            variants to convert, in VARIANT_DIR directories.
+                        jobs {int} -- overrides the 'txmake jobs' pref.
+                        low_priority {bool} -- run txmake at a lower priority.
+                    """
                     rmantree = FilePath(os.environ['RMANTREE'])
                     binary = rmantree.join('bin', app('txmake')).os_path()
-                    cmd = [binary]
-                    if is_udim:
-                        cmd += ['-resize', 'round-',
-                                '-mode', 'clamp',
-                                '-format', 'openexr',
-                                '-compression', 'pxr24',
-                                '-newer']
-                    else:
-                        cmd += ['-resize', 'round-',
-                                '-mode', 'periodic',
-                                '-format', 'openexr',
-                                '-compression', 'pxr24',
-                                '-newer']
-                    if ocio_config['path']:
-                        cmd += ['-ocioconfig', ocio_config['path'],
-                                '-ocioconvert', ocio_colorspace, 'rendering']
-                    cmd += ['src', 'dst']
+                    options = ['-resize', 'round-',
+                               '-mode', 'clamp' if is_udim else 'periodic',
+                               '-format', 'openexr',
+                               '-compression', 'pxr24',
+                               '-newer']
+                    cmd = [binary] + options + ocio.transform(colorspace)
                     LOG.debug_info('       |_ cmd = %r', ' '.join(cmd))
-                    for img in fpath_list:
-                        img = FilePath(img)
-                        cmd[-2] = img.os_path()
-                        filename = img.basename()
-                        texfile = os.path.splitext(filename)[0] + '.tex'
-                        cmd[-1] = asset_path.join(texfile).os_path()
-                        LOG.debug_info('       |_ txmake : %s -> %s',
-                                       cmd[-2], cmd[-1])
-                        p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                                             stderr=subprocess.PIPE,
-                                             startupinfo=startup_info())
-                        p.wait()
-
-                    # return a local path to the tex file.
+                    # the conversion is valid as long as the source, the
+                    # options and the color transform are the same.
+                    settings = hashlib.sha1(json.dumps(
+                        [options, ocio.signature(colorspace)]).encode(
+                            'utf-8')).hexdigest()[:16]
+                    dst_dir = asset_path.os_path()
+                    vdirs = [VARIANT_DIR % (2 ** lvl)
+                             for lvl in range(1, variants + 1)]
+                    for vdir in vdirs:
+                        create_directory(FilePath(dst_dir).join(vdir))
+                    jobs = jobs or max(1, int(self.prefsobj.get(
+                        'txmake jobs', os.cpu_count() or 1)))
+
+                    def _conversions():
+                        for img in fpath_list:
+                            src = os.path.normpath(img)
+                            texfile = os.path.splitext(
+                                os.path.basename(src))[0] + '.tex'
+                            dst = os.path.join(dst_dir, texfile)
+                            # the variants are converted from scaled copies
+                            # of the map, saved next to it.
+                            todo = [(src, dst)] + [
+                                (os.path.join(os.path.dirname(src), vdir,
+                                              os.path.basename(src)),
+                                 os.path.join(dst_dir, vdir, texfile))
+                                for vdir in vdirs]
+                            needed = [True] * len(todo)
+                            signature = None
+                            if journal:
+                                src_stat = os.stat(src)
+                                signature = [src_stat.st_mtime,
+                                             src_stat.st_size, settings]
+                                needed = [not journal.converted(d, signature)
+                                          for _, d in todo]
+                                if not any(needed):
+                                    LOG.debug_info(
+                                        '       |_ resume: skipped %s', dst)
+                                    continue
+                            if any(needed[1:]):
+                                # scale down to the smallest missing variant.
+                                depth = max(i for i, n in enumerate(needed) if n)
+                                if not scaled_variants(
+                                        src, [s for s, _ in todo[1:depth + 1]]):
+                                    LOG.debug_warning(
+                                        '       |_ no variants: %s', src)
+                                    needed[1:] = [False] * len(vdirs)
+                            for (vsrc, vdst), need in zip(todo, needed):
+                                if need:
+                                    yield vsrc, vdst, signature
+
+                    def _done(src, dst, signature, future):
+                        returncode, err, seconds = future.result()
+                        LOG.debug_info('       |_ txmake : %s -> %s', src, dst)
+                        if returncode:
+                            LOG.error('txmake failed (%d): %s -> %s\n%s',
+                                      returncode, src, dst, err)
+                        elif err:
+                            LOG.debug_warning('       |_ txmake: %s', err)
+                        if journal and not returncode:
+                            journal.set_converted(dst, signature, save=False)
+                        try:
+                            nbytes = os.path.getsize(dst)
+                        except OSError:
+                            nbytes = 0
+                        EVENTS.publish('map_converted', src=src, dst=dst,
+                                       bytes=nbytes, returncode=returncode,
+                                       seconds=seconds)
+
+                    # only a few conversions are queued at a time, so the
+                    # memory use doesn't depend on the number of tiles.
+                    running = collections.deque()
+                    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+                        for src, dst, signature in _conversions():
+                            running.append((src, dst, signature, pool.submit(
+                                run_txmake, cmd + [src, dst], low_priority)))
+                            if len(running) >= jobs * 2:
+                                _done(*running.popleft())
+                        while running:
+                            _done(*running.popleft())
+                    if journal:
+                        journal.save()
+
+                def tex_file(self, is_udim, asset_path, fpath_list):
+                    """Returns a local path to the tex file."""
                     filename = FilePath(fpath_list[0]).basename()
                     fname, _ = os.path.splitext(filename)
                     asset_file_ref = FilePath(asset_path).join(fname + '.tex')
@@ -681,7 +3633,12 @@ class RenderManForSP(object):
 
             root.setWindowFlag(Qt.SubWindow, True)
             try:
-                self.aui = rui.Ui(SPrefs(rman_version_str, self.prefs), parent=root)
+                self.host_prefs = SPrefs(rman_version_str, self.prefs)
+                if hasattr(ral, 'getAssetList'):
+                    self.asset_list = (ral, ral.getAssetList)
+                    ral.getAssetList = self.host_prefs.indexed_asset_list(
+                        ral.getAssetList)
+                self.aui = rui.Ui(self.host_prefs, parent=root)
             except BaseException:
                 traceback.print_exc(file=sys.stdout)
             else:
@@ -691,6 +3648,16 @@ class RenderManForSP(object):
         return root, dock
 
 
+def wait_for_project(timeout=600.0):
+    """Wait until the opened project is ready to be edited."""
+    start = time.time()
+    while not spp.is_in_edition_state():
+        if time.time() - start > timeout:
+            raise RuntimeError('Timed out while opening the project')
+        QCoreApplication.processEvents()
+        time.sleep(0.1)
+
+
 def pick_rmantree():
     rmantree = QFileDialog.getExistingDirectory(
         None,
@@ -760,12 +3727,266 @@ def set_params(settings_dict, chan, node_name, asset):
                            pname, pdict['value'])
 
 
+TEXTURE_NODES = {'Normal': 'PxrNormalMap', 'Height': 'PxrBump'}
+
+
+def texture_node_type(ch_type):
+    return TEXTURE_NODES.get(ch_type, 'PxrTexture')
+
+
 def add_texture_node(asset, node_name, ntype, filepath):
     asset.addNode(node_name, ntype, 'pattern', ntype)
-    pdict = {'type': 'string', 'value': filepath.basename()}
+    pdict = {'type': 'string', 'value': os.path.basename(filepath)}
     asset.addParam(node_name, 'filename', pdict)
 
 
+# resolution variants are stored in sub-directories of the asset, named
+# after the scale's divisor.
+VARIANT_DIR = 'res%d'
+
+
+def scaled_variants(src, fpaths):
+    """Save half resolution copies of an image: each copy is scaled from
+    the previous one, so the source is only read once.
+
+    Arguments:
+        src {str} -- the source image.
+        fpaths {list} -- the copies' paths, from the largest to the smallest.
+
+    Returns:
+        bool -- False if Qt can't read the image.
+    """
+    img = QImage(src)
+    if img.isNull():
+        return False
+    for fpath in fpaths:
+        img = img.scaled(max(1, img.width() // 2), max(1, img.height() // 2),
+                         Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        dir_path = os.path.dirname(fpath)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        if not img.save(fpath):
+            LOG.warning('Could not save: %s', fpath)
+            return False
+    return True
+
+
+def converted_variants(asset_dir, variants):
+    """Returns the VARIANT_DIR directories holding a copy of every texture
+    of an asset, keyed by scale, i.e. {'1/2': 'res2'}. A scale is missing
+    if a map couldn't be scaled down."""
+    textures = set(f for f in os.listdir(asset_dir) if f.endswith('.tex'))
+    result = {}
+    for lvl in range(1, variants + 1):
+        vdir = VARIANT_DIR % (2 ** lvl)
+        try:
+            converted = set(os.listdir(os.path.join(asset_dir, vdir)))
+        except OSError:
+            break
+        if not textures or not textures <= converted:
+            break
+        result['1/%d' % (2 ** lvl)] = vdir
+    return result
+
+
+# (fileFormat, bitDepth) of the intermediate maps, for maps exported as 8 or
+# 16 bits integers in the rules.
+HANDOFF_FORMATS = {
+    'png': {'8': ('png', '8'), '16': ('png', '16')},
+    'tif': {'8': ('tif', '8'), '16': ('tif', '16')},
+    'exr': {'8': ('exr', '16f'), '16': ('exr', '32f')},
+}
+
+
+def handoff_config(config, fmt):
+    """Set the file format of the maps in an export config. Each map keeps
+    its precision: 8 bits maps are written as half floats in exr files, 16
+    bits maps as floats.
+
+    The export parameters' filters may not match the presets' maps, so
+    every map gets its own file format.
+    """
+    formats = HANDOFF_FORMATS[fmt]
+    default_depth = '8'
+    for item in config['exportParameters']:
+        default_depth = item.get('parameters', {}).get('bitDepth',
+                                                       default_depth)
+
+    def _set(params, depth):
+        depth = '8' if params.get('bitDepth', depth) == '8' else '16'
+        params['fileFormat'], params['bitDepth'] = formats[depth]
+        if params['fileFormat'] == 'exr':
+            params['dithering'] = False
+
+    for item in config['exportParameters']:
+        params = item.get('parameters', {})
+        if 'fileFormat' in params or 'bitDepth' in params:
+            _set(params, default_depth)
+    for preset in config['exportPresets']:
+        for map_dict in preset['maps']:
+            _set(map_dict.setdefault('parameters', {}), default_depth)
+
+
+def drop_maps(config, channels):
+    """Remove the channels' maps from all the presets of an export config."""
+    for preset in config['exportPresets']:
+        preset['maps'] = [
+            m for m in preset['maps']
+            if EXPORTED_CHANNEL.search(m['fileName']).group(1) not in channels]
+
+
+def exported_channels(job, tset):
+    """Returns the texture set's channels that have a map in the export."""
+    channels = list(tset.channels)
+    if job.fold_height and 'Height' in channels:
+        # the normal map combines the height with the normal channel, so
+        # it exists even if the texture set has no normal channel.
+        channels.remove('Height')
+        if 'Normal' not in channels:
+            channels.append('Normal')
+    return channels
+
+
+def pack_preset(preset, name, map_name, packed):
+    """Returns a copy of an export preset where the packed channels are
+    exported in a single map.
+
+    Arguments:
+        preset {dict} -- the export preset to copy.
+        name {str} -- the new preset's name.
+        map_name {str} -- the channel name of the packed map, i.e. 'Packed'.
+        packed {dict} -- channel names, keyed by component ('R', 'G', ...).
+
+    Returns:
+        dict -- the new preset.
+    """
+    new_preset = copy.deepcopy(preset)
+    new_preset['name'] = name
+    new_preset['maps'] = [
+        m for m in new_preset['maps']
+        if EXPORTED_CHANNEL.search(m['fileName']).group(1) not in packed.values()]
+    new_preset['maps'].append({
+        'fileName': '$textureSet_%s(.$udim)' % map_name,
+        'channels': [{'srcChannel': 'R', 'destChannel': comp,
+                      'srcMapType': 'documentMap',
+                      'srcMapName': ch_type[0].lower() + ch_type[1:]}
+                     for comp, ch_type in sorted(packed.items())]})
+    return new_preset
+
+
+# txmake writes half float textures with mipmaps.
+TEXEL_BYTES = 2
+MIPMAP_FACTOR = 4.0 / 3.0
+# maps are never downsized below this resolution to fit a budget.
+BUDGET_MIN_SIZE = 128
+
+
+def texture_bytes(width, height, channels, tiles=1):
+    """Estimated render-time memory of a converted map."""
+    return int(width * height * channels * TEXEL_BYTES * MIPMAP_FACTOR) * tiles
+
+
+def fit_budget(maps, budget, min_size=BUDGET_MIN_SIZE):
+    """Pick how many times each map should be halved to fit a budget.
+
+    The map with the lowest priority is halved first. As its priority is
+    doubled every time, a map of priority 0.5 ends up at half the resolution
+    of a map of priority 1.
+
+    Arguments:
+        maps {dict} -- (width, height, channels, tiles, priority), keyed by
+                       map name.
+        budget {int} -- the maximum size in bytes.
+
+    Returns:
+        tuple -- the number of halvings keyed by map name, and the estimated
+                 size in bytes. The size may exceed the budget if all maps
+                 reached the minimum resolution.
+    """
+    levels = dict.fromkeys(maps, 0)
+
+    def _bytes(name):
+        width, height, channels, tiles, _ = maps[name]
+        return texture_bytes(width >> levels[name], height >> levels[name],
+                             channels, tiles)
+
+    total = sum(_bytes(n) for n in maps)
+    heap = [(maps[n][4], -_bytes(n), n) for n in maps]
+    heapq.heapify(heap)
+    while total > budget and heap:
+        _, _, name = heapq.heappop(heap)
+        width, height, _, _, priority = maps[name]
+        if min(width, height) >> (levels[name] + 1) < min_size:
+            continue
+        before = _bytes(name)
+        levels[name] += 1
+        total -= before - _bytes(name)
+        heapq.heappush(heap, (priority * 2 ** levels[name], -_bytes(name),
+                              name))
+    return levels, total
+
+
+def budget_plan(job, tset, packed):
+    """Returns the texture set's maps resolutions fitting the job's budget,
+    or None if the job has no budget.
+
+    Returns:
+        dict -- the 'budget' and estimated 'bytes', and the resolution of
+                each map in 'maps'.
+    """
+    if not job.budget:
+        return None
+    mappings = job.bxdf_rules['mapping']
+    width, height = tset.resolution
+    maps = {}
+    for ch_type in exported_channels(job, tset):
+        if ch_type in packed or ch_type not in mappings:
+            continue
+        chdict = mappings[ch_type]
+        channels = 3 if chdict.get('type', None) in ('color', 'normal',
+                                                     'vector') else 1
+        maps[ch_type] = (width, height, channels, tset.tiles,
+                         chdict.get('priority', 1.0))
+    if packed:
+        maps[job.rules['packing']['name']] = (
+            width, height, len(packed), tset.tiles,
+            max(mappings.get(ch, {}).get('priority', 1.0) for ch in packed))
+    levels, nbytes = fit_budget(maps, job.budget)
+    if nbytes > job.budget:
+        LOG.warning('%s: %.1f MB over the texture budget at the minimum '
+                    'resolution', tset.name,
+                    (nbytes - job.budget) / 1048576.0)
+    return {'budget': job.budget, 'bytes': nbytes,
+            'maps': dict((n, [width >> k, height >> k])
+                         for n, k in levels.items())}
+
+
+def budget_parameters(tset, plan):
+    """Returns the export parameters setting the resolution of the maps
+    downsized by a budget plan."""
+    params = []
+    for map_name, (width, height) in sorted(plan['maps'].items()):
+        if (width, height) == tuple(tset.resolution):
+            continue
+        params.append({
+            'filter': {'dataPaths': [tset.name],
+                       'outputMaps': ['$textureSet_%s(.$udim)' % map_name]},
+            'parameters': {'sizeLog2': [width.bit_length() - 1,
+                                        height.bit_length() - 1]}})
+    return params
+
+
+def directory_size(dir_path):
+    total = 0
+    for dirpath, _, filenames in os.walk(dir_path):
+        for fname in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, fname))
+            except OSError:
+                pass
+    return total
+
+
 def chan_type_str(channel_type):
     return str(channel_type).split('.')[-1]
 
@@ -780,6 +4001,58 @@ def app(name):
     return name
 
 
+def qt_reads(fmt):
+    """True if Qt can read images in a file format, i.e. 'png'."""
+    return fmt.lower() in [bytes(f).decode('ascii', 'replace').lower()
+                           for f in QImageReader.supportedImageFormats()]
+
+
+def is_default_tile(fpath, default, chunk_rows=64):
+    """Returns True if the image only holds the default value.
+
+    The pixels are compared to the first one, a chunk of rows at a time, so
+    painted tiles are usually rejected after the first chunk. Images Qt can't
+    read are never considered empty.
+    """
+    img = QImage(fpath)
+    if img.isNull():
+        return False
+    img = img.convertToFormat(QImage.Format_RGBA8888)
+    buf = memoryview(img.constBits())
+    first = bytes(buf[:4])
+    expected = [int(round(v * 255.0)) for v in (list(default) + [1.0])[:4]]
+    if any(abs(v - e) > 1 for v, e in zip(bytearray(first), expected)):
+        return False
+    bpl = img.bytesPerLine()
+    chunk = first * img.width() * chunk_rows
+    height = img.height()
+    for y in range(0, height, chunk_rows):
+        rows = min(chunk_rows, height - y)
+        if bytes(buf[y * bpl:(y + rows) * bpl]) != chunk[:rows * bpl]:
+            return False
+    return True
+
+
+def run_txmake(cmd, low_priority=False):
+    """Run a txmake command.
+
+    Returns:
+        tuple -- the return code, stderr's content and the duration.
+    """
+    start = time.time()
+    kwargs = {}
+    if low_priority:
+        if os.name == 'nt':
+            kwargs['creationflags'] = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        else:
+            cmd = ['nice', '-n', '10'] + cmd
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         startupinfo=startup_info(), **kwargs)
+    _, err = p.communicate()
+    return (p.returncode, err.decode('utf-8', 'replace').strip(),
+            time.time() - start)
+
+
 def startup_info():
     """Returns a Windows-only object to make sure tasks launched through
     subprocess don't open a cmd window.
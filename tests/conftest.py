@@ -0,0 +1,261 @@
+"""Test configuration.
+
+The plugin imports Substance Painter's python API and PySide2 at the top of
+the module. When they are not available, they are replaced by stand-ins, so
+the parts of the plugin that don't talk to Substance Painter can be tested
+with a plain python interpreter.
+"""
+import json
+import os
+import shutil
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+QT_MODULES = ('PySide2', 'PySide2.QtCore', 'PySide2.QtGui', 'PySide2.QtWidgets')
+SP_MODULES = ('substance_painter', 'substance_painter.ui',
+              'substance_painter.logging', 'substance_painter.project',
+              'substance_painter.textureset', 'substance_painter.export',
+              'substance_painter.event')
+
+
+def _stub_modules(names):
+    try:
+        __import__(names[-1])
+    except ImportError:
+        for name in names:
+            sys.modules[name] = mock.MagicMock(name=name)
+        return True
+    return False
+
+
+_stub_modules(QT_MODULES)
+if _stub_modules(SP_MODULES):
+    spl = types.ModuleType('substance_painter.logging')
+    for _level, _name in enumerate(('INFO', 'WARNING', 'ERROR', 'DBG_INFO',
+                                    'DBG_WARNING', 'DBG_ERROR')):
+        setattr(spl, _name, _level)
+    spl.log = lambda level, channel, msg: None
+    sys.modules['substance_painter.logging'] = spl
+    sys.modules['substance_painter'].logging = spl
+    sys.modules['substance_painter'].__version__ = '0.2.0'
+
+
+def pytest_addoption(parser):
+    parser.addoption('--update-golden', action='store_true', default=False,
+                     help='(re)write the golden files instead of comparing.')
+
+
+class FilePath(str):
+    """A stand-in for rman_utils' FilePath."""
+
+    def join(self, *args):
+        return FilePath(os.path.join(self, *args))
+
+    def os_path(self):
+        return str(self)
+
+    def exists(self):
+        return os.path.exists(self)
+
+    def basename(self):
+        return os.path.basename(self)
+
+
+class FakePrefs(dict):
+    """A stand-in for the plugin's Prefs, which is saved next to the
+    plugin."""
+
+    @property
+    def prefs(self):
+        return self
+
+    def get(self, key, default):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def save(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def debug_log(monkeypatch):
+    """Errors dump the debug log next to the plugin: drop it instead."""
+    import renderman_for_sp as rfsp
+    monkeypatch.setattr(rfsp.LOG, 'flush_ring', rfsp.LOG.ring.clear)
+
+
+@pytest.fixture
+def rman_utils(monkeypatch, tmp_path):
+    """Replace the preset browser's modules, which come with RenderMan."""
+
+    class HostPrefs(object):
+
+        def __init__(self, rman_version):
+            self.rman_version = rman_version
+            self.cfg = None
+
+    import renderman_for_sp as rfsp
+    ral = types.ModuleType('rman_utils.rman_assets.lib')
+    ral.HostPrefs = HostPrefs
+    ral.getAbsCategoryPath = lambda cfg, categorypath: str(
+        tmp_path / 'library' / categorypath)
+    filepath = types.ModuleType('rman_utils.filepath')
+    filepath.FilePath = FilePath
+    rman_assets = types.ModuleType('rman_utils.rman_assets')
+    rman_assets.core = mock.MagicMock()
+    rman_assets.ui = mock.MagicMock()
+    rman_assets.lib = ral
+    package = types.ModuleType('rman_utils')
+    package.rman_assets = rman_assets
+    package.filepath = filepath
+    modules = {'rman_utils': package,
+               'rman_utils.rman_assets': rman_assets,
+               'rman_utils.rman_assets.core': rman_assets.core,
+               'rman_utils.rman_assets.ui': rman_assets.ui,
+               'rman_utils.rman_assets.lib': ral,
+               'rman_utils.filepath': filepath}
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.setattr(rfsp, 'env_check', lambda prefs: '24')
+    return package
+
+
+@pytest.fixture
+def prefs():
+    return FakePrefs({'RMANTREE': '/opt/pixar/RenderManProServer-24.0',
+                      'host_prefs': {}, 'last bxdf': 'PxrSurface',
+                      'ocio config': 'Off'})
+
+
+@pytest.fixture
+def plugin(rman_utils, prefs):
+    """The plugin, built without Substance Painter and RenderMan."""
+    import renderman_for_sp as rfsp
+    plugin = rfsp.RenderManForSP.__new__(rfsp.RenderManForSP)
+    plugin.prefs = prefs
+    plugin.host_prefs = None
+    plugin.asset_list = None
+    plugin.event_sinks = []
+    plugin.widget, plugin.dock = plugin.build_panel()
+    assert plugin.host_prefs is not None
+    return plugin
+
+
+@pytest.fixture
+def host_prefs(plugin):
+    return plugin.host_prefs
+
+
+class TextureSet(object):
+    """A stand-in for Substance Painter's texture sets."""
+
+    def __init__(self, name, channels, resolution=(256, 256)):
+        self._name = name
+        self.channels = channels
+        self.resolution = resolution
+
+    def name(self):
+        return self._name
+
+    def has_uv_tiles(self):
+        return False
+
+    def get_resolution(self):
+        return types.SimpleNamespace(width=self.resolution[0],
+                                     height=self.resolution[1])
+
+    def get_stack(self):
+        return types.SimpleNamespace(all_channels=lambda: self.channels)
+
+    def all_uv_tiles(self):
+        return []
+
+
+class Project(object):
+    """Exports a stand-in project through the export dialog's code path:
+    the maps are written by a fake map export and copied by a fake txmake.
+    """
+
+    def __init__(self, host_prefs, fpath, texture_sets):
+        self.host_prefs = host_prefs
+        self.fpath = fpath
+        self.texture_sets = texture_sets
+
+    def sp_export(self, export_path, tsets, packable=None, budget=None,
+                  handoff='png', drop=None):
+        import renderman_for_sp as rfsp
+        files = rfsp.ExportManifest()
+        tex_dir = os.path.join(str(export_path), 'exported')
+        os.makedirs(tex_dir, exist_ok=True)
+        for tset in tsets:
+            for channel in tset.channels:
+                if drop and channel in drop:
+                    continue
+                fpath = os.path.join(tex_dir, '%s_%s.%s' % (tset.name,
+                                                            channel, handoff))
+                with open(fpath, 'w') as fhdl:
+                    fhdl.write('%s %s' % (tset.name, channel))
+                files.add(tset.name, channel, fpath)
+        return files, {}
+
+    def export(self, label, categorypath, preview='none'):
+        """Export the project like the preset browser does. Returns the
+        export's result."""
+        import renderman_for_sp as rfsp
+        result = self.host_prefs.exportMaterial(categorypath,
+                                                {'label': label}, preview)
+        rfsp.SWATCHES.join()
+        return result
+
+
+@pytest.fixture
+def project(host_prefs, prefs, rman_utils, monkeypatch, tmp_path):
+    """A saved project with two texture sets and a library."""
+    import tempfile
+    import renderman_for_sp as rfsp
+    fpath = str(tmp_path / 'robot.spp')
+    with open(fpath, 'w') as fhdl:
+        fhdl.write('spp')
+    channels = ['BaseColor', 'Roughness', 'Metallic', 'Normal']
+    proj = Project(host_prefs, fpath,
+                   [TextureSet('body', channels), TextureSet('eyes', channels)])
+    for name, value in (('file_path', lambda: proj.fpath),
+                        ('name', lambda: 'robot'),
+                        ('is_open', lambda: True),
+                        ('needs_saving', lambda: False)):
+        monkeypatch.setattr(rfsp.spp, name, value, raising=False)
+    monkeypatch.setattr(rfsp.spts, 'all_texture_sets',
+                        lambda: proj.texture_sets, raising=False)
+    monkeypatch.setattr(host_prefs, 'sp_export', proj.sp_export)
+
+    def _txmake(cmd, low_priority=False):
+        shutil.copyfile(cmd[-2], cmd[-1])
+        return 0, '', 0.0
+    monkeypatch.setattr(rfsp, 'run_txmake', _txmake)
+    monkeypatch.setattr(rfsp, 'QImageReader', types.SimpleNamespace(
+        supportedImageFormats=lambda: [b'png', b'jpg', b'tif']))
+    monkeypatch.setenv('RMANTREE', prefs['RMANTREE'])
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path / 'tmp'))
+    os.makedirs(str(tmp_path / 'tmp'))
+
+    def _save(fpath, *args):
+        with open(str(fpath), 'w') as fhdl:
+            json.dump({'RenderManAsset': {'label': 'robot'}}, fhdl)
+    asset = rman_utils.rman_assets.core.RmanAsset.return_value
+    asset.save.side_effect = _save
+    library = tmp_path / 'library'
+    for category in ('Materials', 'Props'):
+        os.makedirs(str(library / category))
+    host_prefs.rpbSelectedLibrary = FilePath(str(library))
+    host_prefs.rpbUserLibraries = [FilePath(str(library))]
+    prefs['swatch mode'] = 'off'
+    return proj
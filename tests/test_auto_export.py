@@ -0,0 +1,68 @@
+"""Tests of the auto export, which runs without the export dialog."""
+from unittest import mock
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+PROJECT = '/projects/robot.spp'
+TARGET = {'category': 'Materials', 'label': 'robot'}
+
+
+@pytest.fixture
+def prefs(prefs):
+    prefs.update({'auto export': True,
+                  'auto export targets': {PROJECT: TARGET},
+                  'handoff format': 'exr', 'texture budget': 64})
+    return prefs
+
+
+@pytest.fixture
+def host_prefs(host_prefs, monkeypatch):
+    monkeypatch.setattr(rfsp.spp, 'is_open', lambda: True, raising=False)
+    monkeypatch.setattr(rfsp.spp, 'file_path', lambda: PROJECT, raising=False)
+    monkeypatch.setattr(rfsp.spp, 'is_in_edition_state', lambda: True,
+                        raising=False)
+    monkeypatch.setattr(rfsp.DIRTY, 'dirty', lambda project, target: ['body'])
+    return host_prefs
+
+
+def test_auto_export_without_dialog(host_prefs, monkeypatch):
+    exported, submitted = [], []
+    monkeypatch.setattr(host_prefs, 'export_maps', exported.append)
+    monkeypatch.setattr(rfsp.AUTO_EXPORTS, 'submit',
+                        lambda func, *args, **kwargs: submitted.append(args))
+    assert host_prefs.opt_bxdf is None
+    host_prefs.auto_export()
+    assert len(exported) == 1
+    job = exported[0]
+    # the options saved by the last export from the dialog.
+    assert (job.label, job.bxdf, job.handoff) == ('robot', 'PxrSurface', 'exr')
+    assert job.budget == 64 * 1048576
+    assert job.ocio_config['config'] == 'Off'
+    assert job.only_changed and job.low_priority
+    assert job.only == ['body']
+    assert submitted == [(job, 'Materials')]
+
+
+def test_closed_dialog(host_prefs, prefs):
+    """Qt deletes the widgets of a closed dialog: the saved options are
+    kept."""
+    deleted = mock.MagicMock()
+    deleted.currentText.side_effect = RuntimeError(
+        'Internal C++ object already deleted.')
+    host_prefs.opt_bxdf = deleted
+    host_prefs.save_export_options()
+    assert prefs['last bxdf'] == 'PxrSurface'
+    assert host_prefs.export_job('robot').bxdf == 'PxrSurface'
+
+
+def test_auto_export_errors_are_logged(host_prefs, monkeypatch):
+    def _fail(job):
+        raise RuntimeError('export failed')
+    monkeypatch.setattr(host_prefs, 'export_maps', _fail)
+    errors = []
+    monkeypatch.setattr(rfsp.LOG, 'error',
+                        lambda msg, *args: errors.append(msg % args))
+    host_prefs.auto_export()
+    assert errors == ['Auto export failed: export failed']
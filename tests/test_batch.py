@@ -0,0 +1,61 @@
+"""Tests of the batch export of several projects."""
+import json
+import os
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+
+@pytest.fixture
+def projects(project, monkeypatch, tmp_path):
+    """Two saved projects and a missing one, opened by the stand-in
+    project."""
+    fpaths = []
+    for name in ('robot', 'missing', 'crate'):
+        fpath = str(tmp_path / ('%s.spp' % name))
+        if name != 'missing':
+            with open(fpath, 'w') as fhdl:
+                fhdl.write('spp')
+        fpaths.append(fpath)
+
+    def _open(fpath):
+        if not os.path.exists(fpath):
+            raise RuntimeError('Can not open %s' % fpath)
+        project.fpath = fpath
+    monkeypatch.setattr(rfsp.spp, 'open', _open, raising=False)
+    monkeypatch.setattr(rfsp.spp, 'close', lambda: None, raising=False)
+    monkeypatch.setattr(rfsp.spp, 'is_in_edition_state', lambda: True,
+                        raising=False)
+    monkeypatch.setattr(
+        rfsp.spp, 'name',
+        lambda: os.path.splitext(os.path.basename(project.fpath))[0],
+        raising=False)
+    # the batch report is written next to the plugin.
+    monkeypatch.setattr(rfsp, 'root_dir', lambda: str(tmp_path))
+    return fpaths
+
+
+def test_batch_export(project, projects, tmp_path):
+    report = project.host_prefs.batch_export(projects, 'Materials')
+    rfsp.SWATCHES.join()
+    assert [(e['project'], e['status']) for e in report] == [
+        (projects[0], 'success'), (projects[1], 'error'),
+        (projects[2], 'success')]
+    assert report[1]['error'] == 'Can not open %s' % projects[1]
+    assert report[0]['assets'] == ['robot_body', 'robot_eyes']
+    assert report[2]['assets'] == ['crate_body', 'crate_eyes']
+    installed = os.listdir(str(tmp_path / 'library' / 'Materials'))
+    assert sorted(f for f in installed if not f.startswith('.')) == [
+        'crate_body.rma', 'crate_eyes.rma', 'robot_body.rma', 'robot_eyes.rma']
+    saved = [f for f in os.listdir(str(tmp_path))
+             if f.startswith('rfsp_batch_')]
+    assert len(saved) == 1
+    with open(str(tmp_path / saved[0]), 'r') as fhdl:
+        assert json.load(fhdl)['projects'] == report
+
+
+def test_unsaved_project(project, projects, monkeypatch):
+    monkeypatch.setattr(rfsp.spp, 'needs_saving', lambda: True, raising=False)
+    with pytest.raises(RuntimeError):
+        project.host_prefs.batch_export(projects, 'Materials')
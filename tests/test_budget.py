@@ -0,0 +1,87 @@
+"""Tests of the texture memory budget."""
+import pytest
+
+import renderman_for_sp as rfsp
+
+MB = 1048576
+
+
+def test_within_budget():
+    maps = {'BaseColor': (2048, 2048, 3, 1, 1.0)}
+    levels, nbytes = rfsp.fit_budget(maps, 64 * MB)
+    assert levels == {'BaseColor': 0}
+    assert nbytes == rfsp.texture_bytes(2048, 2048, 3)
+
+
+def test_priorities():
+    maps = {'BaseColor': (2048, 2048, 3, 1, 1.0),
+            'Roughness': (2048, 2048, 3, 1, 0.5)}
+    levels, nbytes = rfsp.fit_budget(maps, 12 * MB)
+    # the low priority map ends up at half the resolution.
+    assert levels == {'BaseColor': 1, 'Roughness': 2}
+    assert nbytes <= 12 * MB
+    assert nbytes == rfsp.texture_bytes(1024, 1024, 3) + \
+        rfsp.texture_bytes(512, 512, 3)
+
+
+def test_minimum_size():
+    maps = {'BaseColor': (512, 512, 3, 10, 1.0)}
+    levels, nbytes = rfsp.fit_budget(maps, 1, min_size=128)
+    assert levels == {'BaseColor': 2}
+    # over budget at the minimum resolution.
+    assert nbytes == rfsp.texture_bytes(128, 128, 3, 10) > 1
+
+
+def test_tiles_count():
+    one = rfsp.fit_budget({'m': (1024, 1024, 1, 1, 1.0)}, 2 * MB)[0]
+    many = rfsp.fit_budget({'m': (1024, 1024, 1, 4, 1.0)}, 2 * MB)[0]
+    assert many['m'] == one['m'] + 1
+
+
+@pytest.fixture
+def job(host_prefs, prefs):
+    prefs['texture budget'] = 32
+    return host_prefs.export_job('robot')
+
+
+def test_no_budget(host_prefs):
+    job = host_prefs.export_job('robot')
+    tset = rfsp.TextureSetInfo('body', False, (2048, 2048), ['BaseColor'], 1)
+    assert rfsp.budget_plan(job, tset, {}) is None
+
+
+def test_budget_plan(job):
+    tset = rfsp.TextureSetInfo(
+        'body', True, (2048, 2048),
+        ['BaseColor', 'Roughness', 'Metallic', 'Normal', 'User0'], 2)
+    plan = rfsp.budget_plan(job, tset, {})
+    assert plan['budget'] == 32 * MB
+    assert plan['bytes'] <= 32 * MB
+    assert sorted(plan['maps']) == ['BaseColor', 'Metallic', 'Normal',
+                                    'Roughness']
+    # the maps of the same priority are halved in turn, largest first.
+    assert plan['maps'] == {'BaseColor': [512, 512], 'Normal': [1024, 1024],
+                            'Roughness': [512, 512], 'Metallic': [512, 512]}
+    params = rfsp.budget_parameters(tset, plan)
+    assert params[0] == {
+        'filter': {'dataPaths': ['body'],
+                   'outputMaps': ['$textureSet_BaseColor(.$udim)']},
+        'parameters': {'sizeLog2': [9, 9]}}
+    assert len(params) == 4
+
+
+def test_budget_plan_with_packed_channels(job):
+    tset = rfsp.TextureSetInfo(
+        'body', False, (2048, 2048),
+        ['BaseColor', 'Roughness', 'Metallic', 'Normal'], 1)
+    plan = rfsp.budget_plan(job, tset, {'Roughness': 'R', 'Metallic': 'G'})
+    assert sorted(plan['maps']) == ['BaseColor', 'Normal', 'Packed']
+    assert plan['bytes'] <= 32 * MB
+
+
+def test_full_resolution_maps_are_not_resized():
+    tset = rfsp.TextureSetInfo('body', False, (1024, 1024), ['BaseColor'], 1)
+    plan = {'maps': {'BaseColor': [1024, 1024], 'Roughness': [256, 256]}}
+    assert [p['filter']['outputMaps'] for p in
+            rfsp.budget_parameters(tset, plan)] == [
+                ['$textureSet_Roughness(.$udim)']]
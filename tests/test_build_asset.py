@@ -0,0 +1,105 @@
+"""Tests of the asset build, with stand-ins for RenderMan's modules."""
+import types
+from unittest import mock
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+CHANNELS = ['BaseColor', 'Roughness', 'Metallic', 'Opacity', 'Normal',
+            'Height']
+
+
+@pytest.fixture
+def prefs(prefs):
+    prefs['last bxdf'] = 'PxrDisney'
+    return prefs
+
+
+@pytest.fixture
+def job(host_prefs, tmp_path):
+    job = host_prefs.export_job('robot')
+    job.journal = mock.MagicMock()
+    for ch_type in CHANNELS:
+        job.files.add('body', ch_type,
+                      str(tmp_path / 'exported' / ('body_%s.png' % ch_type)))
+    return job
+
+
+@pytest.fixture
+def converted(host_prefs, monkeypatch):
+    """The maps handed over to txmake, keyed by map."""
+    maps = {}
+    monkeypatch.setattr(
+        host_prefs, 'convert_maps',
+        lambda job, label, is_udim, asset_path, todo: maps.update(todo))
+    return maps
+
+
+def build(host_prefs, job, asset_path):
+    tset = rfsp.TextureSetInfo('body', False, (256, 256), CHANNELS, 1)
+    chans = host_prefs.textureset_channels(job, tset)
+    host_prefs._build_asset(job, tset, 'robot', asset_path, chans)
+
+
+def test_pruned_maps_are_not_converted(host_prefs, job, converted, rman_utils,
+                                       tmp_path):
+    build(host_prefs, job,
+          rman_utils.filepath.FilePath(str(tmp_path / 'robot.rma')))
+    # PxrDisney has no opacity, and the height is not connected.
+    assert sorted(converted) == ['BaseColor', 'Metallic', 'Normal',
+                                 'Roughness']
+
+
+@pytest.fixture
+def udim_job(host_prefs, tmp_path):
+    job = host_prefs.export_job('robot')
+    job.journal = mock.MagicMock()
+    for ch_type in CHANNELS:
+        for tile in (1001, 1002):
+            job.files.add('body', ch_type, str(
+                tmp_path / 'exported' / ('body_%s.%d.png' % (ch_type, tile))))
+    return job
+
+
+def missing_params(rman_utils):
+    asset = rman_utils.rman_assets.core.RmanAsset.return_value
+    return sorted((c[0][0], c[0][1]) for c in asset.addParam.call_args_list
+                  if c[0][1].startswith('missing'))
+
+
+@pytest.mark.parametrize('skip_tiles', [False, True])
+def test_missing_color_of_skipped_tiles(host_prefs, udim_job, converted,
+                                        rman_utils, monkeypatch, tmp_path,
+                                        skip_tiles):
+    # the second metallic tile holds the default value.
+    monkeypatch.setattr(rfsp, 'is_default_tile',
+                        lambda fpath, default: 'Metallic.1002' in fpath)
+    udim_job.skip_tiles = skip_tiles
+    tset = rfsp.TextureSetInfo('body', True, (256, 256), CHANNELS, 2)
+    chans = host_prefs.textureset_channels(udim_job, tset)
+    host_prefs._build_asset(
+        udim_job, tset, 'robot', rman_utils.filepath.FilePath(
+            str(tmp_path / 'robot.rma')), chans)
+    if skip_tiles:
+        assert len(converted['Metallic'][0]) == 1
+        assert missing_params(rman_utils) == [
+            ('robot_Metallic_tex', 'missingAlpha'),
+            ('robot_Metallic_tex', 'missingColor')]
+    else:
+        assert len(converted['Metallic'][0]) == 2
+        assert missing_params(rman_utils) == []
+
+
+@pytest.mark.parametrize('handoff, skip_tiles', [('png', True),
+                                                 ('exr', False)])
+def test_skip_tiles_needs_readable_maps(host_prefs, prefs, monkeypatch,
+                                        handoff, skip_tiles):
+    prefs.update({'skip default tiles': True, 'handoff format': handoff})
+    monkeypatch.setattr(rfsp, 'QImageReader', types.SimpleNamespace(
+        supportedImageFormats=lambda: [b'png', b'tif']))
+    warnings = []
+    monkeypatch.setattr(rfsp.LOG, 'warning',
+                        lambda msg, *args: warnings.append(msg % args))
+    assert host_prefs.export_job('robot').skip_tiles == skip_tiles
+    assert len(warnings) == (0 if skip_tiles else 1)
@@ -0,0 +1,183 @@
+"""Tests of the legacy plugin's export server, with a stand-in exporter:
+the protocol, the token check and the confinement of the maps to the
+export directory."""
+import builtins
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from urllib import error, request
+
+import pytest
+
+from conftest import ROOT
+
+# the legacy plugin is python 2 code.
+if not hasattr(builtins, 'unicode'):
+    builtins.unicode = str
+sys.path.insert(0, os.path.join(ROOT, 'RenderMan'))
+import rmanAssetsSubstancePainter as rasp   # noqa: E402
+
+BaseExporter = rasp.Exporter
+
+
+class Exporter(BaseExporter):
+    """Records the requests instead of converting maps and building the
+    assets, which needs RenderMan."""
+
+    def __init__(self, settings, export_path, jobs=None):
+        self.settings = settings
+        self.export_path = rasp.FilePath(export_path)
+        self.is_udim = settings['udim']
+        self.materials = {}
+        self.queue = rasp.queue.Queue()
+        self.workers = []
+        self.state = 'running'
+
+    def finish(self):
+        self.state = 'finished'
+
+    def abort(self):
+        BaseExporter.abort(self)
+        self.state = 'aborted'
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class Client(object):
+
+    def __init__(self, port, token):
+        self.url = 'http://127.0.0.1:%d' % port
+        self.token = token
+
+    def call(self, path, data=None, token=None,
+             content_type='application/json'):
+        """Returns the reply's status and data."""
+        headers = {'X-RfSP-Token': token or self.token}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = content_type
+        req = request.Request(self.url + path, data=body, headers=headers)
+        try:
+            with request.urlopen(req, timeout=10.0) as reply:
+                return reply.status, json.loads(reply.read().decode('utf-8'))
+        except error.HTTPError as err:
+            return err.code, json.loads(err.read().decode('utf-8'))
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    created = []
+
+    def _exporter(settings, export_path):
+        created.append(Exporter(settings, export_path))
+        return created[-1]
+    monkeypatch.setattr(rasp, 'Exporter', _exporter)
+    return created
+
+
+@pytest.fixture
+def client(jobs, monkeypatch, tmp_path):
+    port = free_port()
+    token_file = str(tmp_path / ('.daemon_%d.token' % port))
+    monkeypatch.setattr(rasp, 'DAEMON_TOKEN',
+                        str(tmp_path / '.daemon_%d.token'))
+    thread = threading.Thread(target=rasp.serve,
+                              args=(port, logging.StreamHandler()))
+    thread.start()
+    deadline = time.time() + 10.0
+    while not os.path.exists(token_file) and time.time() < deadline:
+        time.sleep(0.01)
+    with open(token_file, 'r') as fhdl:
+        client = Client(port, fhdl.read())
+    yield client
+    client.call('/quit', {})
+    thread.join(10.0)
+    assert not thread.is_alive()
+    # the token is removed when the server stops.
+    assert not os.path.exists(token_file)
+
+
+def settings(tmp_path):
+    export_dir = tmp_path / 'export'
+    export_dir.mkdir(exist_ok=True)
+    return {'scene': 'robot', 'udim': False, 'exportPath': str(export_dir)}
+
+
+def test_token_file_is_private(client, tmp_path):
+    token_file = [f for f in os.listdir(str(tmp_path))
+                  if f.endswith('.token')][0]
+    assert os.stat(str(tmp_path / token_file)).st_mode & 0o077 == 0
+
+
+def test_job_protocol(client, jobs, tmp_path):
+    assert client.call('/ping')[0] == 200
+    status, reply = client.call('/jobs', settings(tmp_path))
+    assert (status, reply['job']) == (200, 1)
+    fpath = str(tmp_path / 'export' / 'body_BaseColor.png')
+    status, reply = client.call('/jobs/1/maps', {
+        'textureSet': 'body', 'resolution': [256, 256],
+        'channel': 'BaseColor', 'path': fpath})
+    assert (status, reply['job']) == (200, 1)
+    assert jobs[0].materials['body']['channels'] == {'BaseColor': [fpath]}
+    assert client.call('/jobs/1/end', {})[0] == 200
+    assert jobs[0].state == 'finished'
+    # the job is gone.
+    assert client.call('/jobs/1/maps', {})[0] == 404
+    client.call('/jobs', settings(tmp_path))
+    assert client.call('/jobs/2/abort', {})[0] == 200
+    assert jobs[1].state == 'aborted'
+    assert client.call('/unknown', {})[0] == 404
+
+
+def test_unauthorized(client, jobs, tmp_path):
+    status, reply = client.call('/ping', token='guessed')
+    assert (status, reply['error']) == (403, 'unauthorized')
+    assert client.call('/jobs', settings(tmp_path), token='guessed')[0] == 403
+    assert jobs == []
+
+
+def test_json_only(client, jobs, tmp_path):
+    # a web page can post forms without a preflight request.
+    status, reply = client.call('/jobs', settings(tmp_path),
+                                content_type='text/plain')
+    assert (status, reply['error']) == (415, 'expected application/json')
+    assert jobs == []
+
+
+def test_maps_outside_the_export_dir(client, jobs, tmp_path):
+    client.call('/jobs', settings(tmp_path))
+    # the converted maps are deleted: other files must not be accepted.
+    outside = str(tmp_path / 'project' / 'body_BaseColor.png')
+    escaping = str(tmp_path / 'export' / '..' / 'body_BaseColor.png')
+    for fpath in (outside, escaping):
+        status, reply = client.call('/jobs/1/maps', {
+            'textureSet': 'body', 'resolution': [256, 256],
+            'channel': 'BaseColor', 'path': fpath})
+        assert status == 500
+        assert 'is not in' in reply['error']
+    assert jobs[0].materials == {}
+
+
+def test_is_inside(tmp_path):
+    export_dir = str(tmp_path / 'export')
+    os.makedirs(export_dir)
+    assert rasp.is_inside(os.path.join(export_dir, 'a.png'), export_dir)
+    assert not rasp.is_inside(export_dir, export_dir)
+    assert not rasp.is_inside(str(tmp_path / 'export2' / 'a.png'), export_dir)
+    assert not rasp.is_inside(
+        os.path.join(export_dir, '..', 'a.png'), export_dir)
+    # links are resolved.
+    os.symlink(str(tmp_path), os.path.join(export_dir, 'link'))
+    assert not rasp.is_inside(os.path.join(export_dir, 'link', 'a.png'),
+                              export_dir)
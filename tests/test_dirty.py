@@ -0,0 +1,114 @@
+"""Tests of the dirty texture set tracking, with a stub event dispatcher."""
+import json
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+PROJECT = 'project.spp'
+TARGET = 'Materials/asset.rma'
+
+
+class Dispatcher(object):
+
+    def __init__(self):
+        self.handlers = {}
+
+    def connect(self, event_cls, handler):
+        self.handlers.setdefault(event_cls, []).append(handler)
+
+    def disconnect(self, event_cls, handler):
+        self.handlers[event_cls].remove(handler)
+
+    def emit(self, event_cls):
+        for handler in list(self.handlers.get(event_cls, [])):
+            handler(event_cls())
+
+
+class Events(object):
+
+    class LayerStacksModelDataChanged(object):
+        pass
+
+    class ProjectOpened(object):
+        pass
+
+    class ProjectEditionEntered(object):
+        pass
+
+    class ProjectSaved(object):
+        pass
+
+    class ProjectAboutToClose(object):
+        pass
+
+
+class Painter(object):
+    """The project's texture sets: their states and the active one."""
+
+    def __init__(self):
+        self.states = {'body': '2048x2048 basecolor',
+                       'eyes': '512x512 basecolor'}
+        self.active = 'body'
+
+
+@pytest.fixture
+def painter():
+    return Painter()
+
+
+@pytest.fixture
+def tracker(tmp_path, painter):
+    dispatcher = Dispatcher()
+    tracker = rfsp.DirtyTracker(
+        str(tmp_path / 'dirty.json'), dispatcher=dispatcher, events=Events,
+        project=lambda: PROJECT, active=lambda: painter.active,
+        states=lambda: dict(painter.states))
+    tracker.start()
+    dispatcher.emit(Events.ProjectOpened)
+    yield tracker
+    tracker.stop()
+
+
+def test_dirty_until_exported(tracker):
+    assert tracker.dirty(PROJECT, TARGET) == ['body', 'eyes']
+    seq = tracker.sequence(PROJECT)
+    tracker.mark_exported(PROJECT, TARGET, ['body', 'eyes'], seq)
+    assert tracker.dirty(PROJECT, TARGET) == []
+    # other assets still need an export.
+    assert tracker.dirty(PROJECT, 'Materials/other.rma') == ['body', 'eyes']
+
+
+def test_painting_and_resizing(tracker, painter):
+    tracker.mark_exported(PROJECT, TARGET, ['body', 'eyes'],
+                          tracker.sequence(PROJECT))
+    painter.active = 'eyes'
+    tracker.dispatcher.emit(Events.LayerStacksModelDataChanged)
+    assert tracker.dirty(PROJECT, TARGET) == ['eyes']
+    painter.states['body'] = '4096x4096 basecolor'
+    assert tracker.dirty(PROJECT, TARGET) == ['body', 'eyes']
+
+
+def test_changed_during_export(tracker):
+    seq = tracker.sequence(PROJECT)
+    tracker.dispatcher.emit(Events.LayerStacksModelDataChanged)
+    tracker.mark_exported(PROJECT, TARGET, ['body', 'eyes'], seq)
+    assert tracker.dirty(PROJECT, TARGET) == ['body']
+
+
+def test_saved_state(tracker, painter):
+    tracker.mark_exported(PROJECT, TARGET, ['body', 'eyes'],
+                          tracker.sequence(PROJECT))
+    del painter.states['eyes']
+    assert tracker.dirty(PROJECT, TARGET) == []
+    tracker.dispatcher.emit(Events.ProjectSaved)
+    with open(tracker.fpath, 'r') as fhdl:
+        data = json.load(fhdl)
+    assert sorted(data['projects'][PROJECT]['states']) == ['body']
+    # a new session starts from the saved state.
+    restored = rfsp.DirtyTracker(
+        tracker.fpath, dispatcher=Dispatcher(), events=Events,
+        project=lambda: PROJECT, active=lambda: painter.active,
+        states=lambda: dict(painter.states))
+    restored.load()
+    assert restored.dirty(PROJECT, TARGET) == []
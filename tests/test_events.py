@@ -0,0 +1,61 @@
+"""Tests of the export events, forwarded to the sinks set in the prefs."""
+import json
+import socket
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5.0)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def sinks(plugin, prefs, listener, tmp_path):
+    prefs['events file'] = str(tmp_path / 'events.jsonl')
+    prefs['events socket'] = '127.0.0.1:%d' % listener.getsockname()[1]
+    sinks = plugin.setup_event_sinks()
+    yield sinks
+    for sink in sinks:
+        rfsp.EVENTS.unsubscribe(sink)
+        sink.close()
+
+
+def test_export_events(project, sinks, prefs, listener):
+    assert [type(s) for s in sinks] == [rfsp.JsonLinesSink, rfsp.SocketSink]
+    assert project.export('robot', 'Materials')
+    with open(prefs['events file'], 'r') as fhdl:
+        logged = [json.loads(line) for line in fhdl]
+    names = [e['event'] for e in logged]
+    assert names[0] == 'export_start' and names[-1] == 'export_end'
+    assert logged[-1]['status'] == 'success'
+    assert names.count('asset_installed') == 2
+    assert names.count('map_converted') == 8
+    stages = [e['stage'] for e in logged if e['event'] == 'stage_end']
+    assert stages.count('build_asset') == 2 and 'install' in stages
+    assert all(e['host'] == socket.gethostname() for e in logged)
+    # the same events were sent to the socket.
+    received = [json.loads(listener.recv(65536).decode('utf-8'))
+                for _ in logged]
+    assert received == logged
+
+
+def test_failed_export_events(project, sinks, prefs, monkeypatch):
+    def _fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(project.host_prefs, 'convert_maps', _fail)
+    with pytest.raises(OSError):
+        project.export('robot', 'Materials')
+    with open(prefs['events file'], 'r') as fhdl:
+        logged = [json.loads(line) for line in fhdl]
+    assert [(e['stage'], e['status']) for e in logged
+            if e['event'] == 'stage_end'] == [('export_maps', 'success'),
+                                               ('build_asset', 'error')]
+    assert logged[-1]['event'] == 'export_end'
+    assert logged[-1]['status'] == 'error'
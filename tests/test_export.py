@@ -0,0 +1,56 @@
+"""Tests of the export, from the map export to the library."""
+import os
+import time
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    """The swatch queue's tasks, which are not run."""
+    tasks = []
+    monkeypatch.setattr(rfsp.SWATCHES, 'submit',
+                        lambda func, *args, **kwargs: tasks.append(func))
+    return tasks
+
+
+def test_export_to_another_category(project, queued, tmp_path):
+    library = tmp_path / 'library'
+    assert project.export('robot', 'Materials')
+    # the journal is only cleaned-up once the swatches are done.
+    assert len(queued) == 1
+    assert project.export('robot', 'Props')
+    for category in ('Materials', 'Props'):
+        assert sorted(os.listdir(str(library / category / 'robot_body.rma'))) \
+            == ['asset.json', 'body_BaseColor.tex', 'body_Metallic.tex',
+                'body_Normal.tex', 'body_Roughness.tex']
+
+
+def stored_blobs(library):
+    store_dir = str(library / rfsp.TextureStore.dirname)
+    return sorted(f for _, _, files in os.walk(store_dir) for f in files
+                  if f.endswith('.tex'))
+
+
+def test_texture_store(project, prefs, tmp_path):
+    prefs['texture store'] = True
+    library = tmp_path / 'library'
+    assert project.export('robot', 'Materials')
+    assert len(stored_blobs(library)) == 8
+    asset_dir = library / 'Materials' / 'robot_body.rma'
+    with open(str(asset_dir / 'body_BaseColor.tex'), 'r') as fhdl:
+        assert fhdl.read() == 'body BaseColor'
+
+
+def test_superseded_export_is_not_stored(project, prefs, tmp_path):
+    prefs['texture store'] = True
+    library = tmp_path / 'library'
+    # a more recent export of the same assets is installed.
+    for name in ('robot_body.rma', 'robot_eyes.rma'):
+        with rfsp.AssetLock(str(library / 'Materials' / name)) as lock:
+            lock.set_stamp(time.time() + 3600.0)
+    assert project.export('robot', 'Materials')
+    assert stored_blobs(library) == []
+    assert not os.path.exists(str(library / 'Materials' / 'robot_body.rma'))
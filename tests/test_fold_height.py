@@ -0,0 +1,74 @@
+"""Tests of the height folded in the normal map."""
+import copy
+import json
+import os
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+with open(os.path.join(rfsp.root_dir(), 'renderman_rules.json'), 'r') as _fhdl:
+    RULES = json.load(_fhdl)
+
+
+@pytest.fixture
+def job(host_prefs, prefs):
+    prefs['fold height'] = True
+    return host_prefs.export_job('robot')
+
+
+def tset(channels):
+    return rfsp.TextureSetInfo('body', False, (256, 256), channels, 1)
+
+
+def test_exported_channels(job):
+    assert rfsp.exported_channels(job, tset(['BaseColor', 'Normal', 'Height'])) \
+        == ['BaseColor', 'Normal']
+    # SP computes the normal map from the height alone.
+    assert rfsp.exported_channels(job, tset(['BaseColor', 'Height'])) == [
+        'BaseColor', 'Normal']
+    assert rfsp.exported_channels(job, tset(['BaseColor'])) == ['BaseColor']
+    job.fold_height = False
+    assert rfsp.exported_channels(job, tset(['BaseColor', 'Height'])) == [
+        'BaseColor', 'Height']
+
+
+def test_drop_maps():
+    config = copy.deepcopy(RULES['export_config'])
+    rfsp.drop_maps(config, ['Height'])
+    for preset, original in zip(config['exportPresets'],
+                                RULES['export_config']['exportPresets']):
+        names = [m['fileName'] for m in preset['maps']]
+        assert names == [m['fileName'] for m in original['maps']
+                         if m['fileName'] != '$textureSet_Height(.$udim)']
+
+
+def test_normal_without_normal_channel(host_prefs, job, tmp_path):
+    job.files.add('body', 'Normal', str(tmp_path / 'body_Normal.png'))
+    chans = host_prefs.textureset_channels(job, tset(['BaseColor', 'Height']))
+    assert list(chans['Normal']) == [str(tmp_path / 'body_Normal.png')]
+    assert 'Height' not in chans
+
+
+def test_export(project, prefs, monkeypatch, tmp_path):
+    prefs['fold height'] = True
+    for texture_set in project.texture_sets:
+        texture_set.channels = texture_set.channels + ['Height']
+    exported = []
+    sp_export = project.sp_export
+
+    def _export(export_path, tsets, **kwargs):
+        files, packed = sp_export(export_path, tsets, **kwargs)
+        exported.extend(os.path.basename(f) for f in files.paths())
+        return files, packed
+    monkeypatch.setattr(project.host_prefs, 'sp_export', _export)
+    assert project.export('robot', 'Materials')
+    # the height map is not exported.
+    assert sorted(exported) == [
+        'body_BaseColor.png', 'body_Metallic.png', 'body_Normal.png',
+        'body_Roughness.png', 'eyes_BaseColor.png', 'eyes_Metallic.png',
+        'eyes_Normal.png', 'eyes_Roughness.png']
+    assert sorted(os.listdir(
+        str(tmp_path / 'library' / 'Materials' / 'robot_body.rma'))) == [
+            'asset.json', 'body_BaseColor.tex', 'body_Metallic.tex',
+            'body_Normal.tex', 'body_Roughness.tex']
@@ -0,0 +1,169 @@
+"""Golden-output regression tests of the graph builder.
+
+The graph of every model in the rules is built for a set of channel
+combinations, with and without UDIMs, and the nodes, params and connections
+are compared with the golden files. Each build is timed. After an intended
+change of the graphs, re-write the golden files with:
+
+    python -m pytest tests/test_golden.py --update-golden
+"""
+import json
+import os
+import time
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+GOLDEN_DIR = os.path.join(rfsp.root_dir(), 'golden')
+RULES_PATH = os.path.join(rfsp.root_dir(), 'renderman_rules.json')
+
+
+class RecordingAsset(object):
+    """A stand-in for RmanAsset that records the graph it is given, so the
+    graph builder can be checked without rman_utils."""
+
+    def __init__(self, assetType='nodeGraph', label=''):
+        self.assetType = assetType
+        self.label = label
+        self.ocio = None
+        self.nodes = []
+        self.params = []
+        self.connections = []
+
+    def addNode(self, nid, nodetype, category, nodeclass):
+        self.nodes.append([nid, nodetype, category, nodeclass])
+
+    def addParam(self, nid, pname, pdict):
+        self.params.append([nid, pname, pdict['type'], pdict['value']])
+
+    def addConnection(self, src, dst):
+        self.connections.append([src, dst])
+
+    def normalized(self):
+        """Returns the recorded graph in a stable order."""
+        return {'nodes': sorted(self.nodes),
+                'params': sorted(self.params, key=json.dumps),
+                'connections': sorted(self.connections)}
+
+
+def golden_cases(rules, compiled, model):
+    """Yields (case name, channels, is_udim, packed) combinations: all
+    mapped channels, none of them, each of them missing and all of them with
+    packed channels. An unmapped channel is always present, as in most
+    texture sets."""
+    mapped = sorted(rules['models'][model]['mapping'])
+    combos = [('all', mapped, {}), ('none', [], {})]
+    combos += [('no_' + ch, [c for c in mapped if c != ch], {})
+               for ch in mapped]
+    # the channels packed by the export, as in SPrefs.pack_channels().
+    packed = dict((ch, comp)
+                  for comp, ch in rules['packing']['channels'].items()
+                  if ch in compiled[model]['packable'] and ch in mapped)
+    if len(packed) >= 2:
+        combos.append(('packed', mapped, packed))
+    for name, chans, packed in combos:
+        for is_udim in (False, True):
+            yield ('%s%s' % (name, '_udim' if is_udim else ''),
+                   chans + ['User0'], is_udim, packed)
+
+
+def golden_json(results):
+    """Format the results with one node, param or connection per line, so
+    the golden files' diffs are readable."""
+    cases = []
+    for case in sorted(results):
+        keys = []
+        for key in ('nodes', 'params', 'connections'):
+            items = ',\n'.join('   ' + json.dumps(item, sort_keys=True)
+                               for item in results[case][key])
+            keys.append('  %s: [\n%s\n  ]' % (json.dumps(key), items)
+                        if items else '  %s: []' % json.dumps(key))
+        cases.append(' %s: {\n%s\n }' % (json.dumps(case), ',\n'.join(keys)))
+    return '{\n%s\n}\n' % ',\n'.join(cases)
+
+
+def build_cases(rules, compiled, model):
+    """Build the model's graph for every case.
+
+    Returns:
+        tuple -- the normalized graphs and the build timings in seconds,
+                 keyed by case.
+    """
+    results, timings = {}, {}
+    for case, chans, is_udim, packed in golden_cases(rules, compiled, model):
+        job = rfsp.ExportJob('golden', model, {'config': 'Off', 'path': None},
+                             bool(packed), rules, compiled[model], None)
+        label = 'golden' if is_udim else 'golden_tset'
+        chans = dict((ch, ()) for ch in chans)
+        maps = [ch for ch in chans
+                if ch in job.bxdf_rules['mapping'] and ch not in packed]
+        if packed:
+            maps.append(rules['packing']['name'])
+        texfiles = dict(
+            (m, '%s_%s%s.tex' % (label, m, '.<UDIM>' if is_udim else ''))
+            for m in maps)
+        # the default tiles of the UDIM maps are skipped.
+        skipped = set(chans) if is_udim else set()
+        start = time.time()
+        agraph, root_node = rfsp.build_graph(job, label, chans, packed,
+                                             texfiles, skipped)
+        agraph.prune(root_node)
+        asset = RecordingAsset(label=label)
+        agraph.apply(asset)
+        timings[case] = time.time() - start
+        results[case] = asset.normalized()
+    return results, timings
+
+
+def diff_case(expected, found):
+    """Returns the lines describing the differences of two graphs."""
+    lines = []
+    for key in ('nodes', 'params', 'connections'):
+        lines += ['- %s %r' % (key, item) for item in expected[key]
+                  if item not in found[key]]
+        lines += ['+ %s %r' % (key, item) for item in found[key]
+                  if item not in expected[key]]
+    return lines
+
+
+with open(RULES_PATH, 'r') as _fhdl:
+    RULES = json.load(_fhdl)
+
+
+def test_rules_are_valid():
+    assert rfsp.validate_rules(RULES) == []
+
+
+@pytest.mark.parametrize('model', sorted(RULES['models']))
+def test_golden(model, request):
+    compiled = rfsp.compile_rules(RULES)
+    results, timings = build_cases(RULES, compiled, model)
+    slowest = max(timings, key=timings.get)
+    print('%-12s %d cases in %.2f ms (slowest: %s %.2f ms)' % (
+        model, len(timings), sum(timings.values()) * 1000.0, slowest,
+        timings[slowest] * 1000.0))
+
+    fpath = os.path.join(GOLDEN_DIR, '%s.json' % model)
+    if request.config.getoption('--update-golden') or \
+            not os.path.exists(fpath):
+        if not os.path.isdir(GOLDEN_DIR):
+            os.makedirs(GOLDEN_DIR)
+        with open(fpath, 'w') as fhdl:
+            fhdl.write(golden_json(results))
+        pytest.skip('wrote %s' % fpath)
+    with open(fpath, 'r') as fhdl:
+        golden = json.load(fhdl)
+    errors = []
+    for case in sorted(set(golden) | set(results)):
+        expected = golden.get(case, None)
+        found = results.get(case, None)
+        if expected == found:
+            continue
+        if expected is None or found is None:
+            errors.append('%s: %s' % (
+                case, 'new case' if expected is None else 'missing case'))
+            continue
+        errors += ['%s: %s' % (case, line)
+                   for line in diff_case(expected, found)]
+    assert not errors, '\n'.join(errors)
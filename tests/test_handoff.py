@@ -0,0 +1,124 @@
+"""Tests of the handoff formats of the intermediate maps.
+
+The export config is checked offline. The benchmark exports the maps in
+each format, converts them with txmake and reports the time spent and the
+disk used by the intermediate files: it needs Substance Painter and
+RenderMan, and runs from Substance Painter's python interpreter with:
+
+    python -m pytest tests/test_handoff.py -s
+"""
+import concurrent.futures
+import copy
+import json
+import os
+import shutil
+import time
+from unittest import mock
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+RULES_PATH = os.path.join(rfsp.root_dir(), 'renderman_rules.json')
+IN_PAINTER = not isinstance(rfsp.spex, mock.Mock)
+# the maps exported as 16 bits by the rules.
+DEPTHS = {'Normal': '16', 'Height': '16'}
+
+
+@pytest.fixture
+def config():
+    with open(RULES_PATH, 'r') as fhdl:
+        return json.load(fhdl)['export_config']
+
+
+def map_depths(config):
+    """Returns the handoff parameters of every map, keyed by preset and
+    file name."""
+    return dict(((p['name'], m['fileName']), m.get('parameters', {}))
+                for p in config['exportPresets'] for m in p['maps'])
+
+
+@pytest.mark.parametrize('fmt', sorted(rfsp.HANDOFF_FORMATS))
+def test_handoff_config(config, fmt):
+    default = [p for p in config['exportPresets']
+               if p['name'] == config['defaultExportPreset']][0]
+    config['exportPresets'].append(rfsp.pack_preset(
+        default, 'packed', 'Packed', {'R': 'Metallic', 'G': 'Roughness'}))
+    rfsp.handoff_config(config, fmt)
+    formats = rfsp.HANDOFF_FORMATS[fmt]
+    for (_, fname), params in map_depths(config).items():
+        channel = rfsp.EXPORTED_CHANNEL.search(fname).group(1)
+        depth = DEPTHS.get(channel, '8')
+        assert (params.get('fileFormat'), params.get('bitDepth')) == \
+            formats[depth], fname
+        if fmt == 'exr':
+            assert params['dithering'] is False
+
+
+def synthetic_mesh(fpath, tiles=1):
+    """Write an obj file with a quad per UDIM tile."""
+    lines = []
+    for tile in range(tiles):
+        lines.extend(['v %d 0 0' % tile, 'v %d 0 0' % (tile + 1),
+                      'v %d 1 0' % (tile + 1), 'v %d 1 0' % tile])
+    for tile in range(tiles):
+        lines.extend(['vt %d 0' % tile, 'vt %d 0' % (tile + 1),
+                      'vt %d 1' % (tile + 1), 'vt %d 1' % tile])
+    lines.append('vn 0 0 1')
+    for tile in range(tiles):
+        idx = [tile * 4 + i for i in range(1, 5)]
+        lines.append('f ' + ' '.join('%d/%d/1' % (i, i) for i in idx))
+    with open(fpath, 'w') as fhdl:
+        fhdl.write('\n'.join(lines) + '\n')
+
+
+@pytest.mark.skipif(not IN_PAINTER or 'RMANTREE' not in os.environ,
+                    reason='needs Substance Painter and RenderMan')
+def test_handoff_benchmark(config, tmp_path, resolution=2048, tiles=4):
+    """The opened project is used. If none is, a synthetic project with one
+    quad per UDIM tile is created: its channels are flat, so the timings
+    show the fixed costs of each format."""
+    spp, spts, spex = rfsp.spp, rfsp.spts, rfsp.spex
+    if not spp.is_open():
+        mesh = str(tmp_path / 'synthetic.obj')
+        synthetic_mesh(mesh, tiles)
+        spp.create(mesh, settings=spp.Settings(
+            default_texture_resolution=resolution,
+            project_workflow=spp.ProjectWorkflow.UVTile))
+        rfsp.wait_for_project()
+    binary = os.path.join(os.environ['RMANTREE'], 'bin', rfsp.app('txmake'))
+    jobs = os.cpu_count() or 1
+    report = {}
+    for fmt in sorted(rfsp.HANDOFF_FORMATS):
+        out_dir = str(tmp_path / fmt)
+        fmt_config = copy.deepcopy(config)
+        fmt_config['exportPath'] = out_dir
+        fmt_config['exportList'] = [{'rootPath': ts.name()}
+                                    for ts in spts.all_texture_sets()]
+        rfsp.handoff_config(fmt_config, fmt)
+        start = time.time()
+        result = spex.export_project_textures(fmt_config)
+        assert result.status == spex.ExportStatus.Success, result.message
+        exported = time.time()
+        fpaths = [f for texs in result.textures.values() for f in texs if f]
+        assert fpaths
+        exts = set(os.path.splitext(f)[1].lstrip('.') for f in fpaths)
+        assert exts == set([fmt]), 'exported %s files' % sorted(exts)
+        nbytes = sum(os.path.getsize(f) for f in fpaths)
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            returncodes = list(pool.map(
+                lambda f: rfsp.run_txmake(
+                    [binary, '-resize', 'round-', '-format', 'openexr',
+                     '-compression', 'pxr24', f,
+                     os.path.splitext(f)[0] + '.tex'])[0], fpaths))
+        assert not any(returncodes), '%s: txmake failed' % fmt
+        report[fmt] = {'export': exported - start,
+                       'txmake': time.time() - exported,
+                       'maps': len(fpaths), 'bytes': nbytes}
+        shutil.rmtree(out_dir, ignore_errors=True)
+    for fmt, res in sorted(report.items()):
+        print('handoff: %s  export %6.2f s  txmake %6.2f s  total %6.2f s  '
+              '%4d maps  %8.1f MB' % (
+                  fmt, res['export'], res['txmake'],
+                  res['export'] + res['txmake'], res['maps'],
+                  res['bytes'] / 1048576.0))
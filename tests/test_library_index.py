@@ -0,0 +1,137 @@
+"""Tests of the library index."""
+import json
+import os
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+
+def make_asset(category_dir, name):
+    asset_dir = os.path.join(category_dir, name + '.rma')
+    os.makedirs(asset_dir)
+    with open(os.path.join(asset_dir, 'asset.json'), 'w') as fhdl:
+        json.dump({'RenderManAsset': {'label': name}}, fhdl)
+    return asset_dir
+
+
+@pytest.fixture
+def library(tmp_path):
+    category_dir = str(tmp_path / 'Materials')
+    for idx in range(200):
+        make_asset(category_dir, 'asset%03d' % idx)
+    return str(tmp_path), category_dir
+
+
+def scan_category(cfg, categorypath):
+    """A stand-in for the preset browser's asset lister."""
+    return []
+
+
+@pytest.fixture
+def rman_utils(rman_utils):
+    rman_utils.rman_assets.lib.getAssetList = scan_category
+    return rman_utils
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    calls = []
+    read_asset_info = rfsp.read_asset_info
+
+    def _counted(asset_dir):
+        calls.append(asset_dir)
+        return read_asset_info(asset_dir)
+    monkeypatch.setattr(rfsp, 'read_asset_info', _counted)
+    return calls
+
+
+def test_listing_is_cached(library, reads):
+    root, category_dir = library
+    index = rfsp.LibraryIndex(root)
+    assert len(index.find(category_dir)) == 200
+    assert len(reads) == 200
+    index.save()
+    # a new session reads the index file, not the assets.
+    index = rfsp.LibraryIndex(root)
+    found = index.find(category_dir)
+    assert len(reads) == 200
+    assert found[0] == os.path.join(category_dir, 'asset000.rma')
+
+
+def test_install_only_reads_the_new_asset(library, reads):
+    root, category_dir = library
+    index = rfsp.LibraryIndex(root)
+    index.find(category_dir)
+    del reads[:]
+    before = os.stat(category_dir).st_mtime
+    asset_dir = make_asset(category_dir, 'new')
+    index.update_asset(asset_dir, before)
+    assert reads == [asset_dir]
+    assert len(index.find(category_dir)) == 201
+    assert len(reads) == 1
+    assert index.category(category_dir)['new.rma']['label'] == 'new'
+
+
+def test_external_change_rescans(library):
+    root, category_dir = library
+    index = rfsp.LibraryIndex(root)
+    index.find(category_dir)
+    make_asset(category_dir, 'other')
+    # make sure the mtime differs on file systems with a coarse resolution.
+    mtime = os.stat(category_dir).st_mtime + 10
+    os.utime(category_dir, (mtime, mtime))
+    assert len(index.find(category_dir)) == 201
+
+
+def test_install_after_other_changes(library):
+    """Another artist installed an asset since the last scan: our install
+    doesn't hide it."""
+    root, category_dir = library
+    index = rfsp.LibraryIndex(root)
+    index.find(category_dir)
+    make_asset(category_dir, 'other')
+    mtime = os.stat(category_dir).st_mtime + 10
+    os.utime(category_dir, (mtime, mtime))
+    before = os.stat(category_dir).st_mtime
+    index.update_asset(make_asset(category_dir, 'new'), before)
+    found = index.find(category_dir)
+    assert os.path.join(category_dir, 'other.rma') in found
+    assert os.path.join(category_dir, 'new.rma') in found
+
+
+def test_save_merges_other_sessions(library, reads):
+    root, category_dir = library
+    index = rfsp.LibraryIndex(root)
+    index.find(category_dir)
+    index.save()
+    mine, theirs = rfsp.LibraryIndex(root), rfsp.LibraryIndex(root)
+    for index, name in ((mine, 'mine'), (theirs, 'theirs')):
+        before = os.stat(category_dir).st_mtime
+        index.update_asset(make_asset(category_dir, name), before)
+    theirs.save()
+    mine.save()
+    assets = mine.data['categories']['Materials']['assets']
+    assert 'mine.rma' in assets and 'theirs.rma' in assets
+    del reads[:]
+    index = rfsp.LibraryIndex(root)
+    assert len(index.find(category_dir)) == 202
+    # both sessions changed the category: it is re-scanned once.
+    assert len(reads) == 202
+    index.save()
+    del reads[:]
+    rfsp.LibraryIndex(root).find(category_dir)
+    assert reads == []
+
+
+def test_reload_restores_asset_list(plugin, rman_utils):
+    ral = rman_utils.rman_assets.lib
+    assert ral.getAssetList is not scan_category
+    assert ral.getAssetList.__wrapped__ is scan_category
+    plugin.cleanup()
+    assert ral.getAssetList is scan_category
+    # a reloaded plugin wraps the preset browser's lister, not ours.
+    plugin.build_panel()
+    assert ral.getAssetList.__wrapped__ is scan_category
+    plugin.cleanup()
+    assert ral.getAssetList is scan_category
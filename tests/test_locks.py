@@ -0,0 +1,88 @@
+"""Stress test of the asset locks.
+
+Processes lock the same few assets of a library directory: the locks must
+be exclusive and no update may be lost. The library is a temporary
+directory: set RFSP_LOCK_DIR to test a shared file system, i.e.
+
+    RFSP_LOCK_DIR=/path/to/library/tmp python -m pytest tests/test_locks.py
+"""
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def lock_worker(library_dir, assets, rounds):
+    """Lock random assets and check nobody else is in the critical
+    section. Runs in a separate python process."""
+    overlaps = 0
+    for _ in range(rounds):
+        asset_dir = os.path.join(library_dir,
+                                 'asset%d.rma' % random.randrange(assets))
+        stamp = time.time()
+        with rfsp.AssetLock(asset_dir, stale=5.0) as lock:
+            busy = os.path.join(library_dir,
+                                os.path.basename(asset_dir) + '.busy')
+            try:
+                os.close(os.open(busy, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except OSError:
+                overlaps += 1
+            count_file = os.path.join(library_dir,
+                                      os.path.basename(asset_dir) + '.count')
+            try:
+                with open(count_file, 'r') as fhdl:
+                    count = int(fhdl.read())
+            except (OSError, IOError, ValueError):
+                count = 0
+            time.sleep(random.random() * 0.01)
+            with open(count_file, 'w') as fhdl:
+                fhdl.write(str(count + 1))
+            if not lock.superseded(stamp):
+                lock.set_stamp(stamp)
+            os.remove(busy)
+    print(json.dumps({'overlaps': overlaps}))
+
+
+@pytest.fixture
+def library_dir(tmp_path):
+    shared = os.environ.get('RFSP_LOCK_DIR', None)
+    if not shared:
+        yield str(tmp_path)
+        return
+    dir_path = os.path.join(shared, 'rfsp_locks_%d' % os.getpid())
+    os.makedirs(dir_path)
+    yield dir_path
+    shutil.rmtree(dir_path, ignore_errors=True)
+
+
+def test_lock_stress(library_dir, processes=8, assets=3, rounds=25):
+    # the workers import the plugin like the tests do.
+    code = ('import sys; sys.path.insert(0, %r); import conftest, test_locks; '
+            'test_locks.lock_worker(%r, %d, %d)' % (TESTS_DIR, library_dir,
+                                                     assets, rounds))
+    procs = [subprocess.Popen([sys.executable, '-c', code],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+             for _ in range(processes)]
+    overlaps = 0
+    for proc in procs:
+        out, err = proc.communicate()
+        assert proc.returncode == 0, err
+        overlaps += json.loads(out.strip().splitlines()[-1])['overlaps']
+    counted = 0
+    for idx in range(assets):
+        count_file = os.path.join(library_dir, 'asset%d.rma.count' % idx)
+        if os.path.exists(count_file):
+            with open(count_file, 'r') as fhdl:
+                counted += int(fhdl.read())
+    assert overlaps == 0
+    assert counted == processes * rounds
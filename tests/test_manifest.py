@@ -0,0 +1,80 @@
+"""Tests of the manifest of the exported maps."""
+import json
+import os
+import tempfile
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+EXPORT_DIR = os.path.join(os.sep, 'export', 'exported')
+
+
+def udim_paths(prefix, tiles, ext='.png'):
+    return [os.path.join(EXPORT_DIR, '%s.%d%s' % (prefix, tile, ext))
+            for tile in tiles]
+
+
+@pytest.fixture
+def manifest():
+    manifest = rfsp.ExportManifest()
+    for fpath in udim_paths('body_BaseColor', (1001, 1002, 1011)):
+        manifest.add('body', 'BaseColor', fpath)
+    manifest.add('eyes', 'BaseColor', os.path.join(EXPORT_DIR,
+                                                   'eyes_BaseColor.png'))
+    # a file that doesn't follow the naming of the first one.
+    manifest.add('body', 'BaseColor', os.path.join(EXPORT_DIR, 'extra.exr'))
+    return manifest
+
+
+def test_udim_tiles(manifest):
+    mfiles = manifest['body']['BaseColor']
+    expected = udim_paths('body_BaseColor', (1001, 1002, 1011)) + [
+        os.path.join(EXPORT_DIR, 'extra.exr')]
+    assert list(mfiles) == expected
+    assert len(mfiles) == 4
+    assert [mfiles[i] for i in range(4)] == expected
+    assert mfiles[-1] == expected[-1]
+    assert list(mfiles.tiles) == [1001, 1002, 1011]
+    assert mfiles.extra == [expected[-1]]
+
+
+def test_single_tile(manifest):
+    assert list(manifest['eyes']['BaseColor']) == [
+        os.path.join(EXPORT_DIR, 'eyes_BaseColor.png')]
+    assert 'eyes' in manifest and 'arms' not in manifest
+    assert manifest.get('arms', {}) == {}
+
+
+def test_shared_directory(manifest):
+    # the directory is stored once for all maps.
+    assert manifest['body']['BaseColor'].dir is \
+        manifest['eyes']['BaseColor'].dir
+
+
+def test_json_round_trip(manifest):
+    data = json.loads(json.dumps(manifest.to_json()))
+    assert data['dirs'] == [EXPORT_DIR]
+    loaded = rfsp.ExportManifest.from_json(data)
+    assert sorted(loaded.paths()) == sorted(manifest.paths())
+    for tset in ('body', 'eyes'):
+        assert list(loaded[tset]['BaseColor']) == \
+            list(manifest[tset]['BaseColor'])
+
+
+def test_journal_checks_the_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    journal = rfsp.ExportJournal('robot.spp', ['robot'])
+    journal.start({'path': 'robot.spp', 'mtime': 0.0})
+    manifest = rfsp.ExportManifest()
+    for fpath in udim_paths('body_BaseColor', (1001, 1002)):
+        fpath = str(tmp_path / os.path.basename(fpath))
+        with open(fpath, 'w') as fhdl:
+            fhdl.write('texels')
+        manifest.add('body', 'BaseColor', fpath)
+    journal.set_exported(manifest, {'body': {'Roughness': 'R'}})
+    files, packed = journal.exported()
+    assert list(files.paths()) == list(manifest.paths())
+    assert packed == {'body': {'Roughness': 'R'}}
+    os.remove(str(tmp_path / 'body_BaseColor.1002.png'))
+    assert journal.exported() is None
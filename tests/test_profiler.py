@@ -0,0 +1,58 @@
+"""Tests of the profiling mode."""
+import os
+import tracemalloc
+
+import renderman_for_sp as rfsp
+
+
+class FakePrefs(dict):
+
+    def __init__(self, fpath, **prefs):
+        super(FakePrefs, self).__init__(prefs)
+        self.file = fpath
+
+
+def allocate():
+    return [bytearray(1024) for _ in range(1000)]
+
+
+def test_stages(tmp_path):
+    profiler = rfsp.Profiler()
+    profiler.configure(FakePrefs(str(tmp_path / 'renderman.prefs'),
+                                 profiling=True))
+    with profiler.stage('export'):
+        with profiler.stage('maps'):
+            data = allocate()
+    del data
+    fnames = sorted(os.listdir(profiler.dir))
+    assert [f[21:] for f in fnames] == [
+        '00_export.prof', '00_export.tracemalloc',
+        '01_maps.prof', '01_maps.tracemalloc']
+    assert not tracemalloc.is_tracing()
+
+    # the allocations of the profiler itself are not in the snapshots.
+    first, last = rfsp.Profiler._lines()
+    assert first > 0
+    fname = rfsp.Profiler._save.__code__.co_filename
+    snapshot = tracemalloc.Snapshot.load(
+        os.path.join(profiler.dir, fnames[3]))
+    frames = [stat.traceback[0] for stat in snapshot.statistics('lineno')]
+    assert frames
+    assert not [f for f in frames
+                if f.filename == fname and first <= f.lineno <= last]
+    assert allocate.__code__.co_filename in set(f.filename for f in frames)
+
+
+def test_retention(tmp_path):
+    profiler = rfsp.Profiler()
+    profiler.configure(FakePrefs(str(tmp_path / 'renderman.prefs'),
+                                 profiling=True, **{'profiling keep': 2}))
+    os.makedirs(profiler.dir)
+    for session in ('20200101_000000_0001', '20200102_000000_0001',
+                    '20200103_000000_0001'):
+        for ext in ('prof', 'tracemalloc'):
+            open(os.path.join(profiler.dir, '%s_00_export.%s' % (
+                session, ext)), 'w').close()
+    profiler.cleanup()
+    assert sorted(set(f[:20] for f in os.listdir(profiler.dir))) == [
+        '20200102_000000_0001', '20200103_000000_0001']
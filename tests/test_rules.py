@@ -0,0 +1,116 @@
+"""Tests of the rules validation and compilation."""
+import copy
+import json
+import os
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+with open(os.path.join(rfsp.root_dir(), 'renderman_rules.json'), 'r') as _fhdl:
+    RULES = json.load(_fhdl)
+
+
+@pytest.fixture
+def rules():
+    return copy.deepcopy(RULES)
+
+
+def test_valid(rules):
+    assert rfsp.validate_rules(rules) == []
+    assert set(rfsp.compile_rules(rules)) == set(rules['models'])
+
+
+def test_no_model():
+    assert rfsp.validate_rules({}) == [
+        "rules: 'models' should be a dict", 'rules.models: no model defined',
+        "rules: 'export_config' should be a dict"]
+
+
+def test_missing_key(rules):
+    del rules['models']['PxrDisney']['mapping']['Roughness']['ocio']
+    assert rfsp.validate_rules(rules) == [
+        "rules.models.PxrDisney.mapping.Roughness: 'ocio' is missing"]
+
+
+def test_invalid_type(rules):
+    rules['models']['PxrDisney']['mapping']['Roughness']['type'] = 'int'
+    errors = rfsp.validate_rules(rules)
+    assert len(errors) == 1
+    assert errors[0].startswith(
+        "rules.models.PxrDisney.mapping.Roughness: invalid type 'int'")
+
+
+def test_null_param_with_type(rules):
+    # it would compile to a connection to '<bxdf>.None'.
+    rules['models']['PxrDisney']['mapping']['Roughness']['param'] = None
+    assert rfsp.validate_rules(rules) == [
+        'rules.models.PxrDisney.mapping.Roughness: a null param requires a '
+        'null type']
+
+
+def test_texture_only_channel(rules):
+    mapping = rules['models']['PxrDisney']['mapping']['Roughness']
+    mapping['param'] = mapping['type'] = None
+    assert rfsp.validate_rules(rules) == []
+    assert 'Roughness' not in rfsp.compile_rules(rules)['PxrDisney']['direct']
+
+
+def test_invalid_default(rules):
+    rules['models']['PxrDisney']['mapping']['Metallic']['default'] = [2, 0, 0]
+    assert rfsp.validate_rules(rules) == [
+        'rules.models.PxrDisney.mapping.Metallic: default should be a list '
+        'of 3 or 4 values between 0 and 1']
+
+
+def test_malformed_presets(rules):
+    presets = rules['export_config']['exportPresets']
+    presets[0]['maps'].append('body_Normal')
+    presets[0]['maps'][0]['channels'].append(None)
+    presets.append(['not', 'a', 'preset'])
+    errors = rfsp.validate_rules(rules)
+    assert 'rules.export_config.exportPresets[0].maps[%d]: should be a dict' \
+        % (len(presets[0]['maps']) - 1) in errors
+    assert 'rules.export_config.exportPresets[0].maps[0].channels[%d]: should ' \
+        'be a dict' % (len(presets[0]['maps'][0]['channels']) - 1) in errors
+    assert 'rules.export_config.exportPresets[%d]: should be a dict' \
+        % (len(presets) - 1) in errors
+
+
+def write_rules(fpath, rules):
+    with open(fpath, 'w') as fhdl:
+        json.dump(rules, fhdl)
+
+
+def test_reload_keeps_one_version(rules, tmp_path):
+    fpath = str(tmp_path / 'rules.json')
+    loader = rfsp.Rules(fpath)
+    for roughness in ('data', 'srgb_texture'):
+        rules['models']['PxrDisney']['mapping']['Roughness']['ocio'] = \
+            roughness
+        write_rules(fpath, rules)
+        # don't depend on the file system's mtime resolution.
+        loader._stamp = None
+        loader.check('PxrDisney')
+        assert loader.get()['models']['PxrDisney']['mapping']['Roughness'][
+            'ocio'] == roughness
+    assert list(loader._cache) == [loader.key]
+
+
+def test_invalid_on_first_load(rules, tmp_path):
+    fpath = str(tmp_path / 'rules.json')
+    del rules['models']['PxrDisney']['mapping']['Roughness']['ocio']
+    write_rules(fpath, rules)
+    loader = rfsp.Rules(fpath)
+    with pytest.raises(rfsp.RulesError) as err:
+        loader.check()
+    assert err.value.errors == [
+        "rules.models.PxrDisney.mapping.Roughness: 'ocio' is missing"]
+
+
+def test_export_job_reports_invalid_rules(host_prefs, tmp_path):
+    fpath = str(tmp_path / 'rules.json')
+    write_rules(fpath, {'models': {}})
+    host_prefs._rules = rfsp.Rules(fpath)
+    with pytest.raises(rfsp.RulesError):
+        host_prefs.export_job('robot')
@@ -0,0 +1,57 @@
+"""Tests of the texture store."""
+import os
+import time
+
+import renderman_for_sp as rfsp
+
+
+def make_texture(dir_path, name, content):
+    fpath = os.path.join(dir_path, name)
+    with open(fpath, 'wb') as fhdl:
+        fhdl.write(content)
+    # the maps were written a while ago.
+    old = time.time() - 7200.0
+    os.utime(fpath, (old, old))
+    return fpath
+
+
+def test_put_refreshes_mtime(tmp_path):
+    store = rfsp.TextureStore(str(tmp_path))
+    digest = store.put(make_texture(str(tmp_path), 'a.tex', b'texels'))
+    blob = store.blob_path(digest)
+    assert time.time() - os.path.getmtime(blob) < 60.0
+    old = time.time() - 7200.0
+    os.utime(blob, (old, old))
+    # storing the same texture again keeps the blob for the grace period.
+    assert store.put(make_texture(str(tmp_path), 'b.tex', b'texels')) == digest
+    assert time.time() - os.path.getmtime(blob) < 60.0
+    assert store.gc(grace=3600.0) == (0, 0)
+    assert os.path.exists(blob)
+
+
+def test_gc_removes_unused(tmp_path):
+    store = rfsp.TextureStore(str(tmp_path))
+    asset_dir = str(tmp_path / 'Materials' / 'used.rma')
+    os.makedirs(asset_dir)
+    make_texture(asset_dir, 'used.tex', b'used')
+    refs = store.ingest(asset_dir)
+    unused = store.put(make_texture(str(tmp_path), 'unused.tex', b'unused'))
+    assert store.gc(grace=-1.0) == (1, len(b'unused'))
+    assert not os.path.exists(store.blob_path(unused))
+    assert os.path.exists(store.blob_path(refs['used.tex']))
+
+
+def test_replace_asset_with_stored_textures(tmp_path):
+    store = rfsp.TextureStore(str(tmp_path))
+    category_dir = str(tmp_path / 'Materials')
+    for _ in range(2):
+        staged = str(tmp_path / 'staging' / 'asset.rma')
+        os.makedirs(staged)
+        make_texture(staged, 'basecolor.tex', b'texels')
+        store.ingest(staged)
+        os.makedirs(category_dir, exist_ok=True)
+        rfsp.replace_asset(staged, category_dir, store)
+    asset_dir = os.path.join(category_dir, 'asset.rma')
+    assert os.listdir(category_dir) == ['asset.rma']
+    with open(os.path.join(asset_dir, 'basecolor.tex'), 'rb') as fhdl:
+        assert fhdl.read() == b'texels'
@@ -0,0 +1,68 @@
+"""Tests of the swatch cache, with a stand-in render command."""
+import os
+import sys
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+# writes the swatch and counts the renders.
+RENDER = ('import sys; open(sys.argv[1], "w").write("swatch"); '
+          'open(sys.argv[2], "a").write("+")')
+
+
+@pytest.fixture
+def renders(project, prefs, tmp_path):
+    counter = str(tmp_path / 'renders.txt')
+    prefs['swatch mode'] = 'render'
+    prefs['swatch command'] = [sys.executable, '-c', RENDER, '{output}',
+                               counter]
+    project.host_prefs.swatch_cache = str(tmp_path / 'swatches')
+
+    def _count():
+        if not os.path.exists(counter):
+            return 0
+        with open(counter, 'r') as fhdl:
+            return len(fhdl.read())
+    return _count
+
+
+def swatch(tmp_path, category, asset):
+    fpath = str(tmp_path / 'library' / category / asset / rfsp.SWATCH_FILE)
+    with open(fpath, 'r') as fhdl:
+        return fhdl.read()
+
+
+def test_unchanged_maps_use_the_cache(project, renders, tmp_path):
+    assert project.export('robot', 'Materials', preview='std')
+    assert renders() == 2
+    assert len(os.listdir(str(tmp_path / 'swatches'))) == 2
+    assert project.export('robot', 'Props', preview='std')
+    assert renders() == 2
+    for category in ('Materials', 'Props'):
+        for asset in ('robot_body.rma', 'robot_eyes.rma'):
+            assert swatch(tmp_path, category, asset) == 'swatch'
+
+
+def test_changed_maps_are_rendered(project, renders, tmp_path, monkeypatch):
+    assert project.export('robot', 'Materials', preview='std')
+    sp_export = project.sp_export
+
+    def _painted(export_path, tsets, **kwargs):
+        files, packed = sp_export(export_path, tsets, **kwargs)
+        with open(files['eyes']['BaseColor'][0], 'a') as fhdl:
+            fhdl.write(' painted')
+        return files, packed
+    monkeypatch.setattr(project.host_prefs, 'sp_export', _painted)
+    assert project.export('robot', 'Props', preview='std')
+    assert renders() == 3
+
+
+def test_settings_are_part_of_the_key(tmp_path):
+    fpath = str(tmp_path / 'body_BaseColor.png')
+    with open(fpath, 'w') as fhdl:
+        fhdl.write('texels')
+    key = rfsp.swatch_key('flat', 100, None, [fpath])
+    assert rfsp.swatch_key('flat', 100, None, [fpath]) == key
+    assert rfsp.swatch_key('flat', 200, None, [fpath]) != key
+    assert rfsp.swatch_key('render', 100, ['render'], [fpath]) != key
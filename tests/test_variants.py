@@ -0,0 +1,63 @@
+"""Tests of the lower resolution variants of the textures."""
+import os
+import shutil
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+
+@pytest.fixture
+def scaled(monkeypatch):
+    """Copies the maps instead of scaling them. The maps in 'unreadable'
+    can't be scaled."""
+    unreadable = []
+
+    def _scaled(src, fpaths):
+        if os.path.basename(src) in unreadable:
+            return False
+        for fpath in fpaths:
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            shutil.copyfile(src, fpath)
+        return True
+    monkeypatch.setattr(rfsp, 'scaled_variants', _scaled)
+    return unreadable
+
+
+def variants_metadata(rman_utils):
+    asset = rman_utils.rman_assets.core.RmanAsset.return_value
+    return [c[0][1] for c in asset.addMetadata.call_args_list
+            if c[0][0] == 'textureVariants']
+
+
+def test_variants(project, prefs, scaled, rman_utils, tmp_path):
+    prefs['resolution variants'] = 2
+    assert project.export('robot', 'Materials')
+    assert variants_metadata(rman_utils) == [{'1/2': 'res2', '1/4': 'res4'}] * 2
+    asset_dir = tmp_path / 'library' / 'Materials' / 'robot_body.rma'
+    assert sorted(os.listdir(str(asset_dir / 'res4'))) == [
+        'body_BaseColor.tex', 'body_Metallic.tex', 'body_Normal.tex',
+        'body_Roughness.tex']
+
+
+def test_unreadable_map(project, prefs, scaled, rman_utils):
+    prefs['resolution variants'] = 2
+    scaled.append('eyes_Normal.png')
+    assert project.export('robot', 'Materials')
+    # the eyes have no complete variant.
+    assert variants_metadata(rman_utils) == [{'1/2': 'res2', '1/4': 'res4'}]
+
+
+def test_unreadable_handoff_format(project, prefs, scaled, rman_utils):
+    prefs.update({'resolution variants': 2, 'handoff format': 'exr'})
+    assert project.export('robot', 'Materials')
+    assert variants_metadata(rman_utils) == []
+
+
+def test_converted_variants(tmp_path):
+    for fpath in ('a.tex', 'b.tex', 'res2/a.tex', 'res2/b.tex', 'res4/a.tex'):
+        fpath = tmp_path / fpath
+        fpath.parent.mkdir(exist_ok=True)
+        fpath.write_text('tex')
+    assert rfsp.converted_variants(str(tmp_path), 3) == {'1/2': 'res2'}
+    assert rfsp.converted_variants(str(tmp_path), 0) == {}
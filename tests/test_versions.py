@@ -0,0 +1,55 @@
+"""Tests of the asset versions."""
+import os
+
+import pytest
+
+import renderman_for_sp as rfsp
+
+
+def stage_asset(tmp_path, textures):
+    src = tmp_path / 'staging' / 'asset.rma'
+    os.makedirs(str(src))
+    (src / 'asset.json').write_text('{}')
+    for name, content in textures.items():
+        (src / name).write_bytes(content)
+    return str(src)
+
+
+@pytest.fixture(params=['symlink', 'rename'])
+def versions(request, tmp_path, monkeypatch):
+    if request.param == 'rename':
+        monkeypatch.setattr(rfsp, 'supports_symlinks', lambda dir_path: False)
+    elif not rfsp.supports_symlinks(str(tmp_path)):
+        pytest.skip('no symbolic links')
+    category_dir = tmp_path / 'Materials'
+    category_dir.mkdir()
+    return rfsp.AssetVersions(str(category_dir / 'asset.rma'))
+
+
+def test_install(tmp_path, versions):
+    textures = {'a.tex': b'a1', 'b.tex': b'b1'}
+    for idx in range(4):
+        if idx:
+            textures['b.tex'] = b'b%d' % (idx + 1)
+        versions.install(stage_asset(tmp_path, textures), keep=2)
+        assert versions.current_version() == idx + 1
+        assert (os.path.islink(versions.current) ==
+                rfsp.supports_symlinks(versions.dir))
+    with open(os.path.join(versions.current, 'b.tex'), 'rb') as fhdl:
+        assert fhdl.read() == b'b4'
+    # the unchanged texture is shared with the previous version.
+    previous = versions.version_dir(3)
+    assert os.path.samefile(os.path.join(versions.current, 'a.tex'),
+                            os.path.join(previous, 'a.tex'))
+    assert not os.path.samefile(os.path.join(versions.current, 'b.tex'),
+                                os.path.join(previous, 'b.tex'))
+    assert set(versions.digests(4)) == {'a.tex', 'b.tex'}
+    assert len(os.listdir(versions.dir)) <= 3
+
+
+def test_unversioned_asset(tmp_path, versions):
+    os.rename(stage_asset(tmp_path, {'a.tex': b'a1'}), versions.current)
+    versions.install(stage_asset(tmp_path, {'a.tex': b'a2'}))
+    assert versions.current_version() == 2
+    with open(os.path.join(versions.version_dir(1), 'a.tex'), 'rb') as fhdl:
+        assert fhdl.read() == b'a1'